@@ -1,15 +1,39 @@
+import os
+
 import dash
+import dash_ag_grid as dag
 import dash_bootstrap_components as dbc
-from dash import html, dcc, Input, Output, callback
+import dash_leaflet as dl
+from dash import html, dcc, Input, Output, State, MATCH, callback, clientside_callback, ClientsideFunction
+from dash.exceptions import PreventUpdate
+from flask import Response, abort, request
+import numpy as np
+import pandas as pd
 import plotly.graph_objects as go
-from funciones import obtener_datos, auxiliares_salud, casas_salud, parteras, total_unidades_salud
+from plotly.colors import qualitative
+import datos
+import exportar
+import mapa
+import rejilla
+from caches import cacheado, configurar_cache, estadisticas, figuras
+from funciones import (ENTIDAD_PREDETERMINADA, ENTIDADES, ETIQUETAS_EDAD, GRUPOS_EDAD, NIVELES, SEXOS,
+                       metricas_localidad)
+from instrumentacion import instalar, medido, perfilable
+
+# Generar todas las figuras al iniciar
+PRECALENTAR_FIGURAS = os.environ.get("DASH_MPIOS_PRECALENTAR", "0") == "1"
+# Dibujar el gráfico de sexo y las tarjetas de población en el navegador
+# (assets/clientside.js) en lugar de pedirlos al servidor en cada cambio
+CALLBACKS_CLIENTE = os.environ.get("DASH_MPIOS_CLIENTSIDE", "1") == "1"
+# Segundos entre revisiones de cambios en assets/docs (0 desactiva la recarga)
+INTERVALO_RECARGA = float(os.environ.get("DASH_MPIOS_RECARGA", 30))
+# Responder en cuanto se importa la app y cargar los agregados en segundo plano
+ARRANQUE_DIFERIDO = os.environ.get("DASH_MPIOS_ARRANQUE_DIFERIDO", "0") == "1"
 
-# Obtener datos
-df_agrupado, municipios = obtener_datos()
-total_auxiliares = None  # Inicializar variable para evitar errores si no se carga el DataFrame
-if df_agrupado is None:
-    raise ValueError("No se pudieron cargar los datos del archivo parquet.")
-total_auxiliares = auxiliares_salud()
+# Obtener datos: población e indicadores precalculados por municipio
+# (con arranque diferido la carga se inicia al final del módulo)
+if not ARRANQUE_DIFERIDO:
+    datos.actual()
 
 
 MAPEO_CASAS_SALUD = {
@@ -18,6 +42,8 @@ MAPEO_CASAS_SALUD = {
     'CE': {'code': 'CE', 'name': 'Construida Equipada', 'color': '#e15759'},
     'CSE': {'code': 'CSE', 'name': 'Construida sin Equipar', 'color': '#76b7b2'}
 }
+
+
 # Configuración de recursos externos
 external_stylesheets = [
     dbc.themes.SLATE,
@@ -26,6 +52,22 @@ external_stylesheets = [
 ]
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+configurar_cache(app.server)
+# Server-Timing y /metrics (sólo con DASH_MPIOS_METRICAS=1)
+instalar(app.server, estadisticas)
+
+
+@app.server.route('/estado-cache')
+def estado_cache():
+    # Aciertos y fallos de la cache de respuestas por sección
+    return estadisticas()
+
+
+@app.server.route('/listo')
+def listo():
+    # Disponibilidad: 200 cuando los agregados están cargados, 503 mientras cargan
+    estado = datos.estado()
+    return estado, 200 if estado["estado"] == "listo" else 503
 
 # Estilos personalizados
 CUSTOM_STYLE = {
@@ -66,73 +108,133 @@ navbar = dbc.Navbar(
     }
 )
 
-# Fila de filtros
-filtros_row = dbc.Row(
-    dbc.Col(
-        dbc.Card(
-            dbc.CardBody([
-                dbc.Row([
-                    dbc.Col([
-                        html.Label("Municipio", 
-                                 className="text-white-50 mb-2",
-                                 style={"fontWeight": 300}),
-                        dcc.Dropdown(
-                            id="dropdown-selector",
-                            options=[{"label": mun, "value": mun} for mun in municipios],
-                            value=municipios[0] if len(municipios) > 0 else None,
-                            clearable=False,
-                            searchable=True,
-                            style={
-                                "color": "#5B7389", 
-                                "fontWeight": 300,
-                                "backgroundColor": "#f8f9fa"
-                            },
-                        ),
-                        html.Small(
-                            "Selecciona un municipio para filtrar los datos",
-                            className="text-muted d-block mt-1",
-                            style={"fontWeight": 300}
-                        )
-                    ], md=6, className="pe-3"),
-                    
-                    dbc.Col([
-                        html.Label("Opciones de visualización", 
-                                 className="text-white-50 mb-2",
-                                 style={"fontWeight": 300}),
-                        dbc.Checklist(
-                            options=[
-                                {"label": " Mostrar gráficos", "value": 1},
-                                {"label": " Mostrar datos brutos", "value": 2}
-                            ],
-                            value=[1],
-                            id="switches-input",
-                            switch=True,
-                            labelStyle={
-                                "fontWeight": 300,
-                                "color": "white",
-                                "marginRight": "15px"
-                            },
-                            inline=True
-                        )
-                    ], md=6)
-                ])
-            ]),
-            className="bg-dark mb-4",
-            style={
-                "border": "1px solid #2c3e50",
-                "boxShadow": "0 2px 10px rgba(0,0,0,0.2)"
-            }
+# Los niveles sin unidades en la entidad se deshabilitan: las jurisdicciones
+# sanitarias vienen del reporte de unidades, que sólo cubre Hidalgo.
+def opciones_niveles(por_nivel=None):
+    return [{"label": f" {etiqueta}", "value": nivel,
+             "disabled": por_nivel is not None and nivel != 'municipio' and not por_nivel.get(nivel)}
+            for nivel, etiqueta in NIVELES.items()]
+
+
+# Fila de filtros. El selector de entidad sólo se muestra si hay más de una
+# (ITER nacional particionado, ver funciones.RUTA_NACIONAL).
+def crear_filtros(municipios, entidades=(ENTIDAD_PREDETERMINADA,)):
+    return dbc.Row(
+        dbc.Col(
+            dbc.Card(
+                dbc.CardBody([
+                    dbc.Row([
+                        dbc.Col([
+                            html.Div([
+                                html.Label("Entidad", 
+                                         className="text-white-50 mb-2",
+                                         style={"fontWeight": 300}),
+                                dcc.Dropdown(
+                                    id="entidad-selector",
+                                    options=[{"label": ENTIDADES.get(e, str(e)), "value": e} for e in entidades],
+                                    value=ENTIDAD_PREDETERMINADA,
+                                    clearable=False,
+                                    searchable=True,
+                                    className="mb-3",
+                                    style={
+                                        "color": "#5B7389", 
+                                        "fontWeight": 300,
+                                        "backgroundColor": "#f8f9fa"
+                                    },
+                                ),
+                            ], style={} if len(entidades) > 1 else {"display": "none"}),
+                            html.Label("Nivel", 
+                                     className="text-white-50 mb-2",
+                                     style={"fontWeight": 300}),
+                            dbc.RadioItems(
+                                id="nivel-selector",
+                                options=opciones_niveles(),
+                                value="municipio",
+                                inline=True,
+                                className="mb-3",
+                                labelStyle={
+                                    "fontWeight": 300,
+                                    "color": "white",
+                                    "marginRight": "15px"
+                                },
+                            ),
+                            html.Label("Municipio", 
+                                     id="etiqueta-selector",
+                                     className="text-white-50 mb-2",
+                                     style={"fontWeight": 300}),
+                            dcc.Dropdown(
+                                id="dropdown-selector",
+                                options=[{"label": mun, "value": mun} for mun in municipios],
+                                value=municipios[0] if len(municipios) > 0 else None,
+                                clearable=False,
+                                searchable=True,
+                                style={
+                                    "color": "#5B7389", 
+                                    "fontWeight": 300,
+                                    "backgroundColor": "#f8f9fa"
+                                },
+                            ),
+                            html.Small(
+                                "Selecciona un municipio, una jurisdicción o el estado para filtrar los datos",
+                                className="text-muted d-block mt-1",
+                                style={"fontWeight": 300}
+                            ),
+                            html.Label("Localidad", 
+                                     className="text-white-50 mb-2 mt-3",
+                                     style={"fontWeight": 300}),
+                            dcc.Dropdown(
+                                id="dropdown-localidad",
+                                options=[],
+                                value=None,
+                                placeholder="Todo el municipio",
+                                clearable=True,
+                                searchable=True,
+                                style={
+                                    "color": "#5B7389", 
+                                    "fontWeight": 300,
+                                    "backgroundColor": "#f8f9fa"
+                                },
+                            )
+                        ], md=6, className="pe-3"),
+                        
+                        dbc.Col([
+                            html.Label("Opciones de visualización", 
+                                     className="text-white-50 mb-2",
+                                     style={"fontWeight": 300}),
+                            dbc.Checklist(
+                                options=[
+                                    {"label": " Mostrar gráficos", "value": 1},
+                                    {"label": " Mostrar datos brutos", "value": 2}
+                                ],
+                                value=[1],
+                                id="switches-input",
+                                switch=True,
+                                labelStyle={
+                                    "fontWeight": 300,
+                                    "color": "white",
+                                    "marginRight": "15px"
+                                },
+                                inline=True
+                            )
+                        ], md=6)
+                    ])
+                ]),
+                className="bg-dark mb-4",
+                style={
+                    "border": "1px solid #2c3e50",
+                    "boxShadow": "0 2px 10px rgba(0,0,0,0.2)"
+                }
+            ),
+            width=12
         ),
-        width=12
-    ),
-    className="g-0",
-    style={
-        "padding": "1rem",
-        "backgroundColor": "#1a1a1a",
-        "borderBottom": "1px solid #2c3e50",
-        "boxShadow": "0 2px 5px rgba(0,0,0,0.1)"
-    }
-)
+        className="g-0",
+        style={
+            "padding": "1rem",
+            "backgroundColor": "#1a1a1a",
+            "borderBottom": "1px solid #2c3e50",
+            "boxShadow": "0 2px 5px rgba(0,0,0,0.1)"
+        }
+    )
 
 # Contenido principal
 content = html.Div(
@@ -464,6 +566,36 @@ content = html.Div(
         ],
         className="mb-4 g-3"  # g-3 añade separación horizontal entre columnas
     ),
+
+    # Datos brutos (switch "Mostrar datos brutos") y descarga de los indicadores
+    dbc.Row(
+        dbc.Col(
+            dbc.Card(
+                [
+                    dbc.CardHeader(
+                        html.Div([
+                            html.I(className="fas fa-table me-2"),
+                            "Datos brutos"
+                        ]),
+                        className="text-white",
+                        style={"backgroundColor": "#5B7389"}
+                    ),
+                    dbc.CardBody(
+                        [
+                            html.Div(id='tabla-datos-brutos'),
+                            html.Div(id='rejillas-datos-brutos', className="mt-3"),
+                            html.Div(id='enlaces-exportacion', className="mt-3 text-white-50 small")
+                        ]
+                    )
+                ],
+                className="shadow bg-dark"
+            ),
+            width=12
+        ),
+        id='datos-brutos',
+        className="mb-4",
+        style={"display": "none"}
+    ),
             
     ],
     style={
@@ -472,55 +604,731 @@ content = html.Div(
         **CUSTOM_STYLE
     }
 )
-# Layout final
-app.layout = html.Div(
-    [
-        navbar,
-        filtros_row,
-        content
-    ],
-    style={
-        "backgroundColor": "#1a1a1a",
-        **CUSTOM_STYLE
+
+# Mapa de localidades y unidades de salud. Los puntos llegan ya agrupados
+# desde el servidor (mapa.py) según el zoom y la vista, en geobuf; el
+# navegador sólo los dibuja (assets/mapa.js).
+CENTRO_MAPA = [20.48, -98.86]
+ZOOM_INICIAL = 8
+
+
+def capa_mapa(id_capa, color):
+    return dl.GeoJSON(
+        id=id_capa,
+        format="geobuf",
+        pointToLayer={"variable": "mpios_mapa.punto"},
+        hideout={"color": color},
+    )
+
+
+pestana_mapa = html.Div(
+    dbc.Card(
+        dbc.CardBody(
+            dl.Map(
+                dl.LayersControl([
+                    dl.BaseLayer(dl.TileLayer(), name="Mapa base", checked=True),
+                    dl.Overlay(capa_mapa('capa-localidades', '#AEC6CF'), name="Localidades (población)", checked=True),
+                    dl.Overlay(capa_mapa('capa-unidades', '#e15759'), name="Unidades de salud HGSSA", checked=True),
+                ]),
+                id='mapa',
+                center=CENTRO_MAPA,
+                zoom=ZOOM_INICIAL,
+                style={'height': '70vh', 'width': '100%'}
+            )
+        ),
+        className="shadow bg-dark"
+    ),
+    style={"padding": "1rem", **CUSTOM_STYLE}
+)
+
+
+def crear_comparacion(municipios):
+    # Comparación de varios municipios: pirámides y tabla de indicadores
+    return html.Div(
+        [
+            dbc.Card(
+                dbc.CardBody(
+                    dbc.Row([
+                        dbc.Col([
+                            html.Label("Municipios a comparar",
+                                       className="text-white-50 mb-2",
+                                       style={"fontWeight": 300}),
+                            dcc.Dropdown(
+                                id="comparar-selector",
+                                options=[{"label": mun, "value": mun} for mun in municipios],
+                                value=[],
+                                multi=True,
+                                placeholder="Selecciona dos o más municipios",
+                                style={
+                                    "color": "#5B7389",
+                                    "fontWeight": 300,
+                                    "backgroundColor": "#f8f9fa"
+                                },
+                            ),
+                        ], md=8, className="pe-3"),
+                        dbc.Col([
+                            html.Label("Pirámides",
+                                       className="text-white-50 mb-2",
+                                       style={"fontWeight": 300}),
+                            dbc.RadioItems(
+                                id="comparar-modo",
+                                options=[
+                                    {"label": " Superpuestas (%)", "value": "superpuestas"},
+                                    {"label": " Separadas", "value": "separadas"}
+                                ],
+                                value="superpuestas",
+                                inline=True,
+                                labelStyle={
+                                    "fontWeight": 300,
+                                    "color": "white",
+                                    "marginRight": "15px"
+                                },
+                            )
+                        ], md=4)
+                    ])
+                ),
+                className="bg-dark mb-4",
+                style={"border": "1px solid #2c3e50"}
+            ),
+            dbc.Card(dbc.CardBody(dcc.Graph(id='comparar-piramides')), className="shadow bg-dark mb-4"),
+            dbc.Card(dbc.CardBody(html.Div(id='comparar-tabla')), className="shadow bg-dark"),
+        ],
+        style={"padding": "1rem", **CUSTOM_STYLE}
+    )
+
+
+def crear_pestanas(municipios):
+    return dbc.Tabs(
+        [
+            dbc.Tab(content, label="Indicadores", tab_id="pestana-indicadores"),
+            dbc.Tab(crear_comparacion(municipios), label="Comparar", tab_id="pestana-comparar"),
+            dbc.Tab(pestana_mapa, label="Mapa", tab_id="pestana-mapa"),
+        ],
+        id="pestanas",
+        active_tab="pestana-indicadores",
+        className="px-3",
+        style={"backgroundColor": "#1a1a1a"}
+    )
+
+
+def datos_navegador(instantanea):
+    # [población total, hombres, mujeres] por municipio, jurisdicción y estado
+    # para los callbacks del navegador
+    return {
+        nombre: [m.poblacion_total, m.total_hombres, m.total_mujeres]
+        for nombre, m in instantanea.cubo.metricas.items()
     }
+
+
+# Layout final. Es una función para que cada carga de página use la
+# instantánea de datos vigente (lista de municipios y datos del navegador).
+# Mientras los datos cargan se arma con el índice de municipios y
+# 'datos-municipios' se llena después con cargar_datos_municipios.
+def construir_layout():
+    municipios = datos.municipios()
+    return html.Div(
+        [
+            navbar,
+            crear_filtros(municipios, datos.entidades()),
+            crear_pestanas(municipios),
+            dcc.Store(
+                id='datos-municipios',
+                data=datos_navegador(datos.actual()) if CALLBACKS_CLIENTE and datos.esta_listo() else None
+            ),
+            # Localidad elegida para los callbacks del navegador (update_datos_localidad)
+            dcc.Store(id='datos-localidad')
+        ],
+        style={
+            "backgroundColor": "#1a1a1a",
+            **CUSTOM_STYLE
+        }
+    )
+
+
+app.layout = construir_layout
+
+
+if CALLBACKS_CLIENTE:
+    @callback(
+        Output('datos-municipios', 'data'),
+        [Input('dropdown-selector', 'options'),
+         Input('entidad-selector', 'value')],
+        State('datos-municipios', 'data'),
+        prevent_initial_call=not ARRANQUE_DIFERIDO
+    )
+    def cargar_datos_municipios(_, entidad, datos_actuales):
+        # Enviar los datos al cambiar de entidad o, si la página se sirvió
+        # antes de que terminara la carga, en cuanto estén
+        if datos_actuales and dash.ctx.triggered_id != 'entidad-selector':
+            return dash.no_update
+        return datos_navegador(datos.actual(entidad))
+
+# Nivel de agregación: el selector principal lista los municipios, las
+# jurisdicciones o el estado, todos precalculados en instantanea.cubo.
+@callback(
+    [Output('dropdown-selector', 'options'),
+     Output('dropdown-selector', 'value'),
+     Output('etiqueta-selector', 'children')],
+    [Input('nivel-selector', 'value'),
+     Input('entidad-selector', 'value')],
+    prevent_initial_call=True
+)
+def update_opciones_nivel(nivel, entidad=None):
+    nombres = []
+    if nivel != 'municipio':
+        nombres = datos.actual(entidad).cubo.por_nivel.get(nivel, [])
+    if not nombres:
+        # Nivel sin unidades en la entidad (p. ej. jurisdicciones fuera de
+        # Hidalgo): se listan los municipios mientras update_niveles lo cambia
+        nivel, nombres = 'municipio', datos.municipios(entidad)
+    return ([{"label": nombre, "value": nombre} for nombre in nombres],
+            nombres[0] if nombres else None, NIVELES.get(nivel, NIVELES['municipio']))
+
+
+@callback(
+    [Output('nivel-selector', 'options'),
+     Output('nivel-selector', 'value')],
+    Input('entidad-selector', 'value'),
+    State('nivel-selector', 'value'),
+    prevent_initial_call=True
+)
+def update_niveles(entidad, nivel):
+    por_nivel = datos.actual(entidad).cubo.por_nivel
+    if nivel == 'municipio' or por_nivel.get(nivel):
+        return opciones_niveles(por_nivel), dash.no_update
+    return opciones_niveles(por_nivel), 'municipio'
+
+
+# Selección de localidad: las opciones son el rango de localidades del
+# municipio en la tabla ordenada (TablaLocalidades.rango) y se limpian al
+# cambiar de municipio.
+def posicion_localidad(instantanea, municipio, localidad):
+    # Posición de la localidad en instantanea.localidades, o None para todo el municipio
+    if localidad is None or instantanea.localidades is None:
+        return None
+    return instantanea.localidades.posicion(municipio, localidad)
+
+
+def metricas_seleccion(instantanea, municipio, localidad):
+    # Indicadores del municipio (o jurisdicción, o estado) o, si se eligió una, de la localidad
+    i = posicion_localidad(instantanea, municipio, localidad)
+    if i is None:
+        if municipio not in instantanea.cubo.metricas:
+            # Selección de la entidad anterior mientras cambian las opciones
+            raise PreventUpdate
+        return instantanea.cubo.metricas[municipio]
+    return metricas_localidad(instantanea.localidades, instantanea.salud_localidades, i)
+
+
+def clave_seleccion(municipio, localidad):
+    # Clave de cache de la selección
+    return municipio if localidad is None else f"{municipio}|{localidad}"
+
+
+@callback(
+    [Output('dropdown-localidad', 'options'),
+     Output('dropdown-localidad', 'value')],
+    Input('dropdown-selector', 'value'),
+    State('entidad-selector', 'value')
 )
+def update_opciones_localidad(municipio_seleccionado, entidad=None):
+    instantanea = datos.actual(entidad)
+    opciones = cacheado('localidades', instantanea.version, municipio_seleccionado,
+                        lambda: opciones_localidad(instantanea, municipio_seleccionado))
+    return opciones, None
+
+
+def opciones_localidad(instantanea, municipio_seleccionado):
+    localidades = instantanea.localidades
+    if localidades is None:
+        return []
+    inicio, fin = localidades.rango(municipio_seleccionado)
+    return [
+        {"label": f"{nombre} ({loc:04d})", "value": int(loc)}
+        for nombre, loc in zip(localidades.nombre[inicio:fin], localidades.loc[inicio:fin])
+    ]
+
+
+# Callbacks para actualizar los gráficos y cards. Cada sección es un callback
+# independiente que sólo depende del municipio (y la localidad) y guarda su
+# resultado en la cache (caches.cacheado) por versión de datos, así que
+# ninguna espera a las demás ni se recalcula al cambiar los switches. Cada
+# callback lee datos.actual() una sola vez.
+@callback(
+    Output('piramide-poblacional', 'figure'),
+    [Input('dropdown-selector', 'value'),
+     Input('dropdown-localidad', 'value')],
+    State('entidad-selector', 'value')
+)
+@perfilable
+@medido('callback_piramide')
+def update_piramide(municipio_seleccionado, localidad_seleccionada=None, entidad=None):
+    # Pirámide poblacional (desde la cache de figuras)
+    return figura_piramide(datos.actual(entidad), municipio_seleccionado, localidad_seleccionada)
+
+
+@callback(
+    [Output('grupo-mayoritario', 'children'),
+     Output('densidad-poblacional', 'children')],
+    [Input('dropdown-selector', 'value'),
+     Input('dropdown-localidad', 'value')],
+    State('entidad-selector', 'value')
+)
+@perfilable
+@medido('callback_indicadores_poblacion')
+def update_indicadores_poblacion(municipio_seleccionado, localidad_seleccionada=None, entidad=None):
+    instantanea = datos.actual(entidad)
+    return cacheado('indicadores', instantanea.version, clave_seleccion(municipio_seleccionado, localidad_seleccionada),
+                    lambda: indicadores_poblacion(instantanea, municipio_seleccionado, localidad_seleccionada))
+
+
+def indicadores_poblacion(instantanea, municipio_seleccionado, localidad_seleccionada=None):
+    # Indicadores precalculados del municipio (o localidad) seleccionado
+    m = metricas_seleccion(instantanea, municipio_seleccionado, localidad_seleccionada)
+
+    # Habitantes por km² (área de funciones.areas_municipales)
+    densidad = "N/D" if m.densidad is None else f"{m.densidad:,.0f}"
+
+    # Grupo de edad con más población
+    return m.grupo_mayoritario, densidad
+
 
-# Callbacks para actualizar los gráficos y cards
 @callback(
-    [Output('piramide-poblacional', 'figure'),
-     Output('grafico-secundario', 'figure'),
-     Output('poblacion-total', 'children'),
-     Output('porcentaje-hombres', 'children'),
-     Output('porcentaje-mujeres', 'children'),
-     Output('grupo-mayoritario', 'children'),
-     Output('densidad-poblacional', 'children'),
-     Output('auxiliares-salud-card', 'children'),  
+    [Output('auxiliares-salud-card', 'children'),
      Output('casas-salud-card', 'children'),
      Output('parteras-card', 'children'),
      Output('total_unidades-card', 'children')],
-    # Inputs del dropdown y switches  
     [Input('dropdown-selector', 'value'),
-     Input('switches-input', 'value')]
+     Input('dropdown-localidad', 'value')],
+    State('entidad-selector', 'value')
 )
+@perfilable
+@medido('callback_tarjetas_salud')
+def update_tarjetas_salud(municipio_seleccionado, localidad_seleccionada=None, entidad=None):
+    instantanea = datos.actual(entidad)
+    return cacheado('salud', instantanea.version, clave_seleccion(municipio_seleccionado, localidad_seleccionada),
+                    lambda: tarjetas_salud(instantanea, municipio_seleccionado, localidad_seleccionada))
+
+
+def formato_conteo(valor):
+    # Conteo de salud con separador de miles, o N/D si la entidad no tiene datos (NaN)
+    return "N/D" if pd.isna(valor) else f"{int(valor):,}"
+
+
+def tarjetas_salud(instantanea, municipio_seleccionado, localidad_seleccionada=None):
+    m = metricas_seleccion(instantanea, municipio_seleccionado, localidad_seleccionada)
+
+    # auxiliares de salud 
+    auxiliares_formateados = formato_conteo(m.auxiliares)
+
+    # CASAS DE SALUD
+    # Detalle por tipo de casa de salud
+    casas_output = html.Div("Datos no disponibles")  # Valor por defecto
+
+    if m.casas is not None:
+        if m.casas:
+            items_tipos = []
+            for tipo, valor in m.casas.items():
+                # Traducir el código si existe en el mapeo, sino mostrar el código original
+                nombre = MAPEO_CASAS_SALUD.get(tipo, {}).get('name', tipo)
+                
+                item = html.Div([
+                    html.Strong(f"{nombre}: "),  # Negrita para el tipo
+                    html.Span(f"{valor}")  # Valor normal
+                ], style={'marginBottom': '3px', 'fontSize': '0.9rem'})
+                
+                items_tipos.append(item)
+            
+            casas_output = html.Div([
+                html.H4(f"Total: {sum(m.casas.values()):,}", style={'marginBottom': '10px'}),
+                html.Div(items_tipos)
+            ])
+        else:
+            casas_output = "0"
+
+    return auxiliares_formateados, casas_output, formato_conteo(m.parteras), formato_conteo(m.unidades)
+
+
+# Datos brutos de la selección: población por grupo de edad y sexo e
+# indicadores, más los enlaces de descarga de la entidad (exportar_indicadores).
+@callback(
+    [Output('datos-brutos', 'style'),
+     Output('tabla-datos-brutos', 'children'),
+     Output('enlaces-exportacion', 'children')],
+    [Input('switches-input', 'value'),
+     Input('dropdown-selector', 'value'),
+     Input('dropdown-localidad', 'value')],
+    State('entidad-selector', 'value')
+)
+@perfilable
+@medido('callback_datos_brutos')
+def update_datos_brutos(opciones, municipio_seleccionado, localidad_seleccionada=None, entidad=None):
+    if 2 not in (opciones or []):
+        return {"display": "none"}, dash.no_update, dash.no_update
+    instantanea = datos.actual(entidad)
+    tabla = cacheado('datos_brutos', instantanea.version,
+                     clave_seleccion(municipio_seleccionado, localidad_seleccionada),
+                     lambda: tabla_datos_brutos(instantanea, municipio_seleccionado, localidad_seleccionada))
+    return {}, tabla, enlaces_exportacion(instantanea.entidad)
+
+
+def tabla_datos_brutos(instantanea, municipio, localidad=None):
+    # Población por grupo de edad y sexo de la selección, e indicadores de salud
+    m = metricas_seleccion(instantanea, municipio, localidad)
+    i = posicion_localidad(instantanea, municipio, localidad)
+    if i is None:
+        poblacion = instantanea.cubo.poblacion[instantanea.cubo.posiciones[municipio]]
+    else:
+        poblacion = instantanea.localidades.poblacion[i]
+
+    hombres = poblacion[:, SEXOS.index('M')].astype(np.int64)
+    mujeres = poblacion[:, SEXOS.index('F')].astype(np.int64)
+    tabla = pd.DataFrame({
+        "Grupo de edad": [ETIQUETAS_EDAD[grupo] for grupo in GRUPOS_EDAD] + ["Total"],
+        "Hombres": [f"{x:,}" for x in hombres.tolist() + [hombres.sum()]],
+        "Mujeres": [f"{x:,}" for x in mujeres.tolist() + [mujeres.sum()]],
+        "Total": [f"{x:,}" for x in (hombres + mujeres).tolist() + [hombres.sum() + mujeres.sum()]],
+    })
+    casas = "N/D" if m.casas is None else f"{sum(m.casas.values()):,}"
+    densidad = "N/D" if m.densidad is None else f"{m.densidad:,.1f}"
+    return html.Div([
+        dbc.Table.from_dataframe(tabla, striped=True, bordered=False, hover=True, size="sm", color="dark"),
+        html.P(
+            f"Población total: {m.poblacion_total:,} · Densidad (hab/km²): {densidad} · "
+            f"Auxiliares: {formato_conteo(m.auxiliares)} · Casas de salud: {casas} · "
+            f"Parteras: {formato_conteo(m.parteras)} · Unidades: {formato_conteo(m.unidades)}",
+            className="text-white-50 small mb-0"
+        )
+    ])
+
+
+def enlaces_exportacion(entidad):
+    # Descarga de los indicadores por municipio de la entidad (y de todas, si hay varias)
+    grupos = [(str(entidad), ENTIDADES.get(entidad, str(entidad)))]
+    if len(datos.entidades()) > 1:
+        grupos.append(("todas", "todas las entidades"))
+    return [
+        html.Div([
+            f"Indicadores por municipio de {nombre}: ",
+            *[html.A(formato.upper(), href=f"/exportar/indicadores.{formato}?entidad={clave}",
+                     className="me-2") for formato in exportar.FORMATOS]
+        ])
+        for clave, nombre in grupos
+    ]
+
+
+# Rejillas de localidades del ITER y de unidades HGSSA con el modelo de filas
+# 'infinite' de AG Grid: el navegador pide bloques de filas (getRowsRequest) y
+# el filtro, el orden y el recorte se hacen en el servidor (rejilla.py). La
+# entidad va en el id, así que al cambiarla se montan rejillas nuevas y no
+# quedan bloques de la entidad anterior en la caché de la rejilla.
+TAMANO_BLOQUE = 100
+
+
+def crear_rejilla(tabla, entidad):
+    columnas = [
+        {"field": campo, "headerName": encabezado,
+         "filter": "agNumberColumnFilter" if tipo == 'numero' else "agTextColumnFilter"}
+        for campo, encabezado, tipo in rejilla.COLUMNAS[tabla]
+    ]
+    return dag.AgGrid(
+        id={'type': 'rejilla-datos', 'tabla': tabla, 'entidad': entidad},
+        columnDefs=columnas,
+        defaultColDef={"sortable": True, "resizable": True, "floatingFilter": True,
+                       "filterParams": {"buttons": ["reset"], "debounceMs": 300}},
+        rowModelType="infinite",
+        dashGridOptions={
+            "cacheBlockSize": TAMANO_BLOQUE,
+            "maxBlocksInCache": 10,
+            "infiniteInitialRowCount": TAMANO_BLOQUE,
+            "pagination": True,
+            "paginationPageSize": TAMANO_BLOQUE,
+        },
+        className="ag-theme-alpine-dark",
+        style={"height": "480px", "width": "100%"}
+    )
+
+
+@callback(
+    Output('rejillas-datos-brutos', 'children'),
+    [Input('switches-input', 'value'),
+     Input('entidad-selector', 'value')]
+)
+def update_rejillas(opciones, entidad):
+    # Sin el switch de datos brutos no se montan (y no piden filas)
+    if 2 not in (opciones or []):
+        return []
+    entidad = datos.actual(entidad).entidad
+    pestanas = [dbc.Tab(crear_rejilla('localidades', entidad), label="Localidades (ITER)",
+                        tab_id="rejilla-localidades")]
+    if entidad == ENTIDAD_PREDETERMINADA:
+        pestanas.append(dbc.Tab(crear_rejilla('unidades', entidad), label="Unidades HGSSA",
+                                tab_id="rejilla-unidades"))
+    return dbc.Tabs(pestanas, active_tab="rejilla-localidades")
+
+
+@callback(
+    Output({'type': 'rejilla-datos', 'tabla': MATCH, 'entidad': MATCH}, 'getRowsResponse'),
+    Input({'type': 'rejilla-datos', 'tabla': MATCH, 'entidad': MATCH}, 'getRowsRequest'),
+    prevent_initial_call=True
+)
+@perfilable
+@medido('callback_rejilla')
+def update_rejilla(peticion):
+    if not peticion:
+        raise PreventUpdate
+    identificador = dash.ctx.triggered_id
+    tablas = rejilla.tablas(datos.actual(identificador['entidad']))
+    return tablas[identificador['tabla']].bloque(peticion)
+
+
+@app.server.route('/exportar/indicadores.<formato>')
+def exportar_indicadores(formato):
+    # Indicadores por municipio en CSV, Parquet o Arrow IPC, enviados por partes
+    # (?entidad=<clave>, o ?entidad=todas para todas las entidades con datos).
+    # Las entidades que no están cargadas se leen sin publicarlas (datos.sin_publicar)
+    if formato not in exportar.FORMATOS:
+        abort(404)
+    disponibles = datos.entidades()
+    valor = request.args.get('entidad', str(ENTIDAD_PREDETERMINADA))
+    if valor == 'todas':
+        entidades = disponibles
+    elif valor.isdigit() and int(valor) in disponibles:
+        entidades = [int(valor)]
+    else:
+        abort(404)
+    nombre = f"indicadores_{'todas' if valor == 'todas' else f'{entidades[0]:02d}'}.{formato}"
+    return Response(
+        exportar.exportar((datos.sin_publicar(entidad) for entidad in entidades), formato),
+        mimetype=exportar.FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nombre}"'}
+    )
+
+
+# Comparación de municipios. Todas las pirámides e indicadores salen de una
+# sola selección de filas de instantanea.poblacion (N × 18 × 2) y las figuras
+# se arman como dicts, sin validar objetos de plotly por cada traza.
+@callback(
+    [Output('comparar-piramides', 'figure'),
+     Output('comparar-tabla', 'children')],
+    [Input('comparar-selector', 'value'),
+     Input('comparar-modo', 'value')],
+    State('entidad-selector', 'value')
+)
+@perfilable
+@medido('callback_comparacion')
+def update_comparacion(municipios_seleccionados, modo, entidad=None):
+    instantanea = datos.actual(entidad)
+    municipios = [mun for mun in municipios_seleccionados or [] if mun in instantanea.posiciones]
+    if not municipios:
+        return FIGURA_VACIA, html.P("Selecciona municipios para compararlos.", className="text-white-50")
+    return cacheado('comparacion', instantanea.version, f"{modo}|{'|'.join(municipios)}",
+                    lambda: comparacion(instantanea, municipios, modo))
+
+
+@callback(
+    [Output('comparar-selector', 'options'),
+     Output('comparar-selector', 'value')],
+    Input('entidad-selector', 'value'),
+    prevent_initial_call=True
+)
+def update_opciones_comparacion(entidad):
+    return [{"label": mun, "value": mun} for mun in datos.municipios(entidad)], []
+
+
+FIGURA_VACIA = {
+    "data": [],
+    "layout": {"plot_bgcolor": '#1a1a1a', "paper_bgcolor": '#1a1a1a', "font": {"color": 'white'},
+               "xaxis": {"visible": False}, "yaxis": {"visible": False}},
+}
+COLORES_COMPARACION = qualitative.Plotly + qualitative.D3 + qualitative.Dark24
+
+
+def comparacion(instantanea, municipios, modo):
+    poblacion = instantanea.poblacion[[instantanea.posiciones[mun] for mun in municipios]]
+    if modo == "separadas":
+        figura = crear_piramides_separadas(municipios, poblacion)
+    else:
+        figura = crear_piramides_superpuestas(municipios, poblacion)
+    return figura, tabla_comparacion(instantanea, municipios, poblacion)
+
+
+def crear_piramides_superpuestas(municipios, poblacion):
+    """Pirámides de N municipios en porcentaje de su población, una línea por sexo y municipio."""
+    etiquetas = [ETIQUETAS_EDAD[grupo] for grupo in GRUPOS_EDAD]
+    totales = poblacion.sum(axis=(1, 2), dtype=np.int64)
+    porcentajes = 100 * poblacion / np.maximum(totales, 1)[:, None, None]
+    f, m = SEXOS.index('F'), SEXOS.index('M')
+
+    trazas = []
+    for k, municipio in enumerate(municipios):
+        color = COLORES_COMPARACION[k % len(COLORES_COMPARACION)]
+        for sexo, signo, visible in ((m, -1, True), (f, 1, False)):
+            trazas.append({
+                "type": "scatter", "mode": "lines+markers", "name": municipio, "legendgroup": municipio,
+                "showlegend": visible, "x": (signo * porcentajes[k, :, sexo]).round(2).tolist(), "y": etiquetas,
+                "line": {"color": color, "shape": "hvh"}, "marker": {"size": 4},
+                "hovertemplate": f"{municipio}<br>%{{y}}: %{{customdata:.2f}}%<extra></extra>",
+                "customdata": porcentajes[k, :, sexo].round(2).tolist(),
+            })
+
+    limite = float(porcentajes.max()) * 1.1 if len(municipios) else 1
+    paso = max(1, int(limite / 4))
+    marcas = list(range(-int(limite), int(limite) + 1, paso))
+    return {
+        "data": trazas,
+        "layout": {
+            "title": {"text": "Pirámides comparadas (% de la población) - Hombres | Mujeres", "x": 0.5,
+                      "font": {"size": 18, "color": 'white'}},
+            "xaxis": {"title": {"text": "% de la población"}, "range": [-limite, limite], "tickvals": marcas,
+                      "ticktext": [str(abs(x)) for x in marcas], "gridcolor": 'rgba(255,255,255,0.1)',
+                      "zerolinecolor": 'rgba(255,255,255,0.3)'},
+            "yaxis": {"title": {"text": "Grupo de Edad"}, "gridcolor": 'rgba(255,255,255,0.1)'},
+            "plot_bgcolor": '#1a1a1a', "paper_bgcolor": '#1a1a1a', "font": {"color": 'white'},
+            "height": 600, "hovermode": "y unified",
+            "legend": {"orientation": "h", "yanchor": "bottom", "y": 1.02, "xanchor": "center", "x": 0.5},
+        },
+    }
+
+
+def crear_piramides_separadas(municipios, poblacion, columnas=4):
+    """Una pirámide pequeña por municipio, en una rejilla de 'columnas' columnas."""
+    etiquetas = [ETIQUETAS_EDAD[grupo] for grupo in GRUPOS_EDAD]
+    f, m = SEXOS.index('F'), SEXOS.index('M')
+    columnas = min(columnas, len(municipios))
+    filas = -(-len(municipios) // columnas)
+    maximos = poblacion.max(axis=(1, 2))
+    separacion = 0.06
+
+    trazas, anotaciones, layout = [], [], {}
+    ancho = (1 - separacion * (columnas - 1)) / columnas
+    alto = (1 - separacion * (filas - 1)) / filas
+    for k, municipio in enumerate(municipios):
+        fila, columna = divmod(k, columnas)
+        eje = "" if k == 0 else str(k + 1)
+        x0 = columna * (ancho + separacion)
+        y1 = 1 - fila * (alto + separacion)
+        for sexo, signo, color, nombre in ((m, -1, '#AEC6CF', 'Hombres'), (f, 1, '#B8E2C8', 'Mujeres')):
+            trazas.append({
+                "type": "bar", "orientation": "h", "name": nombre, "legendgroup": nombre, "showlegend": k == 0,
+                "x": (signo * poblacion[k, :, sexo].astype(np.int64)).tolist(), "y": etiquetas,
+                "marker": {"color": color}, "xaxis": f"x{eje}", "yaxis": f"y{eje}",
+                "customdata": poblacion[k, :, sexo].tolist(),
+                "hovertemplate": f"{municipio}<br>%{{y}}: %{{customdata:,}}<extra>{nombre}</extra>",
+            })
+        limite = max(int(maximos[k]), 1) * 1.1
+        layout[f"xaxis{eje}"] = {"domain": [x0, x0 + ancho], "anchor": f"y{eje}", "range": [-limite, limite],
+                                 "showticklabels": False, "gridcolor": 'rgba(255,255,255,0.1)',
+                                 "zerolinecolor": 'rgba(255,255,255,0.3)'}
+        layout[f"yaxis{eje}"] = {"domain": [y1 - alto, y1], "anchor": f"x{eje}", "showticklabels": columna == 0,
+                                 "tickfont": {"size": 9}}
+        anotaciones.append({"text": municipio, "x": x0 + ancho / 2, "y": y1, "xref": "paper", "yref": "paper",
+                            "xanchor": "center", "yanchor": "bottom", "showarrow": False,
+                            "font": {"size": 12, "color": 'white'}})
+
+    layout.update({
+        "barmode": "overlay", "bargap": 0.1, "annotations": anotaciones,
+        "plot_bgcolor": '#1a1a1a', "paper_bgcolor": '#1a1a1a', "font": {"color": 'white'},
+        "height": max(400, 260 * filas), "margin": {"t": 60},
+        "legend": {"orientation": "h", "yanchor": "bottom", "y": 1.02, "xanchor": "center", "x": 0.5},
+    })
+    return {"data": trazas, "layout": layout}
+
+
+def tabla_comparacion(instantanea, municipios, poblacion):
+    """Tabla de indicadores de los municipios, con la población calculada sobre la selección."""
+    por_sexo = poblacion.sum(axis=1, dtype=np.int64)
+    totales = por_sexo.sum(axis=1)
+    porcentajes = 100 * por_sexo / np.maximum(totales, 1)[:, None]
+    mayoritario = poblacion.sum(axis=2, dtype=np.int64).argmax(axis=1)
+    metricas = [instantanea.metricas[mun] for mun in municipios]
+
+    tabla = pd.DataFrame({
+        "Municipio": municipios,
+        "Población": [f"{x:,}" for x in totales],
+        "% Hombres": [f"{x:.1f}%" for x in porcentajes[:, SEXOS.index('M')]],
+        "% Mujeres": [f"{x:.1f}%" for x in porcentajes[:, SEXOS.index('F')]],
+        "Grupo mayoritario": [ETIQUETAS_EDAD[GRUPOS_EDAD[i]] for i in mayoritario],
+        "hab/km²": ["N/D" if m.densidad is None else f"{m.densidad:,.0f}" for m in metricas],
+        "Auxiliares": [formato_conteo(m.auxiliares) for m in metricas],
+        "Casas de salud": ["N/D" if m.casas is None else f"{sum(m.casas.values()):,}" for m in metricas],
+        "Parteras": [formato_conteo(m.parteras) for m in metricas],
+        "Unidades": [formato_conteo(m.unidades) for m in metricas],
+    })
+    return dbc.Table.from_dataframe(tabla, striped=True, bordered=False, hover=True, size="sm", color="dark")
+
+
+@callback(
+    [Output('capa-localidades', 'data'),
+     Output('capa-unidades', 'data')],
+    [Input('mapa', 'zoom'),
+     Input('mapa', 'bounds')],
+    State('entidad-selector', 'value')
+)
+@perfilable
+@medido('callback_mapa')
+def update_mapa(zoom, limites, entidad=None):
+    # Grupos visibles de cada capa, en geobuf (base64)
+    capas = mapa.capas(datos.actual(entidad))
+    if not capas:
+        return None, None
+    zoom = ZOOM_INICIAL if zoom is None else zoom
+    return [mapa.a_geobuf_base64(capas[nombre].vista(zoom, limites)) for nombre in ('localidades', 'unidades')]
+
+
+@callback(
+    Output('mapa', 'bounds'),
+    Input('entidad-selector', 'value'),
+    prevent_initial_call=True
+)
+def update_limites_mapa(entidad):
+    # Al cambiar de entidad, encuadrar sus localidades
+    capas = mapa.capas(datos.actual(entidad))
+    if not capas or not len(capas['localidades']):
+        raise PreventUpdate
+    return capas['localidades'].limites()
+
+
+@app.server.route('/mapa/<capa>/<int:z>/<int:x>/<int:y>.pbf')
+def mosaico_mapa(capa, z, x, y):
+    # Mosaico XYZ de una capa en geobuf, para clientes que piden por mosaico
+    # (?entidad=<clave> para otra entidad)
+    entidad = request.args.get('entidad', ENTIDAD_PREDETERMINADA, type=int)
+    if entidad not in datos.entidades():
+        abort(404)
+    capas = mapa.capas(datos.actual(entidad))
+    if capa not in capas or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        abort(404)
+    return Response(mapa.a_geobuf(capas[capa].mosaico(z, x, y)), mimetype='application/x-protobuf')
+
+
+# Gráfico de sexo y tarjetas de población. Por defecto se calculan en el
+# navegador con los datos de 'datos-municipios' (ver assets/clientside.js);
+# update_distribucion_sexo es el equivalente del lado del servidor.
+SALIDAS_DISTRIBUCION_SEXO = [
+    Output('grafico-secundario', 'figure'),
+    Output('poblacion-total', 'children'),
+    Output('porcentaje-hombres', 'children'),
+    Output('porcentaje-mujeres', 'children'),
+]
+
+
+@perfilable
+@medido('callback_distribucion_sexo')
+def update_distribucion_sexo(municipio_seleccionado, localidad_seleccionada=None, entidad=None):
+    instantanea = datos.actual(entidad)
+    m = metricas_seleccion(instantanea, municipio_seleccionado, localidad_seleccionada)
+
+    # Gráfico secundario (desde la cache de figuras)
+    fig_secundario = figura_secundaria(instantanea, municipio_seleccionado, localidad_seleccionada)
 
-def update_content(municipio_seleccionado, switches):
-    # Datos del municipio seleccionado
-    df_mun = df_agrupado.loc[municipio_seleccionado]
-    
-    # Crear pirámide poblacional
-    fig_piramide = crear_piramide_poblacional(municipio_seleccionado)
-    
-    # Crear gráfico secundario
-    fig_secundario = crear_grafico_secundario(municipio_seleccionado)
-    
     # Calcular métricas para las cards
-    total_poblacion = df_mun.sum().sum()
-    columnas_hombres = [col for col in df_mun.index if col.endswith('_M')]
-    columnas_mujeres = [col for col in df_mun.index if col.endswith('_F')]
-    
-    total_hombres = df_mun[columnas_hombres].sum().sum()
-    total_mujeres = df_mun[columnas_mujeres].sum().sum()
+    total_hombres = m.total_hombres
+    total_mujeres = m.total_mujeres
     total_poblacion_sexo = total_hombres + total_mujeres  # Solo suma población por sexo
+    if total_poblacion_sexo == 0:
+        # Localidades con todos los valores reservados por el INEGI
+        return fig_secundario, f"{m.poblacion_total:,}", "N/D", "N/D"
     
     # 2. Calcular porcentajes (asegurar que sumen 100%)
     porcentaje_hombres = f"{(total_hombres / total_poblacion_sexo * 100):.1f}%"
@@ -532,97 +1340,106 @@ def update_content(municipio_seleccionado, switches):
         porcentaje_hombres = f"{(100 * total_hombres / total_poblacion_sexo):.1f}%"
         porcentaje_mujeres = "100.0%" if total_mujeres == 0 else f"{(100 - float(porcentaje_hombres[:-1])):.1f}%"
     # Formatear números con separadores de miles
-    poblacion_total = f"{int(total_poblacion):,}"  # ✅ Asegura que sea entero antes del formato
-   
-    densidad = "128"  # Valor de ejemplo - deberías calcularlo según tus datos
-    
-    # Determinar grupo mayoritario (ejemplo simplificado)
-    grupos_edad = [col[:-2] for col in df_mun.index if col.endswith('_M')]
-    poblacion_por_grupo = {grupo: df_mun[f"{grupo}_M"] + df_mun[f"{grupo}_F"] for grupo in grupos_edad}
-    grupo_mayoritario = max(poblacion_por_grupo.items(), key=lambda x: x[1])[0]
-    grupo_mayoritario = grupo_mayoritario.replace("P_", "").replace("A", "-").replace("YMAS", "+")
-    
-    # auxiliares de salud 
+    poblacion_total = f"{m.poblacion_total:,}"
 
-    total_auxiliares = auxiliares_salud()
-    auxiliares_municipio = total_auxiliares.loc[
-    total_auxiliares['Nombre Municipio Loc'] == municipio_seleccionado,
-        'Auxiliar de Salud'
-        ].values[0] if not total_auxiliares.empty else 0
+    return fig_secundario, poblacion_total, porcentaje_hombres, porcentaje_mujeres
 
-    auxiliares_formateados = f"{int(auxiliares_municipio):,}"  
 
+if CALLBACKS_CLIENTE:
+    clientside_callback(
+        ClientsideFunction(namespace='mpios', function_name='distribucion_sexo'),
+        SALIDAS_DISTRIBUCION_SEXO,
+        [Input('dropdown-selector', 'value'),
+         Input('datos-municipios', 'data'),
+         Input('datos-localidad', 'data')]
+    )
 
-  
-    # CASAS DE SALUD
-    # Procesamiento de Casas de Salud con detalle
-    total_casas = casas_salud()
-    casas_output = html.Div("Datos no disponibles")  # Valor por defecto
+    @callback(
+        Output('datos-localidad', 'data'),
+        [Input('dropdown-selector', 'value'),
+         Input('dropdown-localidad', 'value')],
+        State('entidad-selector', 'value')
+    )
+    def update_datos_localidad(municipio_seleccionado, localidad_seleccionada, entidad=None):
+        # [población total, hombres, mujeres] de la localidad elegida, o None
+        instantanea = datos.actual(entidad)
+        i = posicion_localidad(instantanea, municipio_seleccionado, localidad_seleccionada)
+        if i is None:
+            return None
+        m = metricas_localidad(instantanea.localidades, instantanea.salud_localidades, i)
+        return {
+            "municipio": municipio_seleccionado,
+            "nombre": instantanea.localidades.nombre[i],
+            "valores": [m.poblacion_total, m.total_hombres, m.total_mujeres],
+        }
+else:
+    callback(SALIDAS_DISTRIBUCION_SEXO,
+             [Input('dropdown-selector', 'value'),
+              Input('dropdown-localidad', 'value')],
+             State('entidad-selector', 'value'))(update_distribucion_sexo)
 
-    if not total_casas.empty:
-        casas_municipio = total_casas[total_casas['Nombre Municipio Loc'] == municipio_seleccionado]
-        
-        if not casas_municipio.empty:
-            tipos_casas = casas_municipio.drop('Nombre Municipio Loc', axis=1)
-            tipos_activos = tipos_casas.loc[:, (tipos_casas > 0).any()]
-            
-            if not tipos_activos.empty:
-                total = tipos_activos.sum(axis=1).values[0]
-                
-                # --- VERSIÓN SIMPLIFICADA ---
-                items_tipos = []
-                for tipo, valor in tipos_activos.items():
-                    # Traducir el código si existe en el mapeo, sino mostrar el código original
-                    nombre = MAPEO_CASAS_SALUD.get(tipo, {}).get('name', tipo)
-                    
-                    item = html.Div([
-                        html.Strong(f"{nombre}: "),  # Negrita para el tipo
-                        html.Span(f"{valor.values[0]}")  # Valor normal
-                    ], style={'marginBottom': '3px', 'fontSize': '0.9rem'})
-                    
-                    items_tipos.append(item)
-                
-                casas_output = html.Div([
-                    html.H4(f"Total: {int(total):,}", style={'marginBottom': '10px'}),
-                    html.Div(items_tipos)
-                ])
-            else:
-                casas_output = "0"
-        else:
-            casas_output = "0"
 
-    #parteras
-    total_parteras = parteras()
-    parteras_municipio = total_parteras.loc[
-        total_parteras['Nombre Municipio Loc'] == municipio_seleccionado,
-        'Parteras'
-    ].values[0] if not total_parteras.empty else 0
+def tabla_unidad(instantanea, nombre):
+    # Tabla con la población de un municipio (df_agrupado) o de una unidad del cubo
+    if nombre in instantanea.posiciones:
+        return instantanea.df_agrupado
+    if nombre not in instantanea.cubo.posiciones:
+        raise PreventUpdate
+    return instantanea.cubo.como_tabla(nombre)
 
-    
-    #Total de unidades
-    unidades_filtradas = total_unidades_salud()
-    total_unidades_municipio = unidades_filtradas.loc[
-        unidades_filtradas['Nombre Municipio Loc'] == municipio_seleccionado,
-        'Total Unidades'
-    ].values[0] if not unidades_filtradas.empty else 0
-
-
-    return (
-        fig_piramide,
-        fig_secundario,
-        poblacion_total,
-        porcentaje_hombres,
-        porcentaje_mujeres,
-        grupo_mayoritario,
-        densidad,
-        auxiliares_formateados,
-        casas_output,
-        parteras_municipio,
-        total_unidades_municipio
+
+def figura_piramide(instantanea, municipio, localidad=None):
+    """
+    Pirámide poblacional del municipio (o jurisdicción, o estado), o de una
+    de sus localidades, ya serializada (LRU local y luego Flask-Caching).
+    """
+    i = posicion_localidad(instantanea, municipio, localidad)
+    if i is None:
+        return figuras.obtener(
+            ('piramide', instantanea.version, municipio),
+            lambda: cacheado('piramide', instantanea.version, municipio,
+                             lambda: crear_piramide_poblacional(municipio, tabla_unidad(instantanea, municipio)))
+        )
+    nombre = f"{instantanea.localidades.nombre[i]} ({municipio})"
+    return figuras.obtener(
+        ('piramide', instantanea.version, (municipio, localidad)),
+        lambda: cacheado('piramide', instantanea.version, clave_seleccion(municipio, localidad),
+                         lambda: crear_piramide_poblacional(nombre, instantanea.localidades.como_tabla(i, nombre)))
+    )
+
+
+def figura_secundaria(instantanea, municipio, localidad=None):
+    """Gráfico de distribución por sexo del municipio (o unidad del cubo) o de una de sus localidades, ya serializado."""
+    i = posicion_localidad(instantanea, municipio, localidad)
+    if i is None:
+        etiqueta = NIVELES[instantanea.cubo.niveles[municipio]]
+        return figuras.obtener(
+            ('secundario', instantanea.version, municipio),
+            lambda: cacheado('secundario', instantanea.version, municipio,
+                             lambda: crear_grafico_secundario(municipio, tabla_unidad(instantanea, municipio),
+                                                              etiqueta=etiqueta))
+        )
+    nombre = f"{instantanea.localidades.nombre[i]} ({municipio})"
+    return figuras.obtener(
+        ('secundario', instantanea.version, (municipio, localidad)),
+        lambda: cacheado('secundario', instantanea.version, clave_seleccion(municipio, localidad),
+                         lambda: crear_grafico_secundario(nombre, instantanea.localidades.como_tabla(i, nombre),
+                                                          etiqueta='Localidad'))
     )
 
+
+def precalentar_figuras(instantanea, municipios):
+    """Genera las figuras de 'municipios' para la instantánea dada."""
+    for mun in municipios:
+        if mun in instantanea.cubo.metricas:
+            figura_piramide(instantanea, mun)
+            if not CALLBACKS_CLIENTE:
+                figura_secundaria(instantanea, mun)
+
+
 # Funciones para crear gráficos (igual que en tu versión original)
-def crear_piramide_poblacional(municipio):
+@medido('figura_piramide')
+def crear_piramide_poblacional(municipio, df_agrupado):
     df_mun = df_agrupado.loc[municipio]
     rangos_edad = [col[:-2] for col in df_mun.index if col.endswith('_M')]
     
@@ -632,16 +1449,8 @@ def crear_piramide_poblacional(municipio):
     poblacion_f = df_mun[[f"{grupo}_F" for grupo in rangos_edad_ordenados]].astype(int).values.flatten()
     poblacion_m = df_mun[[f"{grupo}_M" for grupo in rangos_edad_ordenados]].astype(int).values.flatten() * -1
     
-    # Diccionario para etiquetas más amigables
-    etiquetas_edad = {
-        "P_0A4": "0-4", "P_5A9": "5-9", "P_10A14": "10-14", "P_15A19": "15-19",
-        "P_20A24": "20-24", "P_25A29": "25-29", "P_30A34": "30-34", "P_35A39": "35-39",
-        "P_40A44": "40-44", "P_45A49": "45-49", "P_50A54": "50-54", "P_55A59": "55-59",
-        "P_60A64": "60-64", "P_65A69": "65-69", "P_70A74": "70-74", "P_75A79": "75-79",
-        "P_80A84": "80-84", "P_85YMAS": "85+"
-    }
-    
-    grupos_edad_renombrados = [etiquetas_edad[grupo] for grupo in rangos_edad_ordenados]
+    # Etiquetas más amigables
+    grupos_edad_renombrados = [ETIQUETAS_EDAD[grupo] for grupo in rangos_edad_ordenados]
     
   
     color_hombres = '#AEC6CF'  
@@ -736,7 +1545,8 @@ def crear_piramide_poblacional(municipio):
     return fig
 
 # Función para crear el gráfico secundario (distribución por sexo)
-def crear_grafico_secundario(municipio):
+@medido('figura_secundario')
+def crear_grafico_secundario(municipio, df_agrupado, etiqueta='Municipio'):
     df_mun = df_agrupado.loc[municipio]
     
     # Calcular totales por sexo
@@ -759,7 +1569,7 @@ def crear_grafico_secundario(municipio):
     fig.update_layout(
         #title=f"Distribución por Sexo - Municipio: {municipio}",
         title={
-            'text': f"Distribución por Sexo - Municipio: {municipio}",
+            'text': f"Distribución por Sexo - {etiqueta}: {municipio}",
             'y':0.98,
             'x':0.5,
             'xanchor': 'center',
@@ -782,5 +1592,24 @@ def crear_grafico_secundario(municipio):
     
     return fig
 
+@datos.al_preparar
+def _precalentar_recarga(instantanea):
+    # Antes de publicar datos nuevos, regenerar las figuras que ya estaban en
+    # uso (o todas, si se precalienta) para no empezar con la cache fría
+    municipios = instantanea.municipios if PRECALENTAR_FIGURAS else figuras.municipios()
+    precalentar_figuras(instantanea, municipios)
+
+
+# Cargar los datos en segundo plano (el precalentado corre en _precalentar_recarga)
+# o generar todas las figuras al iniciar si así se configuró
+if ARRANQUE_DIFERIDO:
+    datos.iniciar_carga()
+elif PRECALENTAR_FIGURAS:
+    precalentar_figuras(datos.actual(), datos.actual().municipios)
+
+# Recargar los datos en segundo plano cuando cambien los archivos de origen
+if INTERVALO_RECARGA > 0:
+    datos.iniciar_vigilante(INTERVALO_RECARGA)
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,72 @@
+// Callbacks del navegador. Dash carga automáticamente los .js de assets/.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    mpios: {
+        // Equivalente de update_distribucion_sexo (app.py) y
+        // crear_grafico_secundario con los datos de 'datos-municipios':
+        // {municipio: [poblacion_total, hombres, mujeres]}, o los de
+        // 'datos-localidad' si hay una localidad del municipio elegida
+        distribucion_sexo: function (municipio, datos, localidad) {
+            let nombre = municipio;
+            let etiqueta = 'Municipio';
+            let valores = datos && datos[municipio];
+            if (localidad && localidad.municipio === municipio) {
+                nombre = localidad.nombre + ' (' + municipio + ')';
+                etiqueta = 'Localidad';
+                valores = localidad.valores;
+            }
+            if (!municipio || !valores) {
+                return window.dash_clientside.no_update;
+            }
+            const [poblacionTotal, hombres, mujeres] = valores;
+            const totalSexo = hombres + mujeres;
+            const miles = (x) => Math.round(x).toLocaleString('en-US');
+            // Un decimal con empates al par, como f"{x:.1f}" en Python
+            const unDecimal = (x) => {
+                const y = x * 10;
+                if (Number.isInteger(y * 2) && !Number.isInteger(y)) {
+                    const abajo = Math.floor(y);
+                    return ((abajo % 2 === 0 ? abajo : abajo + 1) / 10).toFixed(1);
+                }
+                return x.toFixed(1);
+            };
+
+            // Porcentajes con un decimal que sumen 100% (N/D si la
+            // localidad tiene todos los valores reservados)
+            let porcentajeHombres = unDecimal(hombres / totalSexo * 100);
+            let porcentajeMujeres = unDecimal(mujeres / totalSexo * 100);
+            if (Math.abs(parseFloat(porcentajeHombres) + parseFloat(porcentajeMujeres) - 100) > 0.1) {
+                porcentajeMujeres = mujeres === 0 ? '100.0' : unDecimal(100 - parseFloat(porcentajeHombres));
+            }
+
+            const leyenda = {orientation: 'h', yanchor: 'bottom', y: 1.02, xanchor: 'center', x: 0.5,
+                             font: {color: 'white'}};
+            const figura = {
+                data: [{
+                    type: 'pie',
+                    labels: ['Mujeres', 'Hombres'],
+                    values: [mujeres, hombres],
+                    hole: 0.4,
+                    marker: {colors: ['#B8E2C8', '#AEC6CF']},
+                    textinfo: 'percent+value',
+                    insidetextorientation: 'radial'
+                }],
+                layout: {
+                    title: {
+                        text: 'Distribución por Sexo - ' + etiqueta + ': ' + nombre,
+                        y: 0.98, x: 0.5, xanchor: 'center', yanchor: 'top',
+                        font: {size: 18, color: 'white'}
+                    },
+                    plot_bgcolor: '#1a1a1a',
+                    paper_bgcolor: '#1a1a1a',
+                    font: {color: 'white'},
+                    legend: leyenda
+                }
+            };
+
+            if (totalSexo === 0) {
+                return [figura, miles(poblacionTotal), 'N/D', 'N/D'];
+            }
+            return [figura, miles(poblacionTotal), porcentajeHombres + '%', porcentajeMujeres + '%'];
+        }
+    }
+});
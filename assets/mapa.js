@@ -0,0 +1,31 @@
+// Dibujo de los puntos del mapa (app.py, capa_mapa). Los grupos vienen del
+// servidor con 'cantidad' (puntos agrupados) y 'total' (población o unidades).
+// Los nombres vienen de los datos: se muestran como texto, nunca como HTML.
+window.mpios_mapa = Object.assign({}, window.mpios_mapa, {
+    punto: function (feature, latlng, context) {
+        const {cantidad, total, nombre} = feature.properties;
+        const color = context.hideout.color;
+        const miles = (x) => Math.round(x).toLocaleString('en-US');
+        const texto = (contenido) => {
+            const elemento = document.createElement('span');
+            elemento.textContent = contenido;
+            return elemento;
+        };
+
+        if (cantidad === 1) {
+            return L.circleMarker(latlng, {radius: 5, color: color, fillOpacity: 0.8, weight: 1})
+                .bindTooltip(texto(nombre + ': ' + miles(total)));
+        }
+        // Grupo: el tamaño crece con el logaritmo del número de puntos
+        const radio = 10 + 4 * Math.log10(cantidad);
+        return L.marker(latlng, {
+            icon: L.divIcon({
+                html: '<div style="background:' + color + ';width:' + 2 * radio + 'px;height:' + 2 * radio +
+                      'px;line-height:' + 2 * radio + 'px;border-radius:50%;text-align:center;color:#1a1a1a;' +
+                      'font-weight:600;opacity:0.85">' + miles(cantidad) + '</div>',
+                className: '',
+                iconSize: [2 * radio, 2 * radio]
+            })
+        }).bindTooltip(miles(cantidad) + ' puntos, total ' + miles(total));
+    }
+});
@@ -0,0 +1,545 @@
+"""
+Mediciones de rendimiento de dash_mpios.
+
+Uso:
+    python benchmark.py [caso ...] [--repeticiones N] [--escala N]
+                        [--guardar] [--comparar] [--tolerancia T] [--margen-ms M]
+
+Sin argumentos corre todos los casos y reporta percentiles de latencia (p50,
+p95, p99) y el pico de memoria de una llamada (tracemalloc).
+
+--escala N genera en un directorio temporal versiones sintéticas del ITER y
+del reporte de unidades con N veces las filas (10 y 100 para ver cómo escalan
+la carga y los agregados). Los artefactos compilados durante la corrida
+también van a ese directorio, nunca a assets/docs. Los casos de figuras y
+callbacks trabajan sobre la tabla municipal, que no cambia de tamaño con la
+escala.
+
+--guardar escribe los resultados en benchmark_baseline.json (por escala) y
+--comparar termina con código 1 si algún p50 supera la línea base en más de
+--tolerancia (0.5 = 50 %) y en más de --margen-ms milisegundos, para no
+fallar por ruido en los casos de menos de un milisegundo, o si algún caso
+no tiene línea base en esa escala. La línea base depende de la máquina:
+regénerala con --guardar (en cada escala) en la máquina donde se compare.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from types import SimpleNamespace
+
+# Medir el cómputo, no la cache de respuestas ni la recarga en segundo plano
+os.environ.setdefault("DASH_MPIOS_CACHE_TIPO", "NullCache")
+os.environ.setdefault("DASH_MPIOS_RECARGA", "0")
+warnings.filterwarnings("ignore", message="Flask-Caching: CACHE_TYPE is set to NullCache")
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import funciones
+from funciones import es_localidad
+
+RUTA_BASELINE = 'benchmark_baseline.json'
+PATRON_EXCLUIR = 'Localidades de una vivienda|Localidades de dos viviendas|Total del Municipio'
+
+CASOS = {}
+
+
+def caso(nombre):
+    """Registra una función preparar() -> callable como caso de medición."""
+    def registrar(preparar):
+        CASOS[nombre] = preparar
+        return preparar
+    return registrar
+
+
+# Rutas de funciones que una corrida con --escala apunta al directorio temporal:
+# los orígenes sintéticos y todo lo que se compila a partir de ellos
+RUTAS_ESCALA = ('RUTA_ITER', 'RUTA_UNIDADES', 'RUTA_ARTEFACTO', 'RUTA_ARTEFACTO_LOCALIDADES', 'RUTA_NACIONAL')
+
+
+def generar_escala(escala, directorio):
+    """
+    Escribe copias del ITER y del reporte de unidades con 'escala' veces las
+    filas y apunta a 'directorio' las RUTAS_ESCALA de funciones, así que los
+    artefactos que se compilen con los datos sintéticos nunca reemplazan los
+    de assets/docs. Las CLUES de las copias llevan un sufijo para que cuenten
+    como unidades distintas.
+
+    Returns:
+        dict: Valores anteriores de RUTAS_ESCALA, para restaurar_rutas().
+    """
+    anteriores = {nombre: getattr(funciones, nombre) for nombre in RUTAS_ESCALA}
+    iter_origen = pq.read_table(funciones.RUTA_ITER)
+    ruta_iter = os.path.join(directorio, f'iter_x{escala}.parquet')
+    pq.write_table(pa.concat_tables([iter_origen] * escala), ruta_iter)
+
+    unidades = pd.read_parquet(funciones.RUTA_UNIDADES)
+    copias = []
+    for i in range(escala):
+        copia = unidades.copy()
+        if i:
+            copia['CLUES'] = copia['CLUES'] + f'-{i}'
+        copias.append(copia)
+    ruta_unidades = os.path.join(directorio, f'unidades_x{escala}.parquet')
+    pd.concat(copias, ignore_index=True).to_parquet(ruta_unidades)
+
+    funciones.RUTA_ITER = ruta_iter
+    funciones.RUTA_UNIDADES = ruta_unidades
+    funciones.RUTA_ARTEFACTO = os.path.join(directorio, 'iter_municipios.arrow')
+    funciones.RUTA_ARTEFACTO_LOCALIDADES = os.path.join(directorio, 'iter_localidades.arrow')
+    # Sin particiones: la entidad predeterminada se lee de RUTA_ITER
+    funciones.RUTA_NACIONAL = os.path.join(directorio, 'iter_nacional')
+    funciones.unidades_ssa.cache_clear()
+    return anteriores
+
+
+def restaurar_rutas(anteriores):
+    """Deshace generar_escala y descarta lo que se cargó con los datos sintéticos."""
+    for nombre, valor in anteriores.items():
+        setattr(funciones, nombre, valor)
+    funciones.unidades_ssa.cache_clear()
+    if 'datos' in sys.modules:
+        datos = sys.modules['datos']
+        datos._actual = None
+        datos._entidades.clear()
+
+
+# --- Carga de datos ---
+
+@caso('agregar_iter')
+def _agregar_iter():
+    # Carga en frío: leer el parquet ITER y agregar por municipio
+    return lambda: funciones.agregar_iter(funciones.RUTA_ITER)
+
+
+@caso('obtener_datos')
+def _obtener_datos():
+    # Arranque normal: abrir el artefacto compilado
+    destino = os.path.join(tempfile.mkdtemp(), 'iter_municipios.arrow')
+    funciones.compilar_datos(funciones.RUTA_ITER, destino)
+    return lambda: funciones.cargar_artefacto(destino, funciones.RUTA_ITER)
+
+
+def _agregado_salud(funcion):
+    def llamar():
+        funciones.unidades_ssa.cache_clear()
+        return funcion()
+    return lambda: llamar
+
+
+for _nombre in ('auxiliares_salud', 'casas_salud', 'parteras', 'total_unidades_salud'):
+    caso(_nombre)(_agregado_salud(getattr(funciones, _nombre)))
+
+
+@caso('agregar_entidad_nacional')
+def _agregar_entidad_nacional():
+    # Una entidad de un ITER nacional sintético (32 entidades, particionado
+    # por ENTIDAD): sólo se abre la partición de la entidad, así que las otras
+    # 31 llevan unas cuantas filas del estatal; con --escala 100 las 32 copias
+    # completas no caben en memoria
+    tabla = pq.read_table(funciones.RUTA_ITER)
+    directorio = tempfile.mkdtemp()
+    origenes = []
+    for entidad in funciones.ENTIDADES:
+        copia = tabla if entidad == funciones.ENTIDAD_PREDETERMINADA else tabla.slice(0, 1000)
+        ruta = os.path.join(directorio, f'iter_{entidad:02d}.parquet')
+        pq.write_table(copia.set_column(copia.schema.get_field_index('ENTIDAD'), 'ENTIDAD',
+                                        pa.array([entidad] * copia.num_rows, pa.int64())), ruta)
+        origenes.append(ruta)
+    nacional = os.path.join(directorio, 'iter_nacional')
+    funciones.particionar_iter(origenes, nacional)
+    particion = os.path.join(nacional, f"ENTIDAD={funciones.ENTIDAD_PREDETERMINADA}")
+    return lambda: funciones.agregar_iter(particion)
+
+
+@caso('localidades_iter')
+def _localidades_iter():
+    # Tabla de localidades leída y convertida desde el ITER
+    return lambda: funciones.cargar_localidades(funciones.RUTA_ITER)
+
+
+@caso('localidades_artefacto')
+def _localidades_artefacto():
+    # Arranque de un worker: abrir la tabla de localidades compilada
+    destino = os.path.join(tempfile.mkdtemp(), 'iter_localidades.arrow')
+    funciones.compilar_localidades(funciones.RUTA_ITER, destino)
+    return lambda: funciones.cargar_artefacto_localidades(destino, funciones.RUTA_ITER)
+
+
+# --- Filtro de localidades ---
+
+def _localidades():
+    return pd.read_parquet(funciones.RUTA_ITER, columns=['LOC', 'NOM_LOC'])
+
+
+@caso('filtro_regex')
+def _filtro_regex():
+    df = _localidades()
+    return lambda: df[~df['NOM_LOC'].str.contains(PATRON_EXCLUIR, case=False, na=False)]
+
+
+@caso('filtro_loc')
+def _filtro_loc():
+    df = _localidades()
+    return lambda: df[es_localidad(df['LOC'])]
+
+
+@caso('filtro_loc_categorico')
+def _filtro_loc_categorico():
+    df = _localidades()
+    df['LOC'] = df['LOC'].astype(str).str.zfill(4).astype('category')
+    return lambda: df[es_localidad(df['LOC'])]
+
+
+# --- Localidades de un municipio ---
+
+def _ciclo_localidades(seleccionar):
+    """Llama seleccionar(tabla, municipio) rotando por todos los municipios."""
+    import datos
+    tabla = datos.actual().localidades
+    return _ciclo_municipios(lambda mun: seleccionar(tabla, mun))
+
+
+@caso('localidades_rango')
+def _localidades_rango():
+    # Búsqueda binaria en la tabla ordenada por (MUN, LOC)
+    def seleccionar(tabla, mun):
+        inicio, fin = tabla.rango(mun)
+        return tabla.poblacion[inicio:fin]
+    return _ciclo_localidades(seleccionar)
+
+
+@caso('localidades_mascara')
+def _localidades_mascara():
+    # Referencia: máscara booleana sobre toda la tabla
+    def seleccionar(tabla, mun):
+        return tabla.poblacion[tabla.mun == tabla.claves_municipio[mun]]
+    return _ciclo_localidades(seleccionar)
+
+
+# --- Área y densidad ---
+
+@caso('areas_municipales')
+def _areas():
+    # Precálculo de la tabla de áreas (una vez por instantánea)
+    return lambda: funciones.areas_municipales(funciones.RUTA_ITER)
+
+
+@caso('construir_metricas')
+def _construir_metricas():
+    # Indicadores de todos los municipios con la tabla de áreas ya calculada:
+    # densidad vectorizada y uniones con los agregados de salud
+    import datos
+    instantanea = datos.actual()
+    areas = funciones.areas_municipales(funciones.RUTA_ITER)
+    return lambda: funciones.construir_metricas(instantanea.df_agrupado, instantanea.poblacion, areas,
+                                                unidades=instantanea.unidades)
+
+
+@caso('densidad_completa')
+def _densidad_completa():
+    # Camino completo de la densidad al construir una instantánea: áreas
+    # desde el ITER y los límites, más los indicadores
+    import datos
+    instantanea = datos.actual()
+    return lambda: funciones.construir_metricas(instantanea.df_agrupado, instantanea.poblacion,
+                                                unidades=instantanea.unidades)
+
+
+# Entidad ficticia bajo la que se registran las instantáneas de densidad_n*
+ENTIDAD_SINTETICA = 99
+
+
+def _consulta_densidad(n):
+    """
+    1000 llamadas a update_indicadores_poblacion (búsqueda de las métricas
+    precalculadas y formato de la densidad) sobre una instantánea de 'n'
+    municipios. El tiempo debe ser el mismo con 84 que con un millón.
+    """
+    def preparar():
+        import datos
+        app = _app()
+        real = datos.actual()
+        metricas = [real.metricas[municipio] for municipio in real.municipios]
+        nombres = real.municipios if n == len(metricas) else [f"municipio_{i}" for i in range(n)]
+        tabla = {nombre: metricas[i % len(metricas)] for i, nombre in enumerate(nombres)}
+        # Misma forma que una instantánea publicada: actual(ENTIDAD_SINTETICA) la encuentra sin construirla
+        datos._entidades[ENTIDAD_SINTETICA] = datos.Instantanea(
+            f"densidad_n{n}", real.df_agrupado, nombres, real.poblacion, tabla,
+            SimpleNamespace(metricas=tabla), entidad=ENTIDAD_SINTETICA)
+        claves = [nombres[i] for i in np.random.default_rng(0).integers(0, n, 1000)]
+        return lambda: [app.update_indicadores_poblacion(clave, None, ENTIDAD_SINTETICA) for clave in claves]
+    return preparar
+
+
+for _n in (84, 10_000, 1_000_000):
+    caso(f'densidad_n{_n}')(_consulta_densidad(_n))
+
+
+# --- Cubo de agregados ---
+
+@caso('construir_cubo')
+def _cubo():
+    # Municipios -> jurisdicciones -> estado (una vez por instantánea)
+    import datos
+    instantanea = datos.actual()
+    jurisdicciones = funciones.jurisdicciones_municipales()
+    return lambda: funciones.construir_cubo(instantanea.municipios, instantanea.poblacion,
+                                            instantanea.metricas, jurisdicciones)
+
+
+# --- Mapa ---
+
+@caso('mapa_capas')
+def _mapa_capas():
+    # Agrupación de las dos capas en todos los niveles de zoom (una vez por instantánea)
+    import datos
+    import mapa
+    instantanea = datos.actual()
+    return lambda: mapa.capas.__wrapped__(instantanea)
+
+
+@caso('mapa_vista')
+def _mapa_vista():
+    # Vista de todo el estado a zoom 10, codificada como la envía update_mapa
+    import datos
+    import mapa
+    localidades = mapa.capas(datos.actual())['localidades']
+    return lambda: mapa.a_geobuf_base64(localidades.vista(10, localidades.limites()))
+
+
+# --- Exportación ---
+
+def _exportacion(formato):
+    def preparar():
+        # Archivo completo de indicadores de la entidad, por partes
+        import datos
+        import exportar
+        instantanea = datos.actual()
+        return lambda: b''.join(exportar.exportar([instantanea], formato))
+    return preparar
+
+
+for _formato in ('csv', 'parquet', 'arrow'):
+    caso(f'exportar_{_formato}')(_exportacion(_formato))
+
+
+# --- Rejilla de datos brutos ---
+
+# Petición típica de la rejilla: un bloque a mitad de la lista, filtrado y ordenado
+_PETICION_REJILLA = {
+    'startRow': 500, 'endRow': 600,
+    'sortModel': [{'colId': 'POBLACION', 'sort': 'desc'}],
+    'filterModel': {'NOM_LOC': {'filterType': 'text', 'type': 'contains', 'filter': 'san'}},
+}
+
+
+@caso('rejilla_tablas')
+def _rejilla_tablas():
+    # Tablas indexadas de localidades y unidades (una vez por instantánea)
+    import datos
+    import rejilla
+    instantanea = datos.actual()
+    return lambda: rejilla.tablas.__wrapped__(instantanea)
+
+
+@caso('rejilla_filtro')
+def _rejilla_filtro():
+    # Bloque con un filtro y orden nuevos: máscara + orden precalculado
+    import datos
+    import rejilla
+    tabla = rejilla.tablas(datos.actual())['localidades']
+
+    def bloque():
+        tabla._consultas.clear()
+        return tabla.bloque(_PETICION_REJILLA)
+    return bloque
+
+
+@caso('rejilla_bloque')
+def _rejilla_bloque():
+    # Siguiente bloque de la misma consulta (desplazamiento): sólo el recorte
+    import datos
+    import rejilla
+    tabla = rejilla.tablas(datos.actual())['localidades']
+    tabla.bloque(_PETICION_REJILLA)
+    return lambda: tabla.bloque(_PETICION_REJILLA)
+
+
+# --- Figuras y callbacks ---
+
+def _app():
+    import app
+    return app
+
+
+def _ciclo_municipios(funcion):
+    """Llama funcion(municipio) rotando por todos los municipios."""
+    import datos
+    municipios = datos.actual().municipios
+    estado = {'i': 0}
+
+    def llamar():
+        municipio = municipios[estado['i'] % len(municipios)]
+        estado['i'] += 1
+        return funcion(municipio)
+    return llamar
+
+
+@caso('crear_piramide_poblacional')
+def _piramide():
+    app = _app()
+    df_agrupado = app.datos.actual().df_agrupado
+    return _ciclo_municipios(lambda mun: app.crear_piramide_poblacional(mun, df_agrupado))
+
+
+@caso('crear_grafico_secundario')
+def _secundario():
+    app = _app()
+    df_agrupado = app.datos.actual().df_agrupado
+    return _ciclo_municipios(lambda mun: app.crear_grafico_secundario(mun, df_agrupado))
+
+
+@caso('comparacion_20')
+def _comparacion():
+    # Pirámides superpuestas y tabla de 20 municipios, sin pasar por la cache
+    app = _app()
+    instantanea = app.datos.actual()
+    municipios = instantanea.municipios[:20]
+    return lambda: app.comparacion(instantanea, municipios, 'superpuestas')
+
+
+def _callbacks_todos(app):
+    """Todos los callbacks del servidor para cada municipio (una carga completa)."""
+    municipios = app.datos.actual().municipios
+
+    def llamar():
+        for mun in municipios:
+            app.update_piramide(mun)
+            app.update_indicadores_poblacion(mun)
+            app.update_tarjetas_salud(mun)
+            app.update_distribucion_sexo(mun)
+    return llamar
+
+
+@caso('callbacks_frio')
+def _callbacks_frio():
+    app = _app()
+    todos = _callbacks_todos(app)
+
+    def llamar():
+        app.figuras.limpiar()
+        todos()
+    return llamar
+
+
+@caso('callbacks_cache')
+def _callbacks_cache():
+    app = _app()
+    todos = _callbacks_todos(app)
+    todos()
+    return todos
+
+
+# --- Ejecución ---
+
+def medir(funcion, repeticiones):
+    """Tiempos en segundos de 'repeticiones' llamadas a funcion()."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def pico_memoria(funcion):
+    """
+    Pico de memoria (bytes) asignada durante una llamada según tracemalloc.
+    Incluye los arreglos de numpy/pandas, pero no los buffers internos de Arrow.
+    """
+    tracemalloc.start()
+    try:
+        funcion()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def resumen(tiempos):
+    p = statistics.quantiles(tiempos, n=100, method='inclusive')
+    return {'p50': statistics.median(tiempos), 'p95': p[94], 'p99': p[98]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mide los caminos críticos de dash_mpios.")
+    parser.add_argument("casos", nargs="*", help=f"Casos a medir: {', '.join(CASOS)}")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--escala", type=int, default=1)
+    parser.add_argument("--guardar", action="store_true", help=f"Guardar resultados en {RUTA_BASELINE}.")
+    parser.add_argument("--comparar", action="store_true", help=f"Fallar si un p50 empeora respecto a {RUTA_BASELINE}.")
+    parser.add_argument("--tolerancia", type=float, default=0.5)
+    parser.add_argument("--margen-ms", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    desconocidos = set(args.casos) - set(CASOS)
+    if desconocidos:
+        parser.error(f"Casos desconocidos: {', '.join(sorted(desconocidos))}")
+
+    anteriores = None
+    if args.escala > 1:
+        anteriores = generar_escala(args.escala, tempfile.mkdtemp(prefix='dash_mpios_bench_'))
+
+    resultados = {}
+    try:
+        print(f"{'caso':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'pico MB':>10}")
+        for nombre in args.casos or CASOS:
+            funcion = CASOS[nombre]()
+            funcion()  # calentamiento
+            r = resumen(medir(funcion, args.repeticiones))
+            r['pico_bytes'] = pico_memoria(funcion)
+            resultados[nombre] = r
+            print(f"{nombre:<28}{r['p50'] * 1e3:>10.2f}{r['p95'] * 1e3:>10.2f}{r['p99'] * 1e3:>10.2f}"
+                  f"{r['pico_bytes'] / 1e6:>10.2f}")
+    finally:
+        if anteriores is not None:
+            restaurar_rutas(anteriores)
+
+    lineas_base = {}
+    if os.path.exists(RUTA_BASELINE):
+        with open(RUTA_BASELINE, encoding='utf-8') as archivo:
+            lineas_base = json.load(archivo)
+    escala = f"x{args.escala}"
+
+    codigo = 0
+    if args.comparar:
+        base = lineas_base.get(escala, {})
+        for nombre, r in resultados.items():
+            if nombre not in base:
+                print(f"SIN LÍNEA BASE {nombre}: corre --guardar --escala {args.escala}")
+                codigo = 1
+                continue
+            limite = max(base[nombre]['p50'] * (1 + args.tolerancia), base[nombre]['p50'] + args.margen_ms / 1e3)
+            if r['p50'] > limite:
+                print(f"REGRESIÓN {nombre}: p50 {r['p50'] * 1e3:.2f} ms "
+                      f"> línea base {base[nombre]['p50'] * 1e3:.2f} ms")
+                codigo = 1
+
+    if args.guardar:
+        lineas_base.setdefault(escala, {}).update(resultados)
+        with open(RUTA_BASELINE, 'w', encoding='utf-8') as archivo:
+            json.dump(lineas_base, archivo, indent=2, sort_keys=True)
+            archivo.write('\n')
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
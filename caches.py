@@ -0,0 +1,125 @@
+"""
+Caches de respuestas de la aplicación, en dos niveles:
+
+1. figuras: LRU en memoria del proceso con las figuras ya serializadas.
+2. cache: Flask-Caching, configurable por variables de entorno. Con
+   FileSystemCache o RedisCache la comparten todos los workers.
+
+Las claves incluyen la versión de los datos (datos.Instantanea.version), así
+que al cambiar los parquet de origen las entradas viejas dejan de usarse y
+expiran solas.
+
+Variables de entorno:
+    DASH_MPIOS_CACHE_TIPO       SimpleCache (por defecto), FileSystemCache,
+                                RedisCache o NullCache.
+    DASH_MPIOS_CACHE_TTL        Segundos de vida de cada entrada (3600).
+    DASH_MPIOS_CACHE_DIR        Directorio de FileSystemCache.
+    DASH_MPIOS_CACHE_REDIS_URL  URL de RedisCache (redis://localhost:6379/0).
+    DASH_MPIOS_CACHE_FIGURAS    Tamaño de la LRU de figuras (256).
+"""
+import json
+import os
+import tempfile
+import threading
+from collections import Counter, OrderedDict
+
+from flask_caching import Cache
+from plotly.utils import PlotlyJSONEncoder
+
+from instrumentacion import medido
+
+TAMANO_CACHE_FIGURAS = int(os.environ.get("DASH_MPIOS_CACHE_FIGURAS", 256))
+
+CONFIG_CACHE = {
+    "CACHE_TYPE": os.environ.get("DASH_MPIOS_CACHE_TIPO", "SimpleCache"),
+    "CACHE_DEFAULT_TIMEOUT": int(os.environ.get("DASH_MPIOS_CACHE_TTL", 3600)),
+    "CACHE_THRESHOLD": 2000,
+    "CACHE_DIR": os.environ.get("DASH_MPIOS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dash_mpios_cache")),
+    "CACHE_REDIS_URL": os.environ.get("DASH_MPIOS_CACHE_REDIS_URL", "redis://localhost:6379/0"),
+    "CACHE_KEY_PREFIX": "dash_mpios:",
+}
+
+
+class CacheFiguras:
+    """
+    Cache LRU acotada de figuras de plotly ya serializadas.
+
+    Guarda el dict JSON de cada figura (sin objetos de plotly ni arreglos de
+    numpy), de modo que en un acierto Dash sólo codifica el dict y no vuelve a
+    validar propiedades ni a llamar a to_plotly_json.
+    """
+
+    def __init__(self, tamano_maximo):
+        self.tamano_maximo = tamano_maximo
+        self._figuras = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, constructor):
+        """Devuelve la figura de 'clave'; si falta, la toma de constructor(), que ya la entrega serializada."""
+        with self._lock:
+            if clave in self._figuras:
+                self._figuras.move_to_end(clave)
+                return self._figuras[clave]
+
+        figura = constructor()
+
+        with self._lock:
+            self._figuras[clave] = figura
+            self._figuras.move_to_end(clave)
+            while len(self._figuras) > self.tamano_maximo:
+                self._figuras.popitem(last=False)
+        return figura
+
+    def municipios(self):
+        """Municipios con alguna figura en la cache (último elemento de la clave)."""
+        with self._lock:
+            return list(dict.fromkeys(clave[-1] for clave in self._figuras))
+
+    def limpiar(self):
+        with self._lock:
+            self._figuras.clear()
+
+
+figuras = CacheFiguras(TAMANO_CACHE_FIGURAS)
+cache = Cache()
+
+# Aciertos y fallos de 'cache' por sección
+aciertos = Counter()
+fallos = Counter()
+_lock_contadores = threading.Lock()
+
+
+def configurar_cache(server):
+    """Inicializa Flask-Caching sobre el servidor Flask de la app."""
+    cache.init_app(server, config=CONFIG_CACHE)
+
+
+@medido('serializacion')
+def a_json(valor):
+    """Convierte figuras, componentes de Dash y tuplas a tipos JSON simples."""
+    return json.loads(json.dumps(valor, cls=PlotlyJSONEncoder))
+
+
+def cacheado(seccion, version, clave, constructor):
+    """
+    Busca la salida de 'seccion' para 'clave' en la versión de datos dada; si
+    no está, la calcula con constructor(), la guarda serializada y la devuelve.
+    """
+    llave = f"{seccion}:{version}:{clave}"
+    valor = cache.get(llave)
+    with _lock_contadores:
+        (fallos if valor is None else aciertos)[seccion] += 1
+    if valor is None:
+        valor = a_json(constructor())
+        cache.set(llave, valor)
+    return valor
+
+
+def estadisticas():
+    """Aciertos y fallos de la cache por sección."""
+    with _lock_contadores:
+        secciones = sorted(set(aciertos) | set(fallos))
+        return {
+            "tipo": CONFIG_CACHE["CACHE_TYPE"],
+            "secciones": {s: {"aciertos": aciertos[s], "fallos": fallos[s]} for s in secciones},
+        }
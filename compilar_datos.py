@@ -0,0 +1,93 @@
+"""
+Compila el ITER del INEGI en las tablas que carga la aplicación: la municipal
+y la de localidades (artefactos Arrow IPC que cada worker abre con memory map).
+
+Uso:
+    python compilar_datos.py [--origen RUTA] [--destino RUTA] [--destino-localidades RUTA]
+                             [--forzar] [--diagnostico]
+    python compilar_datos.py --particionar ITER [ITER ...]
+
+Sólo recompila si cambió el archivo de origen (nombre, tamaño o mtime, ver
+funciones.firma_archivo), salvo que se indique --forzar. Con --diagnostico también escribe los CSV de comprobación
+de unidades de salud (ver funciones.exportar_diagnostico).
+
+La tabla de localidades va junto a la municipal: con el --destino por omisión
+es funciones.RUTA_ARTEFACTO_LOCALIDADES y con otro se escribe como
+<destino>_localidades, salvo que se indique --destino-localidades.
+
+--particionar escribe archivos ITER (parquet o CSV del INEGI, por entidad o
+el nacional) en el dataset particionado por ENTIDAD de funciones.RUTA_NACIONAL
+y compila las tablas de cada entidad escrita.
+"""
+import argparse
+import os
+import sys
+import time
+
+from funciones import (RUTA_ARTEFACTO, RUTA_ARTEFACTO_LOCALIDADES, RUTA_ITER, RUTA_NACIONAL, cargar_artefacto,
+                       cargar_artefacto_localidades, compilar_datos, compilar_localidades,
+                       exportar_diagnostico, origen_iter, particionar_iter, ruta_artefacto,
+                       ruta_artefacto_localidades)
+
+
+def destino_localidades(destino):
+    """Tabla de localidades que acompaña al artefacto municipal 'destino'."""
+    if destino == RUTA_ARTEFACTO:
+        return RUTA_ARTEFACTO_LOCALIDADES
+    base, extension = os.path.splitext(destino)
+    return f"{base}_localidades{extension}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compila el ITER en una tabla municipal Arrow IPC.")
+    parser.add_argument("--origen", default=None,
+                        help=f"Parquet ITER de origen (por omisión la partición de la entidad "
+                             f"predeterminada en {RUTA_NACIONAL}, o {RUTA_ITER}).")
+    parser.add_argument("--destino", default=RUTA_ARTEFACTO, help="Archivo Arrow IPC a generar.")
+    parser.add_argument("--destino-localidades", default=None,
+                        help="Archivo Arrow IPC de localidades (por omisión junto a --destino).")
+    parser.add_argument("--forzar", action="store_true", help="Recompilar aunque el origen no haya cambiado.")
+    parser.add_argument("--diagnostico", action="store_true",
+                        help="Escribir también los CSV de comprobación de unidades de salud.")
+    parser.add_argument("--particionar", nargs="+", metavar="ITER",
+                        help=f"Archivos ITER a escribir en {RUTA_NACIONAL} (particionado por ENTIDAD).")
+    args = parser.parse_args(argv)
+
+    if args.particionar:
+        inicio = time.perf_counter()
+        entidades = particionar_iter(args.particionar)
+        print(f"{RUTA_NACIONAL}: {len(entidades)} entidades en {time.perf_counter() - inicio:.2f} s")
+        for entidad in entidades:
+            df_agrupado = compilar_datos(origen_iter(entidad), ruta_artefacto(entidad))
+            print(f"{ruta_artefacto(entidad)}: {len(df_agrupado)} municipios")
+            localidades = compilar_localidades(origen_iter(entidad), ruta_artefacto_localidades(entidad))
+            print(f"{ruta_artefacto_localidades(entidad)}: {len(localidades)} localidades")
+        return 0
+
+    if args.diagnostico:
+        for ruta in exportar_diagnostico():
+            print(f"Escrito {ruta}")
+
+    if args.origen is None:
+        args.origen = origen_iter()
+
+    if not args.forzar and cargar_artefacto(args.destino, args.origen) is not None:
+        print(f"{args.destino} está al día.")
+    else:
+        inicio = time.perf_counter()
+        df_agrupado = compilar_datos(args.origen, args.destino)
+        print(f"{args.destino}: {len(df_agrupado)} municipios, "
+              f"{len(df_agrupado.columns)} columnas en {time.perf_counter() - inicio:.2f} s")
+
+    destino = args.destino_localidades or destino_localidades(args.destino)
+    if not args.forzar and cargar_artefacto_localidades(destino, args.origen) is not None:
+        print(f"{destino} está al día.")
+    else:
+        inicio = time.perf_counter()
+        localidades = compilar_localidades(args.origen, destino)
+        print(f"{destino}: {len(localidades)} localidades en {time.perf_counter() - inicio:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
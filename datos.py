@@ -0,0 +1,333 @@
+"""
+Datos en memoria de la aplicación.
+
+Los agregados (población por municipio e indicadores de salud) viven en una
+Instantanea inmutable. Cuando cambian los parquet de assets/docs, un hilo en
+segundo plano construye una instantánea nueva y la publica reemplazando una
+sola referencia, así que un callback nunca ve una tabla a medio construir.
+
+Con iniciar_carga() la primera instantánea se construye en un hilo aparte:
+el layout se arma con el índice ligero de municipios (funciones.leer_municipios)
+y los callbacks esperan en el futuro 'listo' hasta que los agregados estén.
+
+Hay una instantánea por entidad. La de ENTIDAD_PREDETERMINADA se carga al
+iniciar; las demás (particiones de funciones.RUTA_NACIONAL) sólo la primera vez
+que se piden, y se conservan a lo más MAX_ENTIDADES en cada proceso.
+"""
+import glob
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+
+import pandas as pd
+
+from funciones import (COLUMNAS_UNIDADES, COLUMNAS_UNIDADES_DETALLE, ENTIDAD_PREDETERMINADA, ENTIDADES,
+                       RUTA_LIMITES, areas_municipales, construir_cubo, construir_metricas,
+                       entidades_disponibles, leer_municipios, leer_unidades_ssa, matriz_poblacion,
+                       obtener_datos, obtener_localidades, origen_iter, salud_por_localidad,
+                       ubicacion_unidades)
+
+DIRECTORIO_DATOS = 'assets/docs'
+# Entidades, además de la predeterminada, que se mantienen cargadas por proceso
+MAX_ENTIDADES = int(os.environ.get("DASH_MPIOS_MAX_ENTIDADES", "4"))
+
+
+class Instantanea:
+    """
+    Conjunto inmutable de agregados construidos a partir de una misma versión
+    de los archivos de origen. Dos instantáneas son iguales si tienen la misma
+    versión, lo que permite usarlas como clave de cache.
+
+    'poblacion' es la matriz municipios × grupos de edad × sexo de
+    funciones.matriz_poblacion, con las filas en el orden de 'municipios';
+    'posiciones' da la fila de cada municipio.
+    'cubo' es el funciones.CuboAgregados con los municipios, las
+    jurisdicciones sanitarias y el estado. 'entidad' es la clave INEGI de la
+    entidad; los municipios se identifican por (entidad, nombre), y la
+    versión ya distingue la entidad.
+    'localidades' es la funciones.TablaLocalidades (None si no se pudo leer)
+    y 'salud_localidades' el resultado de funciones.salud_por_localidad.
+    'unidades' es el reporte de unidades (funciones.leer_unidades_ssa con
+    detalle, None fuera de ENTIDAD_PREDETERMINADA) del que salen todos los
+    datos de salud de la instantánea, y 'ubicacion_unidades' el resultado de
+    funciones.ubicacion_unidades para el mapa.
+    """
+    __slots__ = ('version', 'entidad', 'df_agrupado', 'municipios', 'posiciones', 'poblacion', 'metricas',
+                 'cubo', 'localidades', 'salud_localidades', 'unidades', 'ubicacion_unidades')
+
+    def __init__(self, version, df_agrupado, municipios, poblacion, metricas, cubo,
+                 localidades=None, salud_localidades=None, entidad=ENTIDAD_PREDETERMINADA,
+                 unidades=None, ubicacion_unidades=None):
+        self.version = version
+        self.entidad = entidad
+        self.df_agrupado = df_agrupado
+        self.municipios = municipios
+        self.posiciones = {municipio: i for i, municipio in enumerate(municipios)}
+        self.poblacion = poblacion
+        self.metricas = metricas
+        self.cubo = cubo
+        self.localidades = localidades
+        self.salud_localidades = salud_localidades or {}
+        self.unidades = unidades
+        self.ubicacion_unidades = ubicacion_unidades or {}
+
+    def __eq__(self, otra):
+        return isinstance(otra, Instantanea) and otra.version == self.version
+
+    def __hash__(self):
+        return hash(self.version)
+
+
+def version_archivos(directorio=DIRECTORIO_DATOS, entidad=ENTIDAD_PREDETERMINADA):
+    """
+    Huella corta de los archivos de origen de la entidad (los parquet de
+    'directorio', los de su partición del ITER nacional y los límites
+    municipales de las áreas) según su nombre, tamaño y mtime.
+    """
+    huella = hashlib.sha256(f"entidad:{entidad};".encode())
+    rutas = glob.glob(os.path.join(directorio, '*.parquet'))
+    try:
+        origen = origen_iter(entidad)
+        if os.path.isdir(origen):
+            rutas += glob.glob(os.path.join(origen, '**', '*.parquet'), recursive=True)
+    except FileNotFoundError:
+        pass
+    if os.path.exists(RUTA_LIMITES):
+        rutas.append(RUTA_LIMITES)
+    for ruta in sorted(rutas):
+        estado = os.stat(ruta)
+        huella.update(f"{os.path.relpath(ruta, directorio)}:{estado.st_size}:{estado.st_mtime_ns};".encode())
+    return huella.hexdigest()[:12]
+
+
+def construir_instantanea(entidad=ENTIDAD_PREDETERMINADA):
+    """
+    Carga y agrega todos los datos de origen de una entidad. Los datos de
+    salud (reporte de unidades HGSSA) sólo existen para ENTIDAD_PREDETERMINADA.
+
+    Raises:
+        ValueError: Si no se pudo cargar la población por municipio.
+    """
+    version = version_archivos(entidad=entidad)
+    predeterminada = entidad == ENTIDAD_PREDETERMINADA
+    df_agrupado, municipios = obtener_datos(entidad)
+    if df_agrupado is None:
+        raise ValueError(f"No se pudieron cargar los datos de la entidad {entidad}.")
+    poblacion = matriz_poblacion(df_agrupado)
+    # Las áreas salen de la tabla de localidades (artefacto con memory map),
+    # así que el worker no vuelve a leer el ITER
+    localidades = obtener_localidades(entidad)
+    areas = None
+    if localidades is not None:
+        areas = areas_municipales(limites=RUTA_LIMITES, entidad=entidad, localidades=localidades)
+    # El reporte de unidades se lee una vez para esta instantánea y de él
+    # salen todos sus datos de salud; una instantánea anterior que siga en
+    # uso conserva el suyo
+    unidades = None
+    if predeterminada:
+        try:
+            unidades = leer_unidades_ssa(detalle=True)
+        except Exception as e:
+            print(f"No se pudo leer el reporte de unidades: {e}")
+            unidades = pd.DataFrame(columns=COLUMNAS_UNIDADES + COLUMNAS_UNIDADES_DETALLE)
+    metricas = construir_metricas(df_agrupado, poblacion, areas, entidad=entidad, unidades=unidades)
+    cubo = construir_cubo(municipios, poblacion, metricas, None if predeterminada else pd.Series(dtype=object),
+                          ENTIDADES.get(entidad, str(entidad)))
+    return Instantanea(version, df_agrupado, municipios, poblacion, metricas, cubo,
+                       localidades, salud_por_localidad(unidades) if predeterminada else {},
+                       entidad=entidad, unidades=unidades,
+                       ubicacion_unidades=ubicacion_unidades(unidades) if predeterminada else {})
+
+
+_actual = None
+# Instantáneas de las otras entidades, de la menos a la más recién usada
+_entidades = OrderedDict()
+_lock_construccion = threading.Lock()
+# Funciones f(instantanea) que se llaman con la instantánea nueva antes de publicarla
+_al_preparar = []
+# Se resuelve con la primera instantánea publicada (o con el error de la carga)
+listo = Future()
+_carga_diferida = False
+
+
+def actual(entidad=None, espera=None):
+    """
+    Instantánea vigente de la entidad (por omisión ENTIDAD_PREDETERMINADA).
+    Si la carga se inició con iniciar_carga(), espera hasta 'espera'
+    segundos a que termine; si no, la construye en la primera llamada.
+
+    Raises:
+        TimeoutError: Si la carga diferida no terminó a tiempo.
+        ValueError: Si la entidad no tiene datos.
+    """
+    if entidad is not None and int(entidad) != ENTIDAD_PREDETERMINADA:
+        return _actual_entidad(int(entidad))
+    if _actual is None:
+        if _carga_diferida:
+            return listo.result(timeout=espera)
+        with _lock_construccion:
+            if _actual is None:
+                _publicar(construir_instantanea())
+    return _actual
+
+
+def _actual_entidad(entidad):
+    # Instantánea de otra entidad: se construye la primera vez que se pide
+    instantanea = _entidades.get(entidad)
+    if instantanea is None:
+        with _lock_construccion:
+            instantanea = _entidades.get(entidad)
+            if instantanea is None:
+                instantanea = construir_instantanea(entidad)
+                for funcion in _al_preparar:
+                    funcion(instantanea)
+                _publicar(instantanea)
+    try:
+        _entidades.move_to_end(entidad)
+    except KeyError:
+        # Otro hilo la descartó mientras tanto; ésta sigue siendo válida
+        pass
+    return instantanea
+
+
+def sin_publicar(entidad):
+    """
+    Instantánea de la entidad para una lectura de una sola vez (la
+    exportación de indicadores): la vigente si ya está cargada o, si no, una
+    construida desde sus artefactos compilados sin publicarla. No toma
+    _lock_construccion ni entra en las MAX_ENTIDADES del proceso, así que no
+    detiene las cargas ni desplaza las entidades que se están consultando.
+    """
+    entidad = int(entidad)
+    vigente = _actual if entidad == ENTIDAD_PREDETERMINADA else _entidades.get(entidad)
+    return vigente if vigente is not None else construir_instantanea(entidad)
+
+
+def esta_listo():
+    return _actual is not None
+
+
+def entidades():
+    """Claves de las entidades con datos (funciones.entidades_disponibles)."""
+    return entidades_disponibles()
+
+
+@lru_cache(maxsize=8)
+def _indice_municipios(entidad=ENTIDAD_PREDETERMINADA):
+    return leer_municipios(origen_iter(entidad))
+
+
+def municipios(entidad=None):
+    """Municipios de la instantánea vigente, o del índice ligero si aún no carga."""
+    entidad = ENTIDAD_PREDETERMINADA if entidad is None else int(entidad)
+    instantanea = _actual if entidad == ENTIDAD_PREDETERMINADA else _entidades.get(entidad)
+    return instantanea.municipios if instantanea is not None else _indice_municipios(entidad)
+
+
+def estado():
+    """Estado de la carga de datos para el endpoint de disponibilidad."""
+    instantanea = _actual
+    if instantanea is not None:
+        return {"estado": "listo", "version": instantanea.version}
+    if listo.done() and listo.exception() is not None:
+        return {"estado": "error", "error": str(listo.exception())}
+    return {"estado": "cargando"}
+
+
+def al_preparar(funcion):
+    """Registra funcion(instantanea) para precalentar caches antes de publicar."""
+    _al_preparar.append(funcion)
+    return funcion
+
+
+def _publicar(instantanea):
+    global _actual, listo
+    if instantanea.entidad != ENTIDAD_PREDETERMINADA:
+        _entidades[instantanea.entidad] = instantanea
+        _entidades.move_to_end(instantanea.entidad)
+        while len(_entidades) > MAX_ENTIDADES:
+            _entidades.popitem(last=False)
+        return
+    _actual = instantanea
+    if listo.done():
+        # Una carga anterior falló: los que esperen de aquí en adelante ya no
+        # deben ver ese error
+        if listo.exception() is not None:
+            resuelto = Future()
+            resuelto.set_result(instantanea)
+            listo = resuelto
+    else:
+        listo.set_result(instantanea)
+
+
+def recargar_si_cambio():
+    """
+    Reconstruye y publica una instantánea nueva de cada entidad cargada
+    cuyos archivos cambiaron.
+
+    Returns:
+        bool: True si se publicó alguna instantánea nueva.
+    """
+    with _lock_construccion:
+        cargadas = [ENTIDAD_PREDETERMINADA] + list(_entidades)
+        vigentes = {ENTIDAD_PREDETERMINADA: _actual, **_entidades}
+        publicada = False
+        for entidad in cargadas:
+            vigente = vigentes[entidad]
+            if vigente is not None and version_archivos(entidad=entidad) == vigente.version:
+                continue
+            nueva = construir_instantanea(entidad)
+            for funcion in _al_preparar:
+                funcion(nueva)
+            _publicar(nueva)
+            publicada = True
+        return publicada
+
+
+def _cargar():
+    try:
+        with _lock_construccion:
+            if _actual is None:
+                nueva = construir_instantanea()
+                for funcion in _al_preparar:
+                    funcion(nueva)
+                _publicar(nueva)
+        print(f"Datos cargados (versión {_actual.version}).")
+    except Exception as e:
+        print(f"Error al cargar los datos: {e}")
+        if not listo.done():
+            listo.set_exception(e)
+
+
+def iniciar_carga():
+    """
+    Construye la primera instantánea en un hilo daemon. Mientras tanto
+    actual() espera en 'listo' y municipios() usa el índice ligero.
+    """
+    global _carga_diferida
+    _carga_diferida = True
+    hilo = threading.Thread(target=_cargar, name='carga-datos', daemon=True)
+    hilo.start()
+    return hilo
+
+
+def _vigilar(intervalo):
+    while True:
+        time.sleep(intervalo)
+        try:
+            if recargar_si_cambio():
+                print(f"Datos recargados (versión {_actual.version}).")
+        except Exception as e:
+            # Se conserva la instantánea anterior
+            print(f"Error al recargar los datos: {e}")
+
+
+def iniciar_vigilante(intervalo):
+    """Revisa assets/docs cada 'intervalo' segundos en un hilo daemon."""
+    hilo = threading.Thread(target=_vigilar, args=(intervalo,), name='vigilante-datos', daemon=True)
+    hilo.start()
+    return hilo
@@ -0,0 +1,136 @@
+"""
+Exportación de los indicadores por municipio: población por grupo de edad y
+sexo, área, densidad, auxiliares, casas de salud, parteras y unidades.
+
+La tabla se arma por entidad (tabla_indicadores) y exportar() la escribe
+como CSV, Parquet o Arrow IPC (stream) entregando los bytes por partes desde
+un generador, así que una exportación de varias entidades nunca se
+construye completa en memoria: a lo más hay una entidad a la vez.
+"""
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.parquet as pq
+
+from funciones import COLUMNAS_SEXO, ENTIDADES
+from instrumentacion import medido
+
+# Formato -> tipo MIME de la respuesta
+FORMATOS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+ESQUEMA = pa.schema(
+    [('ENTIDAD', pa.uint8()), ('NOM_ENT', pa.string()), ('MUN', pa.uint16()), ('NOM_MUN', pa.string()),
+     ('POBTOT', pa.uint32())]
+    + [(columna, pa.uint32()) for columna in COLUMNAS_SEXO]
+    + [('AREA_KM2', pa.float64()), ('DENSIDAD', pa.float64()), ('AUXILIARES', pa.uint32()),
+       ('CASAS_SALUD', pa.uint32()), ('PARTERAS', pa.uint32()), ('UNIDADES', pa.uint32())]
+)
+
+
+@medido('exportar_tabla')
+def tabla_indicadores(instantanea):
+    """
+    Indicadores de los municipios de una instantánea con el esquema ESQUEMA.
+    MUN es nulo si no se cargó la tabla de localidades, y CASAS_SALUD,
+    AUXILIARES, PARTERAS y UNIDADES si no hay datos de salud.
+
+    Returns:
+        pa.Table: Una fila por municipio, en el orden de instantanea.municipios.
+    """
+    municipios = instantanea.municipios
+    metricas = [instantanea.metricas[municipio] for municipio in municipios]
+    claves = instantanea.localidades.claves_municipio if instantanea.localidades is not None else {}
+    poblacion = instantanea.poblacion.reshape(len(municipios), -1)
+
+    columnas = {
+        'ENTIDAD': [instantanea.entidad] * len(municipios),
+        'NOM_ENT': [ENTIDADES.get(instantanea.entidad)] * len(municipios),
+        'MUN': [claves.get(municipio) for municipio in municipios],
+        'NOM_MUN': municipios,
+        'POBTOT': [m.poblacion_total for m in metricas],
+    }
+    # Las columnas de la matriz están en el orden de COLUMNAS_SEXO
+    for j, columna in enumerate(COLUMNAS_SEXO):
+        columnas[columna] = poblacion[:, j]
+    columnas.update({
+        'AREA_KM2': [m.area_km2 for m in metricas],
+        'DENSIDAD': [m.densidad for m in metricas],
+        'AUXILIARES': [m.auxiliares for m in metricas],
+        'CASAS_SALUD': [None if m.casas is None else sum(m.casas.values()) for m in metricas],
+        'PARTERAS': [m.parteras for m in metricas],
+        'UNIDADES': [m.unidades for m in metricas],
+    })
+    # from_pandas: los conteos de salud en NaN (sin datos) se escriben como nulos
+    return pa.table({campo.name: pa.array(columnas[campo.name], campo.type, from_pandas=True) for campo in ESQUEMA},
+                    schema=ESQUEMA)
+
+
+class _Salida:
+    """Destino de escritura que guarda lo escrito hasta que se vacía."""
+
+    def __init__(self):
+        self.partes = []
+        self.posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def vaciar(self):
+        datos = b''.join(self.partes)
+        self.partes.clear()
+        return datos
+
+
+def exportar(instantaneas, formato):
+    """
+    Genera el archivo de indicadores en 'formato' (ver FORMATOS) por partes.
+
+    Args:
+        instantaneas (iterable): Instantáneas de datos, una por entidad. Se
+            recorren una por una, así que puede ser un generador que cargue
+            cada entidad cuando se necesita.
+        formato (str): 'csv', 'parquet' o 'arrow'.
+
+    Yields:
+        bytes: Partes del archivo, una por entidad más el cierre.
+
+    Raises:
+        ValueError: Si el formato no existe.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+    salida = _Salida()
+    archivo = pa.PythonFile(salida, mode='w')
+    if formato == 'csv':
+        escritor = pcsv.CSVWriter(archivo, ESQUEMA)
+    elif formato == 'parquet':
+        escritor = pq.ParquetWriter(archivo, ESQUEMA)
+    else:
+        escritor = pa.ipc.new_stream(archivo, ESQUEMA)
+
+    try:
+        for instantanea in instantaneas:
+            escritor.write_table(tabla_indicadores(instantanea))
+            parte = salida.vaciar()
+            if parte:
+                yield parte
+    finally:
+        escritor.close()
+    cierre = salida.vaciar()
+    if cierre:
+        yield cierre
@@ -1,5 +1,72 @@
 
+import hashlib
+import json
+import os
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd 
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from instrumentacion import medido
+
+RUTA_ITER = 'assets/docs/conjunto_de_datos_iter_13CSV20.parquet'
+# ITER nacional particionado por entidad (ENTIDAD=<clave>/*.parquet), generado
+# con compilar_datos.py --particionar. Cada entidad se lee sólo de su partición.
+RUTA_NACIONAL = 'assets/docs/iter_nacional'
+# Tabla municipal ya agregada (Arrow IPC), generada con compilar_datos.py
+RUTA_ARTEFACTO = 'assets/docs/iter_municipios.arrow'
+# Tabla de localidades ya convertida (Arrow IPC), generada con compilar_datos.py
+RUTA_ARTEFACTO_LOCALIDADES = 'assets/docs/iter_localidades.arrow'
+RUTA_UNIDADES = 'assets/docs/Reporte Auxiliares, Casas de Salud y Parteras.parquet'
+# Límites municipales (GeoJSON) opcionales para el área; sin ellos se estima
+# con las coordenadas de las localidades
+RUTA_LIMITES = 'assets/docs/municipios.geojson'
+
+RADIO_TIERRA_KM = 6371.0088
+# Margen alrededor de las localidades al estimar el área de un municipio.
+# Con 1 km la estimación queda cerca del área oficial en la mayoría de los
+# municipios de Hidalgo; la envolvente sola la subestima.
+MARGEN_AREA_KM = 1.0
+
+# Claves LOC del ITER que no son localidades: 0000 es el total (del municipio
+# o, con MUN 000, de la entidad); 9998 y 9999 agrupan las localidades de una y
+# de dos viviendas
+LOC_AGREGADOS = [0, 9998, 9999]
+
+# Marcas del INEGI para valores confidenciales o no disponibles; cuentan como 0
+MARCAS_SUPRIMIDAS = ['*', 'N/D']
+
+# Entidad de RUTA_ITER y del reporte de unidades HGSSA; las demás entidades
+# sólo tienen datos de población
+ENTIDAD_PREDETERMINADA = 13
+
+# Catálogo de entidades federativas del INEGI
+ENTIDADES = {
+    1: 'Aguascalientes', 2: 'Baja California', 3: 'Baja California Sur', 4: 'Campeche',
+    5: 'Coahuila de Zaragoza', 6: 'Colima', 7: 'Chiapas', 8: 'Chihuahua', 9: 'Ciudad de México',
+    10: 'Durango', 11: 'Guanajuato', 12: 'Guerrero', 13: 'Hidalgo', 14: 'Jalisco', 15: 'México',
+    16: 'Michoacán de Ocampo', 17: 'Morelos', 18: 'Nayarit', 19: 'Nuevo León', 20: 'Oaxaca',
+    21: 'Puebla', 22: 'Querétaro', 23: 'Quintana Roo', 24: 'San Luis Potosí', 25: 'Sinaloa',
+    26: 'Sonora', 27: 'Tabasco', 28: 'Tamaulipas', 29: 'Tlaxcala', 30: 'Veracruz de Ignacio de la Llave',
+    31: 'Yucatán', 32: 'Zacatecas',
+}
+
+# Niveles de agregación del cubo (construir_cubo), de menor a mayor, con su
+# etiqueta para la interfaz
+NIVELES = {'municipio': 'Municipio', 'jurisdiccion': 'Jurisdicción', 'estado': 'Entidad'}
+
+# Columnas del reporte de unidades que usan los agregados de salud
+COLUMNAS_UNIDADES = ['CLUES', 'Nombre Municipio Loc', 'Clave Municipio Loc', 'Clave Localidad',
+                     'Auxiliar de Salud', 'Tipo Casa Salud', 'Parteras']
+# Columnas adicionales para la rejilla de datos brutos y la ubicación de las
+# unidades en el mapa (leer_unidades_ssa(detalle=True))
+COLUMNAS_UNIDADES_DETALLE = ['Nombre Unidad', 'Nombre Localidad']
 
 COLUMNAS_FINALES = ["NOM_MUN","P_0A4","P_0A4_F","P_0A4_M","P_5A9","P_5A9_F","P_5A9_M","P_10A14","P_10A14_F","P_10A14_M","P_15A19","P_15A19_F",
             "P_15A19_M","P_20A24","P_20A24_F","P_20A24_M","P_25A29","P_25A29_F","P_25A29_M","P_30A34","P_30A34_F","P_30A34_M",
@@ -8,25 +75,355 @@ COLUMNAS_FINALES = ["NOM_MUN","P_0A4","P_0A4_F","P_0A4_M","P_5A9","P_5A9_F","P_5
             "P_65A69_M","P_70A74","P_70A74_F","P_70A74_M","P_75A79","P_75A79_F","P_75A79_M","P_80A84","P_80A84_F","P_80A84_M",
             "P_85YMAS","P_85YMAS_F","P_85YMAS_M"]
 
+# Etiquetas amigables para los grupos de edad
+ETIQUETAS_EDAD = {
+    "P_0A4": "0-4", "P_5A9": "5-9", "P_10A14": "10-14", "P_15A19": "15-19",
+    "P_20A24": "20-24", "P_25A29": "25-29", "P_30A34": "30-34", "P_35A39": "35-39",
+    "P_40A44": "40-44", "P_45A49": "45-49", "P_50A54": "50-54", "P_55A59": "55-59",
+    "P_60A64": "60-64", "P_65A69": "65-69", "P_70A74": "70-74", "P_75A79": "75-79",
+    "P_80A84": "80-84", "P_85YMAS": "85+"
+}
+
+# Ejes de la matriz de población (ver matriz_poblacion)
+GRUPOS_EDAD = list(ETIQUETAS_EDAD)
+SEXOS = ('F', 'M')
+COLUMNAS_SEXO = [f"{grupo}_{sexo}" for grupo in GRUPOS_EDAD for sexo in SEXOS]
+
+
+
+@medido('parquet_iter')
+def agregar_iter(ruta=RUTA_ITER):
+    """
+    Lee el ITER de una entidad (archivo o partición de RUTA_NACIONAL) y suma
+    la población por municipio.
+
+    Sólo se decodifican las columnas de COLUMNAS_FINALES, y las filas de
+    totales (LOC en LOC_AGREGADOS) se descartan al leer. La
+    conversión a enteros y la suma se hacen en Arrow, sin pasar por pandas.
+    Se agrupa por la clave MUN, no por el nombre; el índice es la etiqueta de
+    etiquetas_municipio, única por MUN.
+
+    Returns:
+        pd.DataFrame: Indexado por 'NOM_MUN' con las columnas de COLUMNAS_FINALES.
+
+    Raises:
+        ValueError: Si no hay filas.
+    """
+    tabla = pq.read_table(
+        ruta,
+        columns=['MUN'] + COLUMNAS_FINALES,
+        filters=filtro_localidades(tipo_columna(ruta, 'LOC')),
+    )
+    if tabla.num_rows == 0:
+        raise ValueError("El DataFrame está vacío o no se leyo correctamente.")
+
+    tabla = a_enteros(tabla, ['MUN'] + COLUMNAS_FINALES[1:])
+    sumas = tabla.group_by(['MUN', 'NOM_MUN']).aggregate([(col, 'sum') for col in COLUMNAS_FINALES[1:]])
+    sumas = sumas.rename_columns([col.removesuffix('_sum') for col in sumas.column_names])
+    df_agrupado = sumas.to_pandas()
+    df_agrupado['NOM_MUN'] = etiquetas_municipio(df_agrupado['MUN'], df_agrupado['NOM_MUN'])
+    return df_agrupado.set_index('NOM_MUN').sort_index()[COLUMNAS_FINALES[1:]].fillna(0).astype('uint32')
 
 
-def obtener_datos():
+def etiquetas_municipio(mun, nombre):
+    """
+    Etiqueta de cada municipio de una entidad, que es también su clave en
+    las métricas, el cubo, la lista de municipios y la cache: el nombre, o
+    'Nombre (MUN)' si otro municipio de la entidad (otra clave MUN) se llama
+    igual. Así cada MUN tiene una etiqueta distinta.
+
+    Args:
+        mun (array-like): Clave MUN de cada fila.
+        nombre (array-like): NOM_MUN de cada fila (puede repetirse por fila).
+
+    Returns:
+        np.ndarray: Etiqueta de cada fila.
+    """
+    mun = np.asarray(mun).tolist()
+    nombre = np.asarray(nombre, dtype=object).tolist()
+    claves = {}
+    for m, n in set(zip(mun, nombre)):
+        claves.setdefault(n, set()).add(m)
+    repetidos = {n for n, ms in claves.items() if len(ms) > 1}
+    return np.array([f"{n} ({int(m):03d})" if n in repetidos else n for m, n in zip(mun, nombre)], dtype=object)
+
+
+def tipo_columna(ruta, columna):
+    """Tipo de 'columna' en un parquet o en un directorio de parquet (partición)."""
+    return ds.dataset(ruta, format='parquet').schema.field(columna).type
+
+
+def filtro_localidades(tipo_loc=pa.int64()):
+    """
+    Filtro para 'filters=' de pyarrow/pandas que deja sólo localidades.
+
+    Args:
+        tipo_loc (pa.DataType): Tipo de la columna LOC en el archivo. El ITER
+            publicado en CSV la trae como texto con ceros ('0000').
+
+    Returns:
+        list: Filtro [('LOC', 'not in', claves)].
+    """
+    if pa.types.is_string(tipo_loc) or pa.types.is_large_string(tipo_loc):
+        return [('LOC', 'not in', [f"{loc:04d}" for loc in LOC_AGREGADOS])]
+    return [('LOC', 'not in', LOC_AGREGADOS)]
+
+
+def es_localidad(loc):
+    """
+    Máscara booleana de las filas del ITER que son localidades reales.
+
+    Usa las claves LOC (LOC_AGREGADOS), no el texto de NOM_LOC, así que no
+    depende del orden de las filas ni de la redacción de los nombres. Acepta
+    claves numéricas, texto ('0000', '9998') o categóricas; en las categóricas
+    sólo se evalúan las categorías y la máscara se expande con los códigos.
+
+    Args:
+        loc (pd.Series): Columna LOC del ITER.
+
+    Returns:
+        np.ndarray: True para las localidades, False para totales y agrupaciones.
+    """
+    if isinstance(loc.dtype, pd.CategoricalDtype):
+        categorias = es_localidad(pd.Series(loc.cat.categories))
+        codigos = loc.cat.codes.to_numpy()
+        return np.where(codigos >= 0, categorias[codigos], False)
+    if pd.api.types.is_numeric_dtype(loc.dtype):
+        return ~loc.isin(LOC_AGREGADOS).to_numpy()
+    claves = [str(c) for c in LOC_AGREGADOS] + [f"{c:04d}" for c in LOC_AGREGADOS]
+    return (~loc.isin(claves) & loc.notna()).to_numpy()
+
+
+def filtrar_localidades(df, columna='LOC'):
+    """Filas de df que son localidades reales (ver es_localidad)."""
+    return df[es_localidad(df[columna])]
+
+
+def a_enteros(tabla, columnas):
+    """
+    Convierte columnas de conteos del ITER (texto) a uint32 en Arrow.
+
+    Las marcas de MARCAS_SUPRIMIDAS se vuelven nulos; cualquier otro valor no
+    numérico produce un error en lugar de perderse en silencio.
+
+    Args:
+        tabla (pa.Table): Tabla con las columnas a convertir.
+        columnas (list): Nombres de las columnas de conteos.
+
+    Returns:
+        pa.Table: La misma tabla con esas columnas como uint32.
+    """
+    marcas = pa.array(MARCAS_SUPRIMIDAS)
+    for col in columnas:
+        i = tabla.schema.get_field_index(col)
+        valores = tabla.column(i)
+        if pa.types.is_string(valores.type) or pa.types.is_large_string(valores.type):
+            valores = pc.if_else(pc.is_in(valores, value_set=marcas), None, valores)
+        tabla = tabla.set_column(i, col, pc.cast(valores, pa.uint32()))
+    return tabla
+
+
+def suma_archivo(ruta):
+    """
+    Suma SHA-256 (hex) del contenido de un archivo o, si 'ruta' es un
+    directorio (una partición), de sus archivos en orden de nombre.
+    """
+    suma = hashlib.sha256()
+    if os.path.isdir(ruta):
+        archivos = sorted(os.path.join(raiz, nombre) for raiz, _, nombres in os.walk(ruta) for nombre in nombres)
+    else:
+        archivos = [ruta]
+    for nombre in archivos:
+        suma.update(os.path.relpath(nombre, ruta).encode())
+        with open(nombre, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(1 << 20), b''):
+                suma.update(bloque)
+    return suma.hexdigest()
+
+
+def firma_archivo(ruta):
+    """
+    Firma de un archivo o directorio (partición) según el nombre, tamaño y
+    mtime de sus archivos. Sólo consulta el sistema de archivos, sin leer el
+    contenido, así que cada worker puede revisar un artefacto sin costo.
+    """
+    if os.path.isdir(ruta):
+        archivos = sorted(os.path.join(raiz, nombre) for raiz, _, nombres in os.walk(ruta) for nombre in nombres)
+    else:
+        archivos = [ruta]
+    firma = hashlib.sha256()
+    for nombre in archivos:
+        estado = os.stat(nombre)
+        firma.update(f"{os.path.relpath(nombre, ruta)}:{estado.st_size}:{estado.st_mtime_ns};".encode())
+    return firma.hexdigest()
+
+
+def entidades_disponibles(nacional=None):
+    """
+    Claves de las entidades con datos: las particiones ENTIDAD=<clave> de
+    RUTA_NACIONAL más ENTIDAD_PREDETERMINADA, que siempre está (de su
+    partición o de RUTA_ITER, ver origen_iter) y es la que se muestra al
+    abrir la aplicación. Sólo lista directorios, no abre ningún parquet.
+    """
+    nacional = RUTA_NACIONAL if nacional is None else nacional
+    entidades = {ENTIDAD_PREDETERMINADA}
+    if os.path.isdir(nacional):
+        for nombre in os.listdir(nacional):
+            clave, _, valor = nombre.partition('=')
+            if clave == 'ENTIDAD' and valor.isdigit():
+                entidades.add(int(valor))
+    return sorted(entidades)
+
+
+def origen_iter(entidad=ENTIDAD_PREDETERMINADA):
+    """
+    ITER de una entidad: su partición de RUTA_NACIONAL si existe, o
+    RUTA_ITER para ENTIDAD_PREDETERMINADA.
+
+    Raises:
+        FileNotFoundError: Si la entidad no tiene datos.
+    """
+    particion = os.path.join(RUTA_NACIONAL, f"ENTIDAD={int(entidad)}")
+    if os.path.isdir(particion):
+        return particion
+    if entidad == ENTIDAD_PREDETERMINADA:
+        return RUTA_ITER
+    raise FileNotFoundError(f"No hay datos del ITER para la entidad {entidad}.")
+
+
+def ruta_artefacto(entidad=ENTIDAD_PREDETERMINADA, ruta=None):
+    """
+    Artefacto compilado de la entidad: 'ruta' (por omisión RUTA_ARTEFACTO)
+    para la predeterminada y <ruta>_<clave> para las demás.
+    """
+    ruta = RUTA_ARTEFACTO if ruta is None else ruta
+    if entidad == ENTIDAD_PREDETERMINADA:
+        return ruta
+    base, extension = os.path.splitext(ruta)
+    return f"{base}_{int(entidad):02d}{extension}"
+
+
+def ruta_artefacto_localidades(entidad=ENTIDAD_PREDETERMINADA):
+    """Tabla de localidades compilada de la entidad (ver ruta_artefacto)."""
+    return ruta_artefacto(entidad, RUTA_ARTEFACTO_LOCALIDADES)
+
+
+@medido('particionar')
+def particionar_iter(origenes, destino=None):
+    """
+    Escribe archivos ITER (parquet o el CSV del INEGI, de una entidad o
+    nacionales) como dataset parquet particionado por ENTIDAD
+    (destino/ENTIDAD=<clave>/). Las particiones de las entidades que vienen
+    en 'origenes' se reemplazan; las demás se conservan.
+
+    Returns:
+        list: Claves de las entidades escritas.
+    """
+    destino = RUTA_NACIONAL if destino is None else destino
+    escritas = set()
+    for origen in origenes:
+        if origen.lower().endswith('.csv'):
+            # Todo como texto: a_enteros convierte al leer y respeta las marcas '*'
+            columnas = pcsv.open_csv(origen).schema.names
+            tabla = pcsv.read_csv(origen, convert_options=pcsv.ConvertOptions(
+                column_types={col: pa.string() for col in columnas}))
+        else:
+            tabla = pq.read_table(origen)
+        i = tabla.schema.get_field_index('ENTIDAD')
+        tabla = tabla.set_column(i, 'ENTIDAD', pc.cast(tabla.column(i), pa.int32()))
+        pq.write_to_dataset(tabla, destino, partition_cols=['ENTIDAD'],
+                            existing_data_behavior='delete_matching')
+        escritas.update(pc.unique(tabla.column('ENTIDAD')).to_pylist())
+    return sorted(escritas)
+
+
+@medido('artefacto_compilar')
+def compilar_datos(origen=RUTA_ITER, destino=RUTA_ARTEFACTO):
+    """
+    Agrega el ITER por municipio y escribe el resultado como archivo Arrow IPC
+    con columnas uint32 (ver escribir_artefacto).
+
+    Returns:
+        pd.DataFrame: La tabla agregada, igual que agregar_iter.
+    """
+    df_agrupado = agregar_iter(origen)
+    escribir_artefacto(pa.Table.from_pandas(df_agrupado, preserve_index=True), origen, destino)
+    return df_agrupado
+
+
+def escribir_artefacto(tabla, origen, destino):
+    """
+    Escribe 'tabla' como archivo Arrow IPC de un solo lote. En los metadatos
+    del esquema se guardan la firma del origen (firma_archivo), con la que
+    se decide si el artefacto está al día, y su suma SHA-256 como referencia.
+
+    La escritura es atómica: se escribe a un temporal y se renombra.
+    """
+    tabla = tabla.combine_chunks().replace_schema_metadata({
+        **(tabla.schema.metadata or {}),
+        b'origen': os.path.basename(origen).encode(),
+        b'origen_firma': firma_archivo(origen).encode(),
+        b'origen_sha256': suma_archivo(origen).encode(),
+    })
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    with pa.OSFile(temporal, 'wb') as salida, pa.ipc.new_file(salida, tabla.schema) as escritor:
+        escritor.write_table(tabla, max_chunksize=max(tabla.num_rows, 1))
+    os.replace(temporal, destino)
+
+
+def abrir_artefacto(destino, origen):
+    """
+    Abre con memory map un artefacto de escribir_artefacto si existe y su
+    firma coincide con la del origen actual. Si el origen no está disponible
+    (p. ej. un despliegue que sólo lleva los artefactos) se usa tal cual. No
+    se lee el origen, sólo su tamaño y mtime.
+
+    Returns:
+        pa.Table | None: La tabla (sin copiar), o None si no existe o está desactualizada.
+    """
+    if not os.path.exists(destino):
+        return None
+    tabla = pa.ipc.open_file(pa.memory_map(destino, 'r')).read_all()
+    metadatos = tabla.schema.metadata or {}
+    if os.path.exists(origen) and metadatos.get(b'origen_firma', b'').decode() != firma_archivo(origen):
+        return None
+    return tabla
+
+
+@medido('artefacto_cargar')
+def cargar_artefacto(destino=RUTA_ARTEFACTO, origen=RUTA_ITER):
+    """
+    Carga la tabla municipal compilada si existe y corresponde al archivo de
+    origen actual (ver abrir_artefacto).
+
+    El archivo se abre con memory map y las columnas uint32 se entregan sin
+    copiar (split_blocks), así que varios procesos que lo cargan comparten
+    las mismas páginas del sistema operativo. Los arreglos son de sólo lectura.
+
+    Returns:
+        pd.DataFrame | None: La tabla agregada, o None si no existe o está desactualizada.
+    """
+    tabla = abrir_artefacto(destino, origen)
+    return None if tabla is None else tabla.to_pandas(split_blocks=True)
+
+
+def obtener_datos(entidad=ENTIDAD_PREDETERMINADA):
+    """
+    Función para obtener la población por municipio de una entidad.
+
+    Usa la tabla compilada de la entidad (ruta_artefacto) si está al día con
+    su ITER; si no, la vuelve a compilar desde el parquet de origen.
     """
-    Función para obtener datos de un archivo parquet y procesarlos."""
     try:
-        df_inegi = pd.read_parquet('assets/docs/conjunto_de_datos_iter_13CSV20.parquet')
-        if df_inegi.empty:
-            raise ValueError("El DataFrame está vacío o no se leyo correctamente.")
-        
-        df_inegi = df_inegi.iloc[3:]
-        patron_excluir = 'Localidades de una vivienda|Localidades de dos viviendas|Total del Municipio'
-        df_inegi = df_inegi[~df_inegi['NOM_LOC'].str.contains(patron_excluir, case=False, na=False)]
-        columnas_a_eliminar = ['ENTIDAD', 'NOM_ENT', 'MUN', 'LOC', 'NOM_LOC', 'LONGITUD', 'LATITUD', 'ALTITUD']
-        df_inegi_pob = df_inegi.drop(columns=columnas_a_eliminar)
-        cols_numericas = df_inegi_pob.columns.difference(['NOM_MUN'])
-        df_inegi_pob[cols_numericas] = df_inegi_pob[cols_numericas].apply(pd.to_numeric, errors='coerce')
-        df_inegi_pob = df_inegi_pob[COLUMNAS_FINALES]
-        df_agrupado = df_inegi_pob.groupby('NOM_MUN').sum()
+        origen, destino = origen_iter(entidad), ruta_artefacto(entidad)
+        df_agrupado = cargar_artefacto(destino, origen)
+        if df_agrupado is None:
+            try:
+                df_agrupado = compilar_datos(origen, destino)
+            except OSError as e:
+                # Sin permiso de escritura: agregar en memoria
+                print(f"No se pudo escribir {destino}: {e}")
+                df_agrupado = agregar_iter(origen)
         municipios = df_agrupado.index.tolist()
         return df_agrupado, municipios
     
@@ -38,25 +435,400 @@ def obtener_datos():
         return None, None
 
 
-def auxiliares_salud():
+@medido('parquet_municipios')
+def leer_municipios(ruta=RUTA_ITER):
+    """
+    Índice ligero de municipios: sólo lee las columnas MUN y NOM_MUN de las
+    filas de localidades, sin convertir ni agregar la población. Devuelve la
+    misma lista ordenada que obtener_datos, y sirve para armar el layout
+    mientras los agregados se cargan.
+
+    Returns:
+        list: Etiquetas de municipio (etiquetas_municipio) ordenadas.
+    """
+    tabla = pq.read_table(
+        ruta,
+        columns=['MUN', 'NOM_MUN'],
+        filters=filtro_localidades(tipo_columna(ruta, 'LOC')),
+    )
+    pares = tabla.group_by(['MUN', 'NOM_MUN']).aggregate([]).filter(pc.is_valid(pc.field('NOM_MUN')))
+    return sorted(etiquetas_municipio(pares['MUN'].to_pylist(), pares['NOM_MUN'].to_pylist()).tolist())
+
+
+def a_grados(coordenadas):
+    """
+    Convierte coordenadas del ITER en texto ('20°08'45.251" N') a grados
+    decimales, negativos al sur y al oeste.
+
+    Args:
+        coordenadas (pd.Series): Columna LATITUD o LONGITUD.
+
+    Returns:
+        np.ndarray: Grados como float; NaN donde el texto no es una coordenada.
+    """
+    partes = coordenadas.str.extract(r"(\d+)°(\d+)'([\d.]+)\"\s*([NSEW])")
+    grados = partes[0].astype(float) + partes[1].astype(float) / 60 + partes[2].astype(float) / 3600
+    return grados.where(partes[3].isin(['N', 'E']), -grados).to_numpy()
+
+
+def _envolvente(x, y):
+    """Vértices de la envolvente convexa de los puntos (x, y), en orden (cadena monótona)."""
+    puntos = sorted(set(zip(x.tolist(), y.tolist())))
+    if len(puntos) < 3:
+        return np.array(puntos).reshape(-1, 2)
+
+    def giro(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    inferior, superior = [], []
+    for p in puntos:
+        while len(inferior) >= 2 and giro(inferior[-2], inferior[-1], p) <= 0:
+            inferior.pop()
+        inferior.append(p)
+    for p in reversed(puntos):
+        while len(superior) >= 2 and giro(superior[-2], superior[-1], p) <= 0:
+            superior.pop()
+        superior.append(p)
+    return np.array(inferior[:-1] + superior[:-1])
+
+
+def area_localidades_km2(latitud, longitud, margen=MARGEN_AREA_KM):
+    """
+    Estima el área de un municipio a partir de sus localidades: la envolvente
+    convexa de los puntos, proyectados en km alrededor de su latitud media,
+    ampliada 'margen' km hacia afuera (área + perímetro·margen + π·margen²).
+    """
+    validos = ~(np.isnan(latitud) | np.isnan(longitud))
+    latitud, longitud = latitud[validos], longitud[validos]
+    if len(latitud) == 0:
+        return np.nan
+
+    coseno = np.cos(np.radians(latitud.mean()))
+    vertices = _envolvente(np.radians(longitud) * RADIO_TIERRA_KM * coseno, np.radians(latitud) * RADIO_TIERRA_KM)
+    area = perimetro = 0.0
+    if len(vertices) >= 2:
+        siguientes = np.roll(vertices, -1, axis=0)
+        area = 0.5 * abs(np.sum(vertices[:, 0] * siguientes[:, 1] - siguientes[:, 0] * vertices[:, 1]))
+        perimetro = np.hypot(*(siguientes - vertices).T).sum()
+    return area + perimetro * margen + np.pi * margen ** 2
+
+
+def _area_anillo_km2(anillo):
+    # Área de un anillo [lon, lat] sobre la esfera
+    lon, lat = np.radians(np.asarray(anillo, dtype=float)[:, :2]).T
+    return abs(np.sum((np.roll(lon, -1) - lon) * (2 + np.sin(lat) + np.sin(np.roll(lat, -1))))) * RADIO_TIERRA_KM ** 2 / 2
+
+
+def leer_limites(ruta=RUTA_LIMITES, entidad=None):
+    """
+    Área en km² de cada municipio de un GeoJSON de límites municipales
+    (p. ej. el Marco Geoestadístico del INEGI). El nombre se toma de la
+    propiedad NOMGEO o NOM_MUN. Con 'entidad', si los elementos traen
+    CVE_ENT sólo se leen los de esa entidad (los nombres se repiten entre
+    entidades).
+
+    Returns:
+        dict: Municipio -> área en km².
+    """
+    with open(ruta, encoding='utf-8') as archivo:
+        limites = json.load(archivo)
+
+    areas = {}
+    for elemento in limites['features']:
+        propiedades = elemento.get('properties') or {}
+        nombre = propiedades.get('NOMGEO', propiedades.get('NOM_MUN'))
+        geometria = elemento.get('geometry')
+        if nombre is None or geometria is None:
+            continue
+        if entidad is not None and propiedades.get('CVE_ENT') is not None and int(propiedades['CVE_ENT']) != entidad:
+            continue
+        poligonos = geometria['coordinates'] if geometria['type'] == 'MultiPolygon' else [geometria['coordinates']]
+        # El primer anillo es el contorno; los demás son huecos
+        areas[nombre] = areas.get(nombre, 0.0) + sum(
+            _area_anillo_km2(anillos[0]) - sum(_area_anillo_km2(hueco) for hueco in anillos[1:])
+            for anillos in poligonos
+        )
+    return areas
+
+
+@medido('areas')
+def areas_municipales(ruta=RUTA_ITER, limites=RUTA_LIMITES, entidad=None, localidades=None):
+    """
+    Tabla de áreas por municipio del ITER 'ruta'. Usa los límites de
+    'limites' (de la 'entidad', ver leer_limites) si el archivo existe y,
+    para los municipios que no estén ahí, la estimación de
+    area_localidades_km2 con LATITUD/LONGITUD del ITER. Con 'localidades'
+    (TablaLocalidades de la misma entidad) se usan sus coordenadas y no se
+    lee el ITER.
+
+    Returns:
+        pd.Series: Área en km² indexada por 'NOM_MUN' (etiquetas_municipio).
+    """
+    if localidades is not None:
+        latitud = localidades.latitud.astype(float)
+        longitud = localidades.longitud.astype(float)
+        grupos = {municipio: slice(*localidades.rango(municipio)) for municipio in localidades.claves_municipio}
+    else:
+        tabla = pq.read_table(
+            ruta,
+            columns=['MUN', 'NOM_MUN', 'LATITUD', 'LONGITUD'],
+            filters=filtro_localidades(tipo_columna(ruta, 'LOC')),
+        ).to_pandas()
+        tabla['NOM_MUN'] = etiquetas_municipio(tabla['MUN'], tabla['NOM_MUN'])
+        latitud = a_grados(tabla['LATITUD'])
+        longitud = a_grados(tabla['LONGITUD'])
+        grupos = tabla.groupby('NOM_MUN').indices
+
+    oficiales = leer_limites(limites, entidad) if os.path.exists(limites) else {}
+    areas = {
+        municipio: oficiales[municipio] if municipio in oficiales
+        else area_localidades_km2(latitud[filas], longitud[filas])
+        for municipio, filas in grupos.items()
+    }
+    return pd.Series(areas, name='AREA_KM2', dtype=float).rename_axis('NOM_MUN').sort_index()
+
+
+class TablaLocalidades:
+    """
+    Localidades del ITER ordenadas por (MUN, LOC), en arreglos de NumPy con
+    enteros compactos. Las localidades de un municipio son un rango contiguo
+    que se ubica con búsqueda binaria (rango), sin recorrer la tabla.
+
+    'poblacion' tiene forma (localidades, 18, 2) con los ejes de
+    matriz_poblacion (GRUPOS_EDAD × SEXOS). Los arreglos no deben modificarse.
+    """
+    __slots__ = ('mun', 'loc', 'clave', 'nombre', 'latitud', 'longitud', 'poblacion', 'claves_municipio')
+
+    def __init__(self, mun, loc, nombre, latitud, longitud, poblacion, claves_municipio):
+        self.mun = mun
+        self.loc = loc
+        # Clave única ordenada MUN·10000 + LOC para ubicar una localidad
+        self.clave = mun.astype(np.uint32) * 10000 + loc
+        self.nombre = nombre
+        self.latitud = latitud
+        self.longitud = longitud
+        self.poblacion = poblacion
+        self.claves_municipio = claves_municipio
+
+    def __len__(self):
+        return len(self.mun)
+
+    def rango(self, municipio):
+        """Posiciones [inicio, fin) de las localidades del municipio (nombre)."""
+        mun = self.claves_municipio.get(municipio)
+        if mun is None:
+            return 0, 0
+        # La clave con el tipo del arreglo, para que searchsorted no convierta toda la columna
+        mun = self.mun.dtype.type(mun)
+        return int(np.searchsorted(self.mun, mun, 'left')), int(np.searchsorted(self.mun, mun, 'right'))
+
+    def como_tabla(self, i, nombre):
+        """Población de la localidad 'i' como tabla de una fila con COLUMNAS_SEXO, indexada por 'nombre'."""
+        return pd.DataFrame(self.poblacion[i].reshape(1, -1), index=[nombre], columns=COLUMNAS_SEXO)
+
+    def posicion(self, municipio, loc):
+        """Posición de la localidad 'loc' del municipio (nombre), o None si no existe."""
+        mun = self.claves_municipio.get(municipio)
+        if mun is None or loc is None:
+            return None
+        return self.posicion_clave(mun, loc)
+
+    def posicion_clave(self, mun, loc):
+        """Posición de la localidad con claves INEGI (MUN, LOC), o None si no existe."""
+        clave = self.clave.dtype.type(int(mun) * 10000 + int(loc))
+        i = int(np.searchsorted(self.clave, clave))
+        return i if i < len(self.clave) and self.clave[i] == clave else None
+
+
+@medido('parquet_localidades')
+def cargar_localidades(ruta=RUTA_ITER):
+    """
+    Lee las localidades del ITER (sin los totales de LOC_AGREGADOS) con sus
+    coordenadas y población por grupo de edad y sexo.
+
+    Returns:
+        TablaLocalidades: Localidades ordenadas por (MUN, LOC).
+    """
+    tabla = pq.read_table(
+        ruta,
+        columns=['MUN', 'NOM_MUN', 'LOC', 'NOM_LOC', 'LATITUD', 'LONGITUD'] + COLUMNAS_SEXO,
+        filters=filtro_localidades(tipo_columna(ruta, 'LOC')),
+    )
+    tabla = a_enteros(tabla, ['MUN', 'LOC'] + COLUMNAS_SEXO)
+    tabla = tabla.sort_by([('MUN', 'ascending'), ('LOC', 'ascending')])
+
+    poblacion = np.column_stack([
+        tabla.column(col).fill_null(0).to_numpy() for col in COLUMNAS_SEXO
+    ]).reshape(tabla.num_rows, len(GRUPOS_EDAD), len(SEXOS))
+    mun = tabla.column('MUN').to_numpy().astype(np.uint16)
+    municipios = tabla.select(['MUN', 'NOM_MUN']).group_by(['MUN', 'NOM_MUN']).aggregate([])
+    etiquetas = etiquetas_municipio(municipios['MUN'].to_pylist(), municipios['NOM_MUN'].to_pylist())
+
+    return TablaLocalidades(
+        mun=mun,
+        loc=tabla.column('LOC').to_numpy().astype(np.uint16),
+        nombre=np.array(tabla.column('NOM_LOC').to_pylist(), dtype=object),
+        latitud=a_grados(tabla.column('LATITUD').to_pandas()).astype(np.float32),
+        longitud=a_grados(tabla.column('LONGITUD').to_pandas()).astype(np.float32),
+        poblacion=poblacion,
+        claves_municipio=dict(zip(etiquetas.tolist(), municipios.column('MUN').to_pylist())),
+    )
+
+
+@medido('artefacto_localidades_compilar')
+def compilar_localidades(origen=RUTA_ITER, destino=RUTA_ARTEFACTO_LOCALIDADES):
+    """
+    Escribe la tabla de localidades de cargar_localidades como artefacto
+    Arrow IPC (ver escribir_artefacto): claves, nombres, coordenadas ya en
+    grados y la población como lista fija de len(COLUMNAS_SEXO) uint32.
+
+    Returns:
+        TablaLocalidades: La tabla leída del origen.
+    """
+    localidades = cargar_localidades(origen)
+    etiquetas = {mun: etiqueta for etiqueta, mun in localidades.claves_municipio.items()}
+    tabla = pa.table({
+        'MUN': pa.array(localidades.mun),
+        'LOC': pa.array(localidades.loc),
+        'NOM_MUN': pa.array([etiquetas[mun] for mun in localidades.mun.tolist()], pa.string()).dictionary_encode(),
+        'NOM_LOC': pa.array(localidades.nombre.tolist(), pa.string()),
+        'LATITUD': pa.array(localidades.latitud),
+        'LONGITUD': pa.array(localidades.longitud),
+        'POBLACION': pa.FixedSizeListArray.from_arrays(
+            pa.array(localidades.poblacion.reshape(-1).astype(np.uint32)), len(COLUMNAS_SEXO)),
+    })
+    escribir_artefacto(tabla, origen, destino)
+    return localidades
+
+
+@medido('artefacto_localidades_cargar')
+def cargar_artefacto_localidades(destino=RUTA_ARTEFACTO_LOCALIDADES, origen=RUTA_ITER):
+    """
+    Tabla de localidades desde su artefacto, si está al día (ver
+    abrir_artefacto). Las claves, coordenadas y la población son vistas del
+    archivo con memory map, compartidas entre procesos; sólo los nombres se
+    copian.
+
+    Returns:
+        TablaLocalidades | None: None si no existe o está desactualizado.
+    """
+    tabla = abrir_artefacto(destino, origen)
+    if tabla is None:
+        return None
+    columna = {nombre: tabla.column(nombre).chunk(0) if tabla.num_rows else tabla.column(nombre).combine_chunks()
+               for nombre in tabla.column_names}
+    mun = columna['MUN'].to_numpy()
+    municipios = columna['NOM_MUN']
+    _, primeras = np.unique(municipios.indices.to_numpy(), return_index=True)
+    return TablaLocalidades(
+        mun=mun,
+        loc=columna['LOC'].to_numpy(),
+        nombre=np.array(columna['NOM_LOC'].to_pylist(), dtype=object),
+        latitud=columna['LATITUD'].to_numpy(),
+        longitud=columna['LONGITUD'].to_numpy(),
+        poblacion=columna['POBLACION'].flatten().to_numpy().reshape(tabla.num_rows, len(GRUPOS_EDAD), len(SEXOS)),
+        claves_municipio=dict(zip(municipios.dictionary.to_pylist(), mun[primeras].tolist())),
+    )
+
+
+def obtener_localidades(entidad=ENTIDAD_PREDETERMINADA):
+    """
+    Función para obtener la tabla de localidades de una entidad.
+
+    Usa el artefacto de la entidad (ruta_artefacto_localidades) si está al
+    día con su ITER; si no, lo vuelve a compilar desde el parquet de origen.
+
+    Returns:
+        TablaLocalidades | None: None si no se pudo leer el ITER (p. ej. un
+        despliegue que sólo lleva la tabla municipal compilada).
+    """
+    try:
+        origen, destino = origen_iter(entidad), ruta_artefacto_localidades(entidad)
+        localidades = cargar_artefacto_localidades(destino, origen)
+        if localidades is None:
+            try:
+                localidades = compilar_localidades(origen, destino)
+            except OSError as e:
+                # Sin permiso de escritura: leer el ITER en memoria
+                print(f"No se pudo escribir {destino}: {e}")
+                localidades = cargar_localidades(origen)
+        return localidades
+    except FileNotFoundError:
+        print("El archivo de localidades no se encontró.")
+        return None
+    except Exception as e:
+        print(f"Ocurrió un error al cargar las localidades: {e}")
+        return None
+
+
+@medido('parquet_unidades')
+def leer_unidades_ssa(detalle=False):
+    """
+    Lee el reporte de auxiliares, casas de salud y parteras y lo filtra a
+    las unidades con CLUES que empiezan por 'HGSSA'.
+
+    Sólo se leen COLUMNAS_UNIDADES (más COLUMNAS_UNIDADES_DETALLE con
+    'detalle'), y el prefijo se aplica al leer como el rango
+    'HGSSA' <= CLUES < 'HGSSB'.
+
+    Cada datos.Instantanea lee su propia copia y la pasa a los agregados
+    (auxiliares_salud, casas_salud, parteras, total_unidades_salud...), así
+    que no debe modificarse en sitio.
+
+    Returns:
+        pd.DataFrame: Unidades SSA del reporte.
+
+    Raises:
+        FileNotFoundError: Si el archivo no existe.
+        KeyError: Si faltan las columnas 'CLUES' o 'Nombre Municipio Loc'.
+    """
+    requeridas = COLUMNAS_UNIDADES + (COLUMNAS_UNIDADES_DETALLE if detalle else [])
+    columnas = pq.read_schema(RUTA_UNIDADES).names
+    for columna in requeridas:
+        if columna not in columnas:
+            raise KeyError(f"La columna '{columna}' no se encontró en el archivo.")
+
+    return pd.read_parquet(
+        RUTA_UNIDADES,
+        columns=requeridas,
+        filters=[('CLUES', '>=', 'HGSSA'), ('CLUES', '<', 'HGSSB')],
+    )
+
+
+@lru_cache(maxsize=2)
+def unidades_ssa(detalle=False):
+    """
+    leer_unidades_ssa leído una sola vez por proceso, para los agregados que
+    se llaman sin tabla (compilar_datos.py --diagnostico, benchmark.py). La
+    aplicación usa la tabla de la instantánea, que se recarga con ella.
+    """
+    return leer_unidades_ssa(detalle)
+
+
+def _tabla_unidades(unidades):
+    # Tabla de unidades de la instantánea o, sin ella, la compartida del proceso
+    return unidades_ssa() if unidades is None else unidades
+
+
+@medido('agregado_auxiliares')
+def auxiliares_salud(unidades=None):
     """
     Función para obtener el número total de auxiliares de salud por municipio,
     filtrado por unidades con CLUES que empiezan por 'HGSSA'.
 
+    Args:
+        unidades (pd.DataFrame): Tabla de leer_unidades_ssa; por omisión unidades_ssa().
+
     Returns:
         pd.DataFrame: Con columnas ['Nombre Municipio Loc', 'Auxiliar de Salud'].
                      Retorna DataFrame vacío si hay errores.
     """
     try:
-        # Cargar datos
-        df_aux = pd.read_parquet('assets/docs/Reporte Auxiliares, Casas de Salud y Parteras.parquet')
-        
-        # Filtrar unidades SSA y limpiar datos
-        unidades_ssa = df_aux[df_aux['CLUES'].astype(str).str.startswith('HGSSA')].copy()
-        unidades_ssa['Auxiliar de Salud'] = unidades_ssa['Auxiliar de Salud'].fillna(0)  # Si es numérico
+        # Unidades SSA compartidas, limpiar datos
+        auxiliares = _tabla_unidades(unidades)[['Nombre Municipio Loc', 'Auxiliar de Salud']].fillna({'Auxiliar de Salud': 0})
         
         # Agrupar y sumar
-        total_auxiliares = unidades_ssa.groupby('Nombre Municipio Loc', as_index=False)['Auxiliar de Salud'].sum()
+        total_auxiliares = auxiliares.groupby('Nombre Municipio Loc', as_index=False)['Auxiliar de Salud'].sum()
         
         return total_auxiliares
 
@@ -68,11 +840,15 @@ def auxiliares_salud():
         return pd.DataFrame()
     
 
-def casas_salud():
+@medido('agregado_casas')
+def casas_salud(unidades=None):
     """
     Función para obtener el número total de casas de salud por municipio y tipo,
     filtrado por unidades con CLUES que empiezan por 'HGSSA'.
 
+    Args:
+        unidades (pd.DataFrame): Tabla de leer_unidades_ssa; por omisión unidades_ssa().
+
     Returns:
         pd.DataFrame: Con columnas:
             - 'Nombre Municipio Loc': Nombre del municipio.
@@ -81,18 +857,17 @@ def casas_salud():
             Retorna DataFrame vacío si hay errores.
     """
     try:
-        # Cargar datos
-        doc = pd.read_parquet('assets/docs/Reporte Auxiliares, Casas de Salud y Parteras.parquet')
+        # Unidades SSA compartidas
+        doc = _tabla_unidades(unidades)
         
         # Verificar si el DataFrame está vacío
         if doc.empty:
-            print("Advertencia: El archivo está vacío.")
+            print("Advertencia: No hay unidades con CLUES que inicien con 'HGSSA'.")
             return pd.DataFrame()
 
-        # Filtrar y limpiar datos
-        casas = doc[doc['CLUES'].astype(str).str.startswith('HGSSA')].copy()
+        # Limpiar datos
         cols = ['Nombre Municipio Loc', 'Tipo Casa Salud']
-        casas = casas[cols].dropna(subset=["Tipo Casa Salud"])
+        casas = doc[cols].dropna(subset=["Tipo Casa Salud"])
         
         # Verificar si hay datos después del filtrado
         if casas.empty:
@@ -116,31 +891,30 @@ def casas_salud():
         print(f"Error inesperado: {str(e)}")
         return pd.DataFrame()
     
-import pandas as pd
 
-def parteras():
+@medido('agregado_parteras')
+def parteras(unidades=None):
     """
     Obtiene el número total de parteras por municipio, 
     filtrando por unidades con CLUES que empiezan por 'HGSSA'.
 
+    Args:
+        unidades (pd.DataFrame): Tabla de leer_unidades_ssa; por omisión unidades_ssa().
+
     Returns:
         pd.DataFrame: Con columnas ['Nombre Municipio Loc', 'Parteras'].
                       Retorna DataFrame vacío si hay errores.
     """
     try:
-        # Cargar el archivo Parquet
-        parteras = pd.read_parquet('assets/docs/Reporte Auxiliares, Casas de Salud y Parteras.parquet')
+        # Unidades SSA compartidas (CLUES que empiezan con 'HGSSA')
+        parteras_filtradas = _tabla_unidades(unidades)
         
-        if parteras.empty:
-            print("Advertencia: El archivo está vacío.")
+        if parteras_filtradas.empty:
+            print("Advertencia: No hay unidades con CLUES que inicien con 'HGSSA'.")
             return pd.DataFrame() 
-        # Filtrar por CLUES que empiezan con 'HGSSA'
-        parteras_filtradas = parteras[parteras['CLUES'].astype(str).str.startswith('HGSSA')]
-        # Seleccionar columnas relevantes
+        # Seleccionar columnas relevantes y eliminar filas con valores NaN en 'Parteras'
         cols = ['Nombre Municipio Loc', 'Parteras']
-        parteras_filtradas = parteras_filtradas[cols].copy()  # Usar copy() para evitar SettingWithCopyWarning
-        # Eliminar filas con valores NaN en 'Parteras'
-        parteras_filtradas.dropna(subset=["Parteras"], inplace=True)
+        parteras_filtradas = parteras_filtradas[cols].dropna(subset=["Parteras"])
         # Agrupar por municipio sumando las parteras
         parteras_total = parteras_filtradas.groupby('Nombre Municipio Loc')['Parteras'].sum().reset_index()
         return parteras_total
@@ -155,43 +929,25 @@ def parteras():
     
 
 
-def total_unidades_salud():
+@medido('agregado_unidades')
+def total_unidades_salud(unidades=None):
     """
     Obtiene el número total de unidades de salud por municipio,
     filtrando por CLUES que comienzan con 'HGSSA'.
 
+    Args:
+        unidades (pd.DataFrame): Tabla de leer_unidades_ssa; por omisión unidades_ssa().
+
     Returns:
         pd.DataFrame: Con columnas ['Nombre Municipio Loc', 'Total Unidades'].
                       Retorna DataFrame vacío si hay errores.
     """
     try:
-        # Cargar el archivo Parquet
-        unidades = pd.read_parquet('assets/docs/Reporte Auxiliares, Casas de Salud y Parteras.parquet')
-
-        # Comprobar si el DataFrame está vacío inmediatamente después de cargarlo
-        if unidades.empty:
-            print("Advertencia: El archivo está vacío.")
-            return pd.DataFrame()
-
         # --- Inicio de las operaciones de procesamiento ---
 
-        # Asegurarse de que la columna 'CLUES' exista y sea string antes de filtrar
-        if 'CLUES' not in unidades.columns:
-             print("Error: La columna 'CLUES' no se encontró en el archivo.")
-             return pd.DataFrame()
-
-        # Asegurarse de que la columna 'Nombre Municipio Loc' exista
-        if 'Nombre Municipio Loc' not in unidades.columns:
-             print("Error: La columna 'Nombre Municipio Loc' no se encontró en el archivo.")
-             return pd.DataFrame()
-
-
-        # Filtrar, seleccionar columnas y eliminar duplicados en pasos lógicos.
-        # Mantenemos el uso de .copy() para claridad y seguridad contra SettingWithCopyWarning.
-
-        # 1. Filtrar por CLUES que comienzan con 'HGSSA'
-        #    Usamos .astype(str) para manejar posibles valores no-string
-        unidades_filtradas = unidades[unidades['CLUES'].astype(str).str.startswith('HGSSA')].copy()
+        # 1. Unidades SSA compartidas (CLUES que comienzan con 'HGSSA').
+        #    unidades_ssa ya valida que existan 'CLUES' y 'Nombre Municipio Loc'.
+        unidades_filtradas = _tabla_unidades(unidades)
 
         # Si después de filtrar no quedan unidades, podemos retornar un DataFrame vacío
         if unidades_filtradas.empty:
@@ -205,7 +961,6 @@ def total_unidades_salud():
         # 3. Eliminar duplicados basados en 'CLUES'
         #    Usamos inplace=True para modificar el DataFrame directamente, ahorrando memoria temporal.
         unidades_procesar.drop_duplicates(subset=["CLUES"], inplace=True)
-        unidades_procesar.to_csv('assets/docs/comprobacion.csv') # Para depuración, muestra las primeras filas después de eliminar duplicados
         # 4. Agrupar por municipio y contar las unidades únicas
         #    Contamos 'CLUES' después de haber eliminado duplicados, asegurando el conteo de unidades únicas.
         #    reset_index renombra la columna de conteo a 'Total Unidades' y convierte la Serie resultante en DataFrame.
@@ -214,9 +969,13 @@ def total_unidades_salud():
         # --- Fin de las operaciones de procesamiento ---
 
         # Devolver el DataFrame con el total por municipio
-        total_unidades.to_csv('assets/docs/comprobacion_total_unidades.csv') # Para depuración, muestra las primeras filas después de eliminar duplicados
+        # (los CSV de comprobación se generan aparte con exportar_diagnostico)
         return total_unidades
 
+    except KeyError as e:
+        print(f"Error: {e.args[0]}")
+        return pd.DataFrame()
+
     except FileNotFoundError:
         # Manejo específico si el archivo no existe
         print("Error: El archivo no se encontró en la ruta especificada.")
@@ -226,4 +985,433 @@ def total_unidades_salud():
         # Manejo de cualquier otro error inesperado
         # Hemos eliminado la línea duplicada aquí.
         print(f"Error inesperado durante el procesamiento de datos: {str(e)}")
-        return pd.DataFrame() # Retorno consistente: DataFrame vacío
\ No newline at end of file
+        return pd.DataFrame() # Retorno consistente: DataFrame vacío
+
+
+@medido('agregado_localidades')
+def salud_por_localidad(unidades=None):
+    """
+    Auxiliares, casas de salud, parteras y unidades de cada localidad, con
+    los mismos criterios que los agregados por municipio.
+
+    El reporte tiene una fila por unidad y localidad atendida, así que
+    'unidades' es el número de unidades distintas (CLUES) que atienden la
+    localidad, no las que están en ella: una unidad cuenta en cada localidad
+    que atiende y la suma por municipio puede ser mayor que su total.
+
+    Args:
+        unidades (pd.DataFrame): Tabla de leer_unidades_ssa; por omisión unidades_ssa().
+
+    Returns:
+        dict: (Clave Municipio Loc, Clave Localidad) -> dict con 'auxiliares',
+              'casas' (tipo -> conteo), 'parteras' y 'unidades'. Vacío si hay
+              errores.
+    """
+    try:
+        doc = _tabla_unidades(unidades)
+        claves = ['Clave Municipio Loc', 'Clave Localidad']
+
+        auxiliares = doc.groupby(claves)['Auxiliar de Salud'].sum()
+        total_parteras = doc.groupby(claves)['Parteras'].sum()
+        unidades = doc.groupby(claves)['CLUES'].nunique()
+        casas = doc.dropna(subset=['Tipo Casa Salud']).groupby(claves + ['Tipo Casa Salud']).size()
+
+        salud = {
+            (int(mun), int(loc)): {'auxiliares': 0, 'casas': {}, 'parteras': 0, 'unidades': 0}
+            for mun, loc in doc[claves].drop_duplicates().itertuples(index=False)
+        }
+        for (mun, loc), valor in auxiliares.items():
+            salud[int(mun), int(loc)]['auxiliares'] = int(valor)
+        for (mun, loc), valor in total_parteras.items():
+            salud[int(mun), int(loc)]['parteras'] = int(valor)
+        for (mun, loc), valor in unidades.items():
+            salud[int(mun), int(loc)]['unidades'] = int(valor)
+        for (mun, loc, tipo), valor in casas.items():
+            salud[int(mun), int(loc)]['casas'][tipo] = int(valor)
+        return salud
+
+    except FileNotFoundError:
+        print("Error: El archivo no se encontró.")
+        return {}
+    except Exception as e:
+        print(f"Error inesperado: {str(e)}")
+        return {}
+
+
+def _nombre_comparable(nombre):
+    # Sin acentos, en mayúsculas y con espacios simples, para comparar nombres
+    nombre = unicodedata.normalize('NFKD', str(nombre)).encode('ascii', 'ignore').decode()
+    return ' '.join(nombre.upper().replace('.', ' ').replace(',', ' ').split())
+
+
+def ubicacion_unidades(unidades=None):
+    """
+    Localidad donde está cada unidad HGSSA, para el mapa. El reporte sólo
+    dice qué localidades atiende cada unidad, así que se toma la atendida
+    cuyo nombre es igual al de la unidad (sin acentos ni mayúsculas) o, si no
+    hay, la que lo contiene o está contenida en él; entre varias, la de menor
+    clave. Las unidades sin coincidencia (p. ej. las caravanas) no se ubican.
+
+    Args:
+        unidades (pd.DataFrame): leer_unidades_ssa(detalle=True); por
+            omisión unidades_ssa(detalle=True).
+
+    Returns:
+        dict: (Clave Municipio Loc, Clave Localidad) -> número de unidades
+              ubicadas ahí. Vacío si hay errores.
+    """
+    try:
+        doc = unidades_ssa(detalle=True) if unidades is None else unidades
+        unidad = [_nombre_comparable(n) for n in doc['Nombre Unidad']]
+        localidad = [_nombre_comparable(n) for n in doc['Nombre Localidad']]
+        # 0: mismo nombre, 1: uno contiene al otro, 2: sin coincidencia
+        coincidencia = [
+            0 if u == l else 1 if l and (l in u or u in l) else 2
+            for u, l in zip(unidad, localidad)
+        ]
+        candidatas = doc.assign(coincidencia=coincidencia)
+        candidatas = candidatas[candidatas['coincidencia'] < 2].sort_values(
+            ['CLUES', 'coincidencia', 'Clave Municipio Loc', 'Clave Localidad'])
+        ubicadas = candidatas.drop_duplicates(subset=['CLUES'])
+        conteo = ubicadas.groupby(['Clave Municipio Loc', 'Clave Localidad']).size()
+        return {(int(mun), int(loc)): int(valor) for (mun, loc), valor in conteo.items()}
+
+    except FileNotFoundError:
+        print("Error: El archivo no se encontró.")
+        return {}
+    except Exception as e:
+        print(f"Error inesperado: {str(e)}")
+        return {}
+
+
+def exportar_diagnostico(directorio='assets/docs'):
+    """
+    Escribe los CSV de comprobación del conteo de unidades de salud:
+    comprobacion.csv (unidades SSA sin CLUES duplicadas) y
+    comprobacion_total_unidades.csv (total por municipio).
+
+    Se llama bajo demanda (python compilar_datos.py --diagnostico), nunca
+    desde los callbacks. Cada archivo se escribe a un temporal y se renombra.
+
+    Returns:
+        list: Rutas de los archivos escritos.
+    """
+    unidades = unidades_ssa()[['Nombre Municipio Loc', 'CLUES']].drop_duplicates(subset=["CLUES"])
+    archivos = {
+        'comprobacion.csv': unidades,
+        'comprobacion_total_unidades.csv': total_unidades_salud(),
+    }
+    rutas = []
+    for nombre, df in archivos.items():
+        ruta = os.path.join(directorio, nombre)
+        temporal = f"{ruta}.{os.getpid()}.tmp"
+        df.to_csv(temporal)
+        os.replace(temporal, ruta)
+        rutas.append(ruta)
+    return rutas
+
+
+class MetricasMunicipio:
+    """
+    Indicadores precalculados de un municipio. Se construyen una sola vez al
+    iniciar la aplicación para que los callbacks sólo hagan búsquedas.
+    """
+    __slots__ = ('poblacion_total', 'total_hombres', 'total_mujeres', 'grupo_mayoritario',
+                 'area_km2', 'densidad', 'auxiliares', 'casas', 'parteras', 'unidades')
+
+    def __init__(self, poblacion_total, total_hombres, total_mujeres, grupo_mayoritario,
+                 area_km2, densidad, auxiliares, casas, parteras, unidades):
+        self.poblacion_total = poblacion_total
+        self.total_hombres = total_hombres
+        self.total_mujeres = total_mujeres
+        self.grupo_mayoritario = grupo_mayoritario
+        self.area_km2 = area_km2
+        self.densidad = densidad
+        self.auxiliares = auxiliares
+        self.casas = casas
+        self.parteras = parteras
+        self.unidades = unidades
+
+
+def _por_municipio(df, columna, municipios):
+    """
+    Convierte una tabla ['Nombre Municipio Loc', columna] en un dict
+    municipio -> entero, con 0 para los municipios sin registros. Si la
+    tabla está vacía (sin datos de salud) todos quedan en NaN.
+    """
+    if df.empty:
+        return dict.fromkeys(municipios, np.nan)
+    serie = df.set_index('Nombre Municipio Loc')[columna].reindex(municipios, fill_value=0)
+    return dict(zip(municipios, serie.fillna(0).astype(int).tolist()))
+
+
+def _conteo(valor):
+    # Entero, o NaN si no hay datos
+    return np.nan if np.isnan(valor) else int(valor)
+
+
+def _totales_poblacion(poblacion):
+    """Población total, hombres, mujeres y grupo de edad mayoritario de cada fila de la matriz."""
+    por_sexo = poblacion.sum(axis=1, dtype=np.int64)
+    por_edad = poblacion.sum(axis=2, dtype=np.int64)
+    return (por_sexo.sum(axis=1), por_sexo[:, SEXOS.index('M')], por_sexo[:, SEXOS.index('F')],
+            por_edad.argmax(axis=1))
+
+
+def matriz_poblacion(df_agrupado):
+    """
+    Población como arreglo de municipios × grupos de edad × sexo, en el orden
+    de df_agrupado.index, GRUPOS_EDAD y SEXOS. Sólo usa las columnas _F y _M:
+    las columnas P_xAy son su suma y contarlas también duplicaría la población.
+
+    Returns:
+        np.ndarray: Forma (municipios, 18, 2), del mismo tipo entero que df_agrupado.
+    """
+    return df_agrupado[COLUMNAS_SEXO].to_numpy().reshape(len(df_agrupado), len(GRUPOS_EDAD), len(SEXOS))
+
+
+@medido('metricas')
+def construir_metricas(df_agrupado, poblacion=None, areas=None, entidad=ENTIDAD_PREDETERMINADA, unidades=None):
+    """
+    Precalcula los indicadores de población y salud de todos los municipios.
+    Los de población son reducciones de la matriz de matriz_poblacion.
+
+    Args:
+        df_agrupado (pd.DataFrame): Resultado de obtener_datos, indexado por municipio.
+        poblacion (np.ndarray): matriz_poblacion(df_agrupado), si ya se calculó.
+        areas (pd.Series): areas_municipales(), si ya se calculó.
+        entidad (int): Entidad de df_agrupado. El reporte de unidades sólo
+            cubre ENTIDAD_PREDETERMINADA; las demás quedan sin datos de salud.
+        unidades (pd.DataFrame): Reporte de la instantánea (leer_unidades_ssa); por
+            omisión unidades_ssa().
+
+    Returns:
+        dict: Municipio -> MetricasMunicipio. En 'casas' se guarda un dict
+              tipo -> conteo con los tipos presentes en el municipio, o None
+              si no hay datos de casas de salud. 'area_km2' y 'densidad' son
+              None si no se pudo obtener el área. 'auxiliares', 'parteras' y
+              'unidades' son NaN sin datos de salud (p. ej. otras entidades).
+    """
+    municipios = df_agrupado.index.tolist()
+    if poblacion is None:
+        poblacion = matriz_poblacion(df_agrupado)
+
+    poblacion_total, total_hombres, total_mujeres, mayoritario = _totales_poblacion(poblacion)
+
+    if areas is None:
+        try:
+            areas = areas_municipales(origen_iter(entidad), RUTA_LIMITES, entidad)
+        except Exception as e:
+            # Sin el ITER (p. ej. sólo el artefacto compilado) no hay coordenadas
+            print(f"No se pudo calcular el área de los municipios: {e}")
+            areas = pd.Series(dtype=float)
+    area = areas.reindex(municipios).to_numpy(dtype=float)
+    area = np.where(area > 0, area, np.nan)
+    densidad = poblacion_total / area
+
+    # El reporte se une por nombre de municipio, así que sólo vale para su entidad
+    con_salud = entidad == ENTIDAD_PREDETERMINADA
+    vacio = pd.DataFrame()
+    auxiliares = _por_municipio(auxiliares_salud(unidades) if con_salud else vacio, 'Auxiliar de Salud', municipios)
+    total_parteras = _por_municipio(parteras(unidades) if con_salud else vacio, 'Parteras', municipios)
+    total_unidades = _por_municipio(total_unidades_salud(unidades) if con_salud else vacio, 'Total Unidades',
+                                    municipios)
+
+    casas = dict.fromkeys(municipios)
+    tabla_casas = casas_salud(unidades) if con_salud else vacio
+    if not tabla_casas.empty:
+        tabla_casas = tabla_casas.set_index('Nombre Municipio Loc')
+        for municipio in municipios:
+            if municipio in tabla_casas.index:
+                fila = tabla_casas.loc[municipio]
+                casas[municipio] = {tipo: int(valor) for tipo, valor in fila.items() if valor > 0}
+            else:
+                casas[municipio] = {}
+
+    return {
+        municipio: MetricasMunicipio(
+            poblacion_total=int(poblacion_total[i]),
+            total_hombres=int(total_hombres[i]),
+            total_mujeres=int(total_mujeres[i]),
+            grupo_mayoritario=ETIQUETAS_EDAD[GRUPOS_EDAD[mayoritario[i]]],
+            area_km2=None if np.isnan(area[i]) else float(area[i]),
+            densidad=None if np.isnan(densidad[i]) else float(densidad[i]),
+            auxiliares=auxiliares[municipio],
+            casas=casas[municipio],
+            parteras=total_parteras[municipio],
+            unidades=total_unidades[municipio],
+        )
+        for i, municipio in enumerate(municipios)
+    }
+
+
+def metricas_localidad(localidades, salud, i):
+    """
+    Indicadores de la localidad en la posición 'i' de 'localidades', con los
+    mismos campos que los de un municipio. Las localidades no tienen área,
+    así que 'area_km2' y 'densidad' son None; sin datos de salud (fuera de
+    ENTIDAD_PREDETERMINADA) los conteos son NaN y 'casas' None.
+
+    Args:
+        localidades (TablaLocalidades): Tabla de cargar_localidades.
+        salud (dict): Resultado de salud_por_localidad.
+        i (int): Posición de la localidad (TablaLocalidades.posicion).
+    """
+    por_sexo = localidades.poblacion[i].sum(axis=0, dtype=np.int64)
+    por_edad = localidades.poblacion[i].sum(axis=1, dtype=np.int64)
+    conteos = salud.get((int(localidades.mun[i]), int(localidades.loc[i])), {})
+    # Sin datos de salud en la entidad los conteos no son cero sino desconocidos
+    vacio = 0 if salud else np.nan
+    return MetricasMunicipio(
+        poblacion_total=int(por_sexo.sum()),
+        total_hombres=int(por_sexo[SEXOS.index('M')]),
+        total_mujeres=int(por_sexo[SEXOS.index('F')]),
+        grupo_mayoritario=ETIQUETAS_EDAD[GRUPOS_EDAD[por_edad.argmax()]],
+        area_km2=None,
+        densidad=None,
+        auxiliares=conteos.get('auxiliares', vacio),
+        casas=conteos.get('casas', {}) if salud else None,
+        parteras=conteos.get('parteras', vacio),
+        unidades=conteos.get('unidades', vacio),
+    )
+
+
+@medido('jurisdicciones')
+def jurisdicciones_municipales(ruta=RUTA_UNIDADES):
+    """
+    Jurisdicción sanitaria de cada municipio según el reporte de unidades.
+
+    Returns:
+        pd.Series: Nombre de la jurisdicción indexado por nombre del municipio,
+                   en el orden de 'Clave Jurisdicción Loc.'. Vacía si hay errores.
+    """
+    try:
+        tabla = pd.read_parquet(
+            ruta, columns=['Clave Jurisdicción Loc.', 'Nombre Jurisdicción Loc', 'Nombre Municipio Loc']
+        )
+        tabla = tabla.drop_duplicates(subset=['Nombre Municipio Loc'])
+        tabla = tabla.sort_values(['Clave Jurisdicción Loc.', 'Nombre Municipio Loc'])
+        return tabla.set_index('Nombre Municipio Loc')['Nombre Jurisdicción Loc']
+
+    except FileNotFoundError:
+        print("Error: El archivo no se encontró.")
+        return pd.Series(dtype=object)
+    except Exception as e:
+        print(f"Error inesperado: {str(e)}")
+        return pd.Series(dtype=object)
+
+
+class CuboAgregados:
+    """
+    Población e indicadores de salud de cada unidad de agregación: los
+    municipios, las jurisdicciones sanitarias y el estado (NIVELES). Se
+    construye una vez por instantánea (construir_cubo), así que consultar
+    cualquier nivel es una búsqueda.
+
+    'poblacion' tiene forma (unidades, 18, 2), con los ejes de
+    matriz_poblacion y las filas en el orden de 'nombres'.
+    """
+    __slots__ = ('nombres', 'niveles', 'por_nivel', 'miembros', 'posiciones', 'poblacion', 'metricas')
+
+    def __init__(self, nombres, niveles, miembros, poblacion, metricas):
+        self.nombres = nombres
+        # Nombre -> nivel, y nivel -> nombres de ese nivel
+        self.niveles = niveles
+        self.por_nivel = {nivel: [nombre for nombre in nombres if niveles[nombre] == nivel] for nivel in NIVELES}
+        # Nombre -> municipios que suma
+        self.miembros = miembros
+        self.posiciones = {nombre: i for i, nombre in enumerate(nombres)}
+        self.poblacion = poblacion
+        self.metricas = metricas
+
+    def __len__(self):
+        return len(self.nombres)
+
+    def como_tabla(self, nombre):
+        """Población de la unidad como tabla de una fila con COLUMNAS_SEXO, indexada por 'nombre'."""
+        fila = self.poblacion[self.posiciones[nombre]]
+        return pd.DataFrame(fila.reshape(1, -1), index=[nombre], columns=COLUMNAS_SEXO)
+
+
+@medido('cubo')
+def construir_cubo(municipios, poblacion, metricas, jurisdicciones=None, estado=ENTIDADES[ENTIDAD_PREDETERMINADA]):
+    """
+    Agrega municipios -> jurisdicción sanitaria -> estado.
+
+    Cada nivel superior es el producto de una matriz de pertenencia
+    (unidades × municipios, 1 si el municipio forma parte de la unidad) por la
+    población edad × sexo y los conteos de salud de los municipios, así que
+    todo el cubo sale de unas cuantas multiplicaciones de matrices.
+
+    Args:
+        municipios (list): Municipios en el orden de las filas de 'poblacion'.
+        poblacion (np.ndarray): matriz_poblacion de los municipios.
+        metricas (dict): construir_metricas de los municipios.
+        jurisdicciones (pd.Series): jurisdicciones_municipales(), si ya se leyó.
+        estado (str): Nombre de la entidad.
+
+    Returns:
+        CuboAgregados: Los municipios conservan sus MetricasMunicipio. Una
+                       unidad tiene área (y densidad) sólo si todos sus
+                       municipios la tienen, y 'casas' es None si ninguno
+                       tiene datos de casas de salud. Los demás conteos de
+                       salud son NaN si algún municipio no tiene datos.
+    """
+    if jurisdicciones is None:
+        jurisdicciones = jurisdicciones_municipales()
+
+    miembros = {municipio: [municipio] for municipio in municipios}
+    niveles = dict.fromkeys(municipios, 'municipio')
+    asignadas = jurisdicciones[jurisdicciones.index.isin(municipios)]
+    for jurisdiccion, grupo in asignadas.groupby(asignadas, sort=False):
+        miembros[jurisdiccion] = grupo.index.tolist()
+        niveles[jurisdiccion] = 'jurisdiccion'
+    nombre_estado = f"Estado de {estado}"
+    miembros[nombre_estado] = list(municipios)
+    niveles[nombre_estado] = 'estado'
+
+    nombres = list(miembros)
+    fila = {municipio: i for i, municipio in enumerate(municipios)}
+    pertenencia = np.zeros((len(nombres), len(municipios)), dtype=np.int64)
+    for u, nombre in enumerate(nombres):
+        pertenencia[u, [fila[municipio] for municipio in miembros[nombre]]] = 1
+
+    n = len(municipios)
+    cubo = (pertenencia @ poblacion.reshape(n, -1).astype(np.int64)).reshape(len(nombres), *poblacion.shape[1:])
+    poblacion_total, total_hombres, total_mujeres, mayoritario = _totales_poblacion(cubo)
+
+    datos_municipios = [metricas[municipio] for municipio in municipios]
+    # Un conteo sin datos (NaN) en algún municipio deja sin datos a la unidad
+    conteos = np.array([[m.auxiliares, m.parteras, m.unidades] for m in datos_municipios],
+                       dtype=float).reshape(n, 3)
+    sin_conteo = pertenencia @ np.isnan(conteos)
+    conteos = np.where(sin_conteo > 0, np.nan, pertenencia @ np.nan_to_num(conteos))
+    area = np.array([np.nan if m.area_km2 is None else m.area_km2 for m in datos_municipios], dtype=float)
+    sin_area = pertenencia @ np.isnan(area)
+    area = np.where(sin_area > 0, np.nan, pertenencia @ np.nan_to_num(area))
+    area = np.where(area > 0, area, np.nan)
+    densidad = poblacion_total / area
+
+    tipos = list(dict.fromkeys(tipo for m in datos_municipios for tipo in (m.casas or {})))
+    casas = pertenencia @ np.array([[(m.casas or {}).get(tipo, 0) for tipo in tipos] for m in datos_municipios],
+                                   dtype=np.int64).reshape(n, len(tipos))
+    con_casas = pertenencia @ np.array([m.casas is not None for m in datos_municipios], dtype=np.int64)
+
+    metricas_cubo = {}
+    for u, nombre in enumerate(nombres):
+        if niveles[nombre] == 'municipio':
+            metricas_cubo[nombre] = metricas[nombre]
+            continue
+        metricas_cubo[nombre] = MetricasMunicipio(
+            poblacion_total=int(poblacion_total[u]),
+            total_hombres=int(total_hombres[u]),
+            total_mujeres=int(total_mujeres[u]),
+            grupo_mayoritario=ETIQUETAS_EDAD[GRUPOS_EDAD[mayoritario[u]]],
+            area_km2=None if np.isnan(area[u]) else float(area[u]),
+            densidad=None if np.isnan(densidad[u]) else float(densidad[u]),
+            auxiliares=_conteo(conteos[u, 0]),
+            casas={tipo: int(valor) for tipo, valor in zip(tipos, casas[u]) if valor > 0} if con_casas[u] else None,
+            parteras=_conteo(conteos[u, 1]),
+            unidades=_conteo(conteos[u, 2]),
+        )
+    return CuboAgregados(nombres, niveles, miembros, cubo, metricas_cubo)
@@ -0,0 +1,37 @@
+"""
+Configuración de gunicorn para servir dash_mpios con varios workers.
+
+Variables de entorno:
+    DASH_MPIOS_BIND     Dirección de escucha (por defecto 0.0.0.0:8050).
+    DASH_MPIOS_WORKERS  Número de workers (por defecto, uno por CPU).
+"""
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get("DASH_MPIOS_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("DASH_MPIOS_WORKERS", multiprocessing.cpu_count()))
+
+# Sin preload: cada worker importa la app por su cuenta y abre los artefactos
+# Arrow (municipios y localidades) con memory map, de modo que las tablas viven
+# una sola vez en la cache de páginas del sistema en lugar de copiarse por worker.
+preload_app = False
+
+
+def on_starting(server):
+    """
+    Compila los artefactos una sola vez, antes de crear los workers. Así los
+    workers sólo comparan tamaño y mtime del origen y abren los artefactos.
+    Si no se pueden compilar, gunicorn termina en vez de levantar workers
+    que compilarían cada uno por su cuenta (o arrancarían sin datos).
+    """
+    from compilar_datos import main
+
+    try:
+        codigo = main([])
+    except Exception as e:
+        server.log.error(f"No se pudieron compilar los artefactos de datos ({type(e).__name__}): {e}")
+        sys.exit(1)
+    if codigo:
+        server.log.error(f"compilar_datos terminó con código {codigo}")
+        sys.exit(codigo)
@@ -0,0 +1,205 @@
+"""
+Medición opcional de tiempos por etapa (lectura de parquet, agregación,
+figuras, serialización, callbacks).
+
+Se activa con DASH_MPIOS_METRICAS=1. Desactivada, medido() devuelve la función
+sin envolver y etapa() no registra nada, así que no agrega costo.
+
+Con la medición activa:
+    - Cada respuesta lleva un encabezado Server-Timing con las etapas que
+      corrieron en esa petición, más 'total'.
+    - /metrics expone histogramas por etapa en formato de texto de Prometheus.
+
+Perfilado de un callback:
+    DASH_MPIOS_PERFIL=update_piramide      Nombre del callback a perfilar; se
+                                           perfila su primera llamada en cada proceso.
+    DASH_MPIOS_PERFILADOR=pyinstrument     cProfile (por defecto) o pyinstrument
+                                           (opcional: pip install pyinstrument).
+    DASH_MPIOS_PERFIL_DIR=/tmp             Directorio donde se escribe el perfil.
+"""
+import bisect
+import contextlib
+import cProfile
+import functools
+import os
+import tempfile
+import threading
+import time
+
+from flask import Response, g, has_request_context
+
+ACTIVA = os.environ.get("DASH_MPIOS_METRICAS", "0") == "1"
+PERFIL = os.environ.get("DASH_MPIOS_PERFIL", "")
+PERFILADOR = os.environ.get("DASH_MPIOS_PERFILADOR", "cProfile")
+PERFIL_DIR = os.environ.get("DASH_MPIOS_PERFIL_DIR", tempfile.gettempdir())
+
+# Límites superiores (segundos) de los buckets del histograma
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histograma:
+    __slots__ = ('conteos', 'suma', 'total')
+
+    def __init__(self):
+        self.conteos = [0] * (len(BUCKETS) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, segundos):
+        self.conteos[bisect.bisect_left(BUCKETS, segundos)] += 1
+        self.suma += segundos
+        self.total += 1
+
+
+_histogramas = {}
+_lock = threading.Lock()
+
+
+def registrar(nombre, segundos):
+    """Agrega una duración al histograma de 'nombre' y a la petición en curso."""
+    with _lock:
+        histograma = _histogramas.get(nombre)
+        if histograma is None:
+            histograma = _histogramas[nombre] = Histograma()
+        histograma.observar(segundos)
+    if has_request_context():
+        g.setdefault('etapas', []).append((nombre, segundos))
+
+
+@contextlib.contextmanager
+def etapa(nombre):
+    """Mide el bloque como la etapa 'nombre'."""
+    if not ACTIVA:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar(nombre, time.perf_counter() - inicio)
+
+
+def medido(nombre):
+    """Decorador que mide cada llamada de la función como la etapa 'nombre'."""
+    def decorar(funcion):
+        if not ACTIVA:
+            return funcion
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with etapa(nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorar
+
+
+_perfil_hecho = False
+_lock_perfil = threading.Lock()
+
+
+def perfilable(funcion):
+    """
+    Si DASH_MPIOS_PERFIL coincide con el nombre de la función, perfila su
+    primera llamada y escribe el resultado en DASH_MPIOS_PERFIL_DIR. Si se
+    pidió pyinstrument y no está instalado, se usa cProfile.
+    """
+    if PERFIL != funcion.__name__:
+        return funcion
+
+    Profiler = None
+    if PERFILADOR == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print(f"Advertencia: pyinstrument no está instalado; {funcion.__name__} se perfila con cProfile.")
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        global _perfil_hecho
+        with _lock_perfil:
+            perfilar, _perfil_hecho = not _perfil_hecho, True
+        if not perfilar:
+            return funcion(*args, **kwargs)
+
+        base = os.path.join(PERFIL_DIR, f"perfil_{funcion.__name__}_{os.getpid()}")
+        if Profiler is not None:
+            perfilador = Profiler()
+            perfilador.start()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                perfilador.stop()
+                with open(f"{base}.html", "w", encoding="utf-8") as salida:
+                    salida.write(perfilador.output_html())
+                print(f"Perfil escrito en {base}.html")
+
+        perfilador = cProfile.Profile()
+        try:
+            return perfilador.runcall(funcion, *args, **kwargs)
+        finally:
+            perfilador.dump_stats(f"{base}.prof")
+            print(f"Perfil escrito en {base}.prof")
+    return envoltura
+
+
+def _server_timing(respuesta):
+    inicio = g.pop('inicio_peticion', None)
+    etapas = g.pop('etapas', [])
+    if inicio is not None:
+        etapas.append(('total', time.perf_counter() - inicio))
+    if etapas:
+        respuesta.headers['Server-Timing'] = ", ".join(
+            f"{nombre};dur={segundos * 1e3:.2f}" for nombre, segundos in etapas
+        )
+    return respuesta
+
+
+def texto_prometheus(contadores=None):
+    """
+    Histogramas por etapa y, opcionalmente, los contadores de la cache
+    (dict como el de caches.estadisticas) en formato de texto de Prometheus.
+    """
+    lineas = [
+        "# HELP dash_mpios_etapa_segundos Duración de cada etapa.",
+        "# TYPE dash_mpios_etapa_segundos histogram",
+    ]
+    with _lock:
+        for nombre, histograma in sorted(_histogramas.items()):
+            acumulado = 0
+            for limite, conteo in zip(BUCKETS + (float('inf'),), histograma.conteos):
+                acumulado += conteo
+                le = "+Inf" if limite == float('inf') else repr(limite)
+                lineas.append(f'dash_mpios_etapa_segundos_bucket{{etapa="{nombre}",le="{le}"}} {acumulado}')
+            lineas.append(f'dash_mpios_etapa_segundos_sum{{etapa="{nombre}"}} {histograma.suma}')
+            lineas.append(f'dash_mpios_etapa_segundos_count{{etapa="{nombre}"}} {histograma.total}')
+
+    if contadores:
+        lineas += [
+            "# HELP dash_mpios_cache_total Búsquedas en la cache de respuestas por resultado.",
+            "# TYPE dash_mpios_cache_total counter",
+        ]
+        for seccion, valores in contadores["secciones"].items():
+            lineas.append(f'dash_mpios_cache_total{{seccion="{seccion}",resultado="acierto"}} {valores["aciertos"]}')
+            lineas.append(f'dash_mpios_cache_total{{seccion="{seccion}",resultado="fallo"}} {valores["fallos"]}')
+    return "\n".join(lineas) + "\n"
+
+
+def instalar(server, contadores=None):
+    """
+    Agrega Server-Timing y la ruta /metrics al servidor Flask si la medición
+    está activa. 'contadores' es una función sin argumentos que devuelve las
+    estadísticas de la cache.
+    """
+    if not ACTIVA:
+        return
+
+    @server.before_request
+    def _inicio_peticion():
+        g.inicio_peticion = time.perf_counter()
+
+    server.after_request(_server_timing)
+
+    @server.route('/metrics')
+    def metricas():
+        return Response(texto_prometheus(contadores() if contadores else None),
+                        mimetype='text/plain; version=0.0.4')
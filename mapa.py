@@ -0,0 +1,231 @@
+"""
+Capas del mapa: localidades del ITER y unidades HGSSA, agrupadas en el servidor.
+
+Cada capa se agrupa una sola vez por instantánea de datos, en una rejilla por
+nivel de zoom (CELDAS_POR_MOSAICO × CELDAS_POR_MOSAICO celdas por mosaico de
+256 px). Los grupos de cada nivel quedan ordenados por mosaico, así que los
+de la vista actual se obtienen con lecturas de rango. Al navegador sólo llegan
+los grupos de los mosaicos visibles, codificados en geobuf, nunca el GeoJSON
+completo de las localidades.
+"""
+import base64
+from functools import lru_cache
+
+import geobuf
+import numpy as np
+
+from datos import MAX_ENTIDADES
+
+# Niveles de zoom con grupos precalculados; desde ZOOM_PUNTOS cada punto va solo
+ZOOM_MIN = 5
+ZOOM_PUNTOS = 14
+CELDAS_POR_MOSAICO = 4
+# Máximo de mosaicos por vista; si la vista abarca más, se usa un zoom menor
+MAX_MOSAICOS = 64
+
+
+def a_mercator(longitud, latitud):
+    """Coordenadas Web Mercator normalizadas a [0, 1) (x hacia el este, y hacia el sur)."""
+    x = (np.asarray(longitud, dtype=float) + 180) / 360
+    seno = np.sin(np.radians(np.clip(latitud, -85.0511, 85.0511)))
+    y = 0.5 - np.log((1 + seno) / (1 - seno)) / (4 * np.pi)
+    return x, y
+
+
+def de_mercator(x, y):
+    """Inversa de a_mercator: (longitud, latitud) en grados."""
+    longitud = np.asarray(x) * 360 - 180
+    latitud = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y)))))
+    return longitud, latitud
+
+
+class NivelZoom:
+    """Grupos de un nivel de zoom, ordenados por la clave de su mosaico."""
+    __slots__ = ('zoom', 'mosaico', 'longitud', 'latitud', 'cantidad', 'total', 'primero')
+
+    def __init__(self, zoom, mosaico, longitud, latitud, cantidad, total, primero):
+        self.zoom = zoom
+        self.mosaico = mosaico
+        self.longitud = longitud
+        self.latitud = latitud
+        self.cantidad = cantidad
+        self.total = total
+        # Posición en la capa del primer punto del grupo (para los grupos de uno)
+        self.primero = primero
+
+
+class CapaPuntos:
+    """
+    Puntos con un peso (población, número de unidades) y un nombre, agrupados
+    por nivel de zoom. Se construye una vez por instantánea (ver capas).
+    """
+
+    def __init__(self, longitud, latitud, pesos, nombres):
+        validos = ~(np.isnan(longitud) | np.isnan(latitud))
+        self.longitud = np.asarray(longitud, dtype=float)[validos]
+        self.latitud = np.asarray(latitud, dtype=float)[validos]
+        self.pesos = np.asarray(pesos, dtype=np.int64)[validos]
+        self.nombres = np.asarray(nombres, dtype=object)[validos]
+        self.x, self.y = a_mercator(self.longitud, self.latitud)
+        self.niveles = {zoom: self._agrupar(zoom) for zoom in range(ZOOM_MIN, ZOOM_PUNTOS + 1)}
+
+    def __len__(self):
+        return len(self.x)
+
+    def _agrupar(self, zoom):
+        celdas = 2 ** zoom * CELDAS_POR_MOSAICO
+        ix = np.minimum((self.x * celdas).astype(np.int64), celdas - 1)
+        iy = np.minimum((self.y * celdas).astype(np.int64), celdas - 1)
+        mosaico = (ix // CELDAS_POR_MOSAICO) * 2 ** zoom + iy // CELDAS_POR_MOSAICO
+
+        if zoom >= ZOOM_PUNTOS:
+            # Sin agrupar: cada punto va solo, ordenado por mosaico
+            orden = np.argsort(mosaico, kind='stable')
+            return NivelZoom(zoom, mosaico[orden], self.longitud[orden], self.latitud[orden],
+                             np.ones(len(orden), dtype=np.int64), self.pesos[orden], orden)
+
+        # Clave de celda ordenada primero por mosaico, luego por celda dentro del mosaico
+        celda = mosaico * CELDAS_POR_MOSAICO ** 2 + (ix % CELDAS_POR_MOSAICO) * CELDAS_POR_MOSAICO + iy % CELDAS_POR_MOSAICO
+        claves, primero, grupo, cantidad = np.unique(celda, return_index=True, return_inverse=True, return_counts=True)
+
+        # Centro de cada grupo: promedio de sus puntos
+        x = np.bincount(grupo, weights=self.x) / cantidad
+        y = np.bincount(grupo, weights=self.y) / cantidad
+        longitud, latitud = de_mercator(x, y)
+        total = np.bincount(grupo, weights=self.pesos).astype(np.int64)
+        return NivelZoom(zoom, claves // CELDAS_POR_MOSAICO ** 2, longitud, latitud, cantidad, total, primero)
+
+    def nivel(self, zoom):
+        return self.niveles[min(max(int(zoom), ZOOM_MIN), ZOOM_PUNTOS)]
+
+    def limites(self):
+        """[[sur, oeste], [norte, este]] de todos los puntos."""
+        return [[float(self.latitud.min()), float(self.longitud.min())],
+                [float(self.latitud.max()), float(self.longitud.max())]]
+
+    def _rango(self, nivel, tx, ty0, ty1):
+        # Posiciones en 'nivel' de los grupos de los mosaicos (tx, ty0..ty1)
+        base = tx * 2 ** nivel.zoom
+        inicio, fin = np.searchsorted(nivel.mosaico, [base + ty0, base + ty1 + 1])
+        return range(inicio, fin)
+
+    def elementos(self, nivel, tx, ty0, ty1):
+        """Features GeoJSON de los mosaicos (tx, ty0..ty1) de 'nivel'."""
+        return self._features(nivel, self._rango(nivel, tx, ty0, ty1))
+
+    def _features(self, nivel, posiciones):
+        # Features GeoJSON de los grupos en 'posiciones' de 'nivel'
+        elementos = []
+        for i in posiciones:
+            cantidad = int(nivel.cantidad[i])
+            propiedades = {"cantidad": cantidad, "total": int(nivel.total[i])}
+            if cantidad == 1:
+                propiedades["nombre"] = str(self.nombres[nivel.primero[i]])
+            elementos.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [float(nivel.longitud[i]), float(nivel.latitud[i])]},
+                "properties": propiedades,
+            })
+        return elementos
+
+    def mosaico(self, zoom, tx, ty):
+        """
+        FeatureCollection de un mosaico XYZ. Fuera de ZOOM_MIN..ZOOM_PUNTOS se
+        usa el nivel más cercano: debajo de ZOOM_MIN, con los mosaicos del
+        nivel que cubren el pedido; arriba de ZOOM_PUNTOS, con los puntos del
+        mosaico del nivel que caen dentro del pedido.
+        """
+        zoom = int(zoom)
+        nivel = self.nivel(zoom)
+        if zoom <= nivel.zoom:
+            lado = 2 ** (nivel.zoom - zoom)
+            elementos = []
+            for x in range(tx * lado, (tx + 1) * lado):
+                elementos += self.elementos(nivel, x, ty * lado, (ty + 1) * lado - 1)
+        else:
+            salto = zoom - nivel.zoom
+            posiciones = np.fromiter(self._rango(nivel, tx >> salto, ty >> salto, ty >> salto), dtype=np.int64)
+            # En ZOOM_PUNTOS cada grupo es un punto; 'primero' es su posición en la capa
+            puntos = nivel.primero[posiciones]
+            n = 2 ** zoom
+            dentro = ((self.x[puntos] * n).astype(np.int64) == tx) & ((self.y[puntos] * n).astype(np.int64) == ty)
+            elementos = self._features(nivel, posiciones[dentro])
+        return {"type": "FeatureCollection", "features": elementos}
+
+    def vista(self, zoom, limites=None):
+        """
+        FeatureCollection de los grupos visibles en 'limites'
+        ([[sur, oeste], [norte, este]], como Map.bounds de dash-leaflet) al
+        zoom dado. Sin límites, toda la capa.
+        """
+        if len(self) == 0:
+            return {"type": "FeatureCollection", "features": []}
+        (sur, oeste), (norte, este) = limites or self.limites()
+        nivel = self.nivel(zoom)
+        while True:
+            tx0, ty0, tx1, ty1 = mosaicos_visibles(nivel.zoom, sur, oeste, norte, este)
+            if (tx1 - tx0 + 1) * (ty1 - ty0 + 1) <= MAX_MOSAICOS or nivel.zoom == ZOOM_MIN:
+                break
+            nivel = self.niveles[nivel.zoom - 1]
+
+        elementos = []
+        for tx in range(tx0, tx1 + 1):
+            elementos += self.elementos(nivel, tx, ty0, ty1)
+        return {"type": "FeatureCollection", "features": elementos}
+
+
+def mosaicos_visibles(zoom, sur, oeste, norte, este):
+    """Rango de mosaicos (tx0, ty0, tx1, ty1) que cubre los límites al zoom dado."""
+    n = 2 ** zoom
+    x, y = a_mercator([oeste, este], [norte, sur])
+    tx0, tx1 = (int(min(max(v * n, 0), n - 1)) for v in x)
+    ty0, ty1 = (int(min(max(v * n, 0), n - 1)) for v in y)
+    return tx0, ty0, tx1, ty1
+
+
+def a_geobuf(coleccion):
+    """FeatureCollection codificada en geobuf (bytes)."""
+    return geobuf.encode(coleccion)
+
+
+def a_geobuf_base64(coleccion):
+    """geobuf en base64, como lo espera GeoJSON(format='geobuf') de dash-leaflet en 'data'."""
+    return base64.b64encode(a_geobuf(coleccion)).decode('ascii')
+
+
+# Una entrada por instantánea que puede estar viva: la predeterminada y
+# hasta MAX_ENTIDADES más
+@lru_cache(maxsize=MAX_ENTIDADES + 1)
+def capas(instantanea):
+    """
+    Capas 'localidades' (peso: población) y 'unidades' (peso: unidades HGSSA,
+    ubicadas en su localidad, Instantanea.ubicacion_unidades) de la
+    instantánea. Se construyen una vez por versión de datos; sin tabla de
+    localidades no hay capas.
+
+    Returns:
+        dict: Nombre -> CapaPuntos.
+    """
+    localidades = instantanea.localidades
+    if localidades is None:
+        return {}
+
+    poblacion = localidades.poblacion.sum(axis=(1, 2), dtype=np.int64)
+    nombres = localidades.nombre
+
+    # Cada unidad en la localidad donde está (no en todas las que atiende),
+    # con las coordenadas de la localidad
+    posiciones, unidades = [], []
+    for (mun, loc), cantidad in instantanea.ubicacion_unidades.items():
+        i = localidades.posicion_clave(mun, loc)
+        if i is not None:
+            posiciones.append(i)
+            unidades.append(cantidad)
+    posiciones = np.array(posiciones, dtype=np.int64)
+
+    return {
+        'localidades': CapaPuntos(localidades.longitud, localidades.latitud, poblacion, nombres),
+        'unidades': CapaPuntos(localidades.longitud[posiciones], localidades.latitud[posiciones],
+                               unidades, nombres[posiciones]),
+    }
+
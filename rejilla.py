@@ -0,0 +1,275 @@
+"""
+Tablas de la rejilla de datos brutos (dash-ag-grid con el modelo de filas
+'infinite'): las localidades del ITER y las unidades HGSSA del reporte.
+
+El navegador sólo pide bloques de filas (getRowsRequest: startRow, endRow,
+sortModel, filterModel); el filtro, el orden y el recorte se hacen aquí sobre
+una TablaIndexada en memoria. El orden de cada columna se calcula una vez y
+las posiciones de cada combinación de filtro y orden se guardan, así que
+desplazarse por la rejilla sólo recorta un arreglo.
+"""
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from datos import MAX_ENTIDADES
+from funciones import ENTIDAD_PREDETERMINADA, ETIQUETAS_EDAD, GRUPOS_EDAD, SEXOS
+from instrumentacion import medido
+
+# Combinaciones de filtro y orden cuyas posiciones se conservan por tabla
+MAX_CONSULTAS = 32
+
+# Columnas de cada tabla: (campo, encabezado, 'texto' | 'numero')
+COLUMNAS = {
+    'localidades': [
+        ('MUN', 'Clave mun.', 'numero'),
+        ('NOM_MUN', 'Municipio', 'texto'),
+        ('LOC', 'Clave loc.', 'numero'),
+        ('NOM_LOC', 'Localidad', 'texto'),
+        ('LATITUD', 'Latitud', 'numero'),
+        ('LONGITUD', 'Longitud', 'numero'),
+        ('POBLACION', 'Población', 'numero'),
+        ('MUJERES', 'Mujeres', 'numero'),
+        ('HOMBRES', 'Hombres', 'numero'),
+        *[(grupo, ETIQUETAS_EDAD[grupo], 'numero') for grupo in GRUPOS_EDAD],
+        ('UNIDADES', 'Unidades que la atienden', 'numero'),
+    ],
+    'unidades': [
+        ('CLUES', 'CLUES', 'texto'),
+        ('Nombre Unidad', 'Unidad', 'texto'),
+        ('Clave Municipio Loc', 'Clave mun.', 'numero'),
+        ('Nombre Municipio Loc', 'Municipio', 'texto'),
+        ('Clave Localidad', 'Clave loc.', 'numero'),
+        ('Nombre Localidad', 'Localidad', 'texto'),
+        ('Auxiliar de Salud', 'Auxiliares', 'numero'),
+        ('Tipo Casa Salud', 'Casa de salud', 'texto'),
+        ('Parteras', 'Parteras', 'numero'),
+    ],
+}
+
+
+class TablaIndexada:
+    """
+    DataFrame de sólo lectura con el orden de sus columnas precalculado
+    (bajo demanda) para responder bloques de la rejilla.
+    """
+
+    def __init__(self, df, columnas):
+        self.df = df.reset_index(drop=True)
+        self.tipos = {campo: tipo for campo, _, tipo in columnas}
+        self._ordenes = {}
+        self._minusculas = {}
+        self._consultas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.df)
+
+    def orden(self, columna, ascendente=True):
+        """Posiciones de las filas ordenadas por 'columna' (nulos al final)."""
+        clave = (columna, ascendente)
+        with self._lock:
+            orden = self._ordenes.get(clave)
+        if orden is None:
+            orden = self.df[columna].sort_values(ascending=ascendente, kind='stable',
+                                                 na_position='last').index.to_numpy()
+            with self._lock:
+                self._ordenes[clave] = orden
+        return orden
+
+    def _texto(self, columna):
+        # Columna en minúsculas para los filtros de texto (sin distinguir mayúsculas)
+        with self._lock:
+            texto = self._minusculas.get(columna)
+        if texto is None:
+            texto = self.df[columna].fillna('').astype(str).str.lower()
+            with self._lock:
+                self._minusculas[columna] = texto
+        return texto
+
+    def _condicion(self, columna, condicion):
+        # Máscara de una condición de filtro de AG Grid sobre 'columna'
+        tipo = condicion.get('type')
+        valores = self.df[columna]
+        if tipo == 'blank':
+            return valores.isna().to_numpy()
+        if tipo == 'notBlank':
+            return valores.notna().to_numpy()
+
+        if condicion.get('filterType') == 'text' or self.tipos.get(columna) == 'texto':
+            texto = self._texto(columna)
+            buscado = str(condicion.get('filter') or '').lower()
+            if tipo == 'equals':
+                return (texto == buscado).to_numpy()
+            if tipo == 'notEqual':
+                return (texto != buscado).to_numpy()
+            if tipo == 'startsWith':
+                return texto.str.startswith(buscado).to_numpy()
+            if tipo == 'endsWith':
+                return texto.str.endswith(buscado).to_numpy()
+            if tipo == 'notContains':
+                return (~texto.str.contains(buscado, regex=False)).to_numpy()
+            return texto.str.contains(buscado, regex=False).to_numpy()
+
+        valores = pd.to_numeric(valores, errors='coerce').to_numpy(dtype=float)
+        filtro, hasta = (np.nan if condicion.get(c) is None else float(condicion[c]) for c in ('filter', 'filterTo'))
+        with np.errstate(invalid='ignore'):
+            if tipo == 'notEqual':
+                return valores != filtro
+            if tipo == 'lessThan':
+                return valores < filtro
+            if tipo == 'lessThanOrEqual':
+                return valores <= filtro
+            if tipo == 'greaterThan':
+                return valores > filtro
+            if tipo == 'greaterThanOrEqual':
+                return valores >= filtro
+            if tipo == 'inRange':
+                return (valores >= filtro) & (valores <= hasta)
+            return valores == filtro
+
+    def mascara(self, filtros):
+        """Máscara booleana del filterModel de AG Grid, o None sin filtros."""
+        mascara = None
+        for columna, modelo in (filtros or {}).items():
+            if columna not in self.df.columns:
+                continue
+            # Dos condiciones: 'conditions' (AG Grid 29+) o condition1/condition2
+            condiciones = modelo.get('conditions') or [
+                modelo[c] for c in ('condition1', 'condition2') if c in modelo
+            ]
+            if condiciones:
+                partes = [self._condicion(columna, c) for c in condiciones]
+                parcial = np.logical_or.reduce(partes) if modelo.get('operator') == 'OR' else np.logical_and.reduce(partes)
+            else:
+                parcial = self._condicion(columna, modelo)
+            mascara = parcial if mascara is None else mascara & parcial
+        return mascara
+
+    def posiciones(self, filtros=None, orden=None):
+        """
+        Posiciones de las filas que pasan 'filtros', en el orden de 'orden'
+        (sortModel de AG Grid). El resultado se guarda por combinación.
+        """
+        clave = json.dumps([filtros or {}, orden or []], sort_keys=True)
+        with self._lock:
+            posiciones = self._consultas.get(clave)
+            if posiciones is not None:
+                self._consultas.move_to_end(clave)
+                return posiciones
+
+        mascara = self.mascara(filtros)
+        orden = [o for o in orden or [] if o.get('colId') in self.df.columns]
+        if len(orden) == 1:
+            # Orden precalculado de la columna, filtrado con la máscara
+            posiciones = self.orden(orden[0]['colId'], orden[0].get('sort') != 'desc')
+            if mascara is not None:
+                posiciones = posiciones[mascara[posiciones]]
+        elif orden:
+            filas = self.df if mascara is None else self.df[mascara]
+            posiciones = filas.sort_values(
+                [o['colId'] for o in orden], ascending=[o.get('sort') != 'desc' for o in orden],
+                kind='stable', na_position='last'
+            ).index.to_numpy()
+        else:
+            posiciones = np.arange(len(self.df)) if mascara is None else np.flatnonzero(mascara)
+
+        with self._lock:
+            self._consultas[clave] = posiciones
+            while len(self._consultas) > MAX_CONSULTAS:
+                self._consultas.popitem(last=False)
+        return posiciones
+
+    @medido('rejilla_bloque')
+    def bloque(self, peticion):
+        """
+        Respuesta a un getRowsRequest del modelo 'infinite': las filas
+        [startRow, endRow) con el filtro y el orden pedidos, y el total de
+        filas filtradas.
+
+        Returns:
+            dict: {'rowData': [...], 'rowCount': n}
+        """
+        posiciones = self.posiciones(peticion.get('filterModel'), peticion.get('sortModel'))
+        inicio = max(int(peticion.get('startRow') or 0), 0)
+        fin = peticion.get('endRow')
+        fin = max(inicio + 100 if fin is None else int(fin), inicio)
+        filas = self.df.iloc[posiciones[inicio:fin]]
+        # Columna por columna (tolist da tipos de Python); los nulos como None
+        # para que lleguen como null al navegador
+        columnas = {}
+        for columna in filas.columns:
+            valores = filas[columna]
+            lista = valores.tolist()
+            if valores.dtype.kind in 'fO' and valores.isna().any():
+                lista = [None if pd.isna(x) else x for x in lista]
+            columnas[columna] = lista
+        registros = [dict(zip(columnas, fila)) for fila in zip(*columnas.values())]
+        return {"rowData": registros, "rowCount": int(len(posiciones))}
+
+
+def _vacia(nombre):
+    return pd.DataFrame(columns=[campo for campo, _, _ in COLUMNAS[nombre]])
+
+
+def tabla_localidades(instantanea):
+    """
+    Una fila por localidad del ITER con su población por sexo y grupo de
+    edad. UNIDADES queda vacía en las entidades sin reporte de unidades.
+    """
+    localidades = instantanea.localidades
+    if localidades is None:
+        return _vacia('localidades')
+    nombres = {mun: nombre for nombre, mun in localidades.claves_municipio.items()}
+    por_sexo = localidades.poblacion.sum(axis=1, dtype=np.int64)
+    por_edad = localidades.poblacion.sum(axis=2, dtype=np.int64)
+    salud = instantanea.salud_localidades
+    sin_dato = 0 if salud else np.nan
+    claves = zip(localidades.mun.tolist(), localidades.loc.tolist())
+    return pd.DataFrame({
+        'MUN': localidades.mun,
+        'NOM_MUN': [nombres.get(mun) for mun in localidades.mun.tolist()],
+        'LOC': localidades.loc,
+        'NOM_LOC': localidades.nombre,
+        'LATITUD': localidades.latitud.astype(float).round(5),
+        'LONGITUD': localidades.longitud.astype(float).round(5),
+        'POBLACION': por_sexo.sum(axis=1),
+        'MUJERES': por_sexo[:, SEXOS.index('F')],
+        'HOMBRES': por_sexo[:, SEXOS.index('M')],
+        **{grupo: por_edad[:, j] for j, grupo in enumerate(GRUPOS_EDAD)},
+        'UNIDADES': [salud.get(clave, {}).get('unidades', sin_dato) for clave in claves],
+    })
+
+
+def tabla_unidades(instantanea):
+    """
+    Filas del reporte de unidades HGSSA de la instantánea (sólo existe para
+    ENTIDAD_PREDETERMINADA).
+    """
+    if instantanea.entidad != ENTIDAD_PREDETERMINADA or instantanea.unidades is None:
+        return _vacia('unidades')
+    try:
+        return instantanea.unidades[[campo for campo, _, _ in COLUMNAS['unidades']]]
+    except KeyError as e:
+        print(f"Faltan columnas en el reporte de unidades: {e}")
+        return _vacia('unidades')
+
+
+# Una entrada por instantánea viva (ver mapa.capas)
+@lru_cache(maxsize=MAX_ENTIDADES + 1)
+def tablas(instantanea):
+    """
+    Tablas indexadas 'localidades' y 'unidades' de la instantánea. Se
+    construyen una vez por versión de datos.
+
+    Returns:
+        dict: Nombre -> TablaIndexada.
+    """
+    return {
+        'localidades': TablaIndexada(tabla_localidades(instantanea), COLUMNAS['localidades']),
+        'unidades': TablaIndexada(tabla_unidades(instantanea), COLUMNAS['unidades']),
+    }
@@ -0,0 +1,12 @@
+"""
+Punto de entrada WSGI para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+gunicorn.conf.py compila los artefactos una vez en el proceso maestro; cada
+worker sólo abre con memory map las tablas municipal y de localidades ya
+compiladas.
+"""
+from app import app
+
+server = app.server